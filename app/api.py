@@ -0,0 +1,317 @@
+"""
+JSON API of the service, mounted under /api/v1.
+"""
+import asyncio
+import inspect
+import json
+
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from app.catalog import catalog
+from app.config import Configuration
+from app.executor import executor
+from app.forms.batch_classification_form import BatchClassificationForm
+from app.forms.compare_form import CompareForm
+from app.forms.similar_form import SimilarForm
+from app.jobs import FAILED, FINISHED, JobNotFound, backend
+from app.ml.options import VARIANTS
+from app.startup import lazy
+from app.tasks import TASKS
+
+conf = Configuration()
+
+classification_utils = lazy("app.ml.classification_utils")
+embeddings = lazy("app.ml.embeddings")
+ensemble = lazy("app.ml.ensemble")
+histograms = lazy("app.histogram")
+
+router = APIRouter(prefix="/api/v1")
+jobs_router = APIRouter(prefix="/jobs")
+
+
+async def classify_chunk(chunk, form):
+    """Preprocesses a chunk of images once for all the models, then
+    classifies it with each model. Yields the results of each model as
+    soon as they are ready."""
+    names, sources = zip(*chunk)
+    batches = await executor.run(classification_utils.load_batches, list(sources), form.models)
+
+    async def run_model(model_id):
+        outputs = await executor.run(
+            classification_utils.classify_batch, model_id, batches[model_id],
+            k=form.top_k, output=form.output, variant=form.variant,
+        )
+        return model_id, outputs
+
+    for task in asyncio.as_completed([run_model(m) for m in form.models]):
+        model_id, outputs = await task
+        yield [
+            {"image": name, "model": model_id, "scores": scores}
+            for name, scores in zip(names, outputs)
+        ]
+
+
+async def classify_all(form):
+    """Classifies every image of the request with every model, processing
+    at most api_concurrent_chunks chunks of api_chunk_size images at a
+    time. Yields lists of results in completion order, starting with the
+    errors of the rejected files."""
+    if form.rejected:
+        yield [{"image": name, "error": error} for name, error in form.rejected]
+    sources = [(i, i) for i in form.image_ids] + list(form.files)
+    size = conf.api_chunk_size
+    chunks = [sources[i:i + size] for i in range(0, len(sources), size)]
+    queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(conf.api_concurrent_chunks)
+
+    async def run_chunk(chunk):
+        async with semaphore:
+            async for results in classify_chunk(chunk, form):
+                await queue.put(results)
+
+    async def run_all():
+        try:
+            await asyncio.gather(*(run_chunk(c) for c in chunks))
+        except Exception as e:
+            await queue.put(e)
+        else:
+            await queue.put(None)
+
+    task = asyncio.ensure_future(run_all())
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        task.cancel()
+
+
+@router.post("/classify")
+async def classify_images(request: Request):
+    """
+    Classifies many images with many models in one call.
+
+    The request is a JSON body or a multipart form with the fields
+    `image_ids` (gallery images), `files` (uploaded images, multipart
+    only), `models`, and optionally `top_k`, `output`
+    ("percentage", "probability" or "logit"), `variant` and `stream`.
+
+    Returns:
+        The top-k classification output of every (image, model) pair,
+        as a JSON object, or as NDJSON lines streamed as soon as each
+        result is ready when `stream` is true. The uploaded files that
+        are rejected have an `error` instead.
+    """
+    form = BatchClassificationForm(request)
+    await form.load_data()
+    if not form.is_valid(catalog):
+        raise HTTPException(status_code=400, detail=form.errors)
+
+    if form.stream:
+        async def ndjson():
+            try:
+                async for results in classify_all(form):
+                    for result in results:
+                        yield json.dumps(result) + "\n"
+            except Exception as e:
+                # the status code has already been sent
+                yield json.dumps({"error": str(e)}) + "\n"
+
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    return {"results": [r async for results in classify_all(form) for r in results]}
+
+
+@router.post("/compare")
+async def compare_models(request: Request):
+    """
+    Classifies one image with several models and with their ensemble.
+
+    The request is a JSON body or a multipart form with either the
+    `image_id` of a gallery image or an uploaded `file` (multipart only),
+    and optionally `models` (all the configured ones by default),
+    `top_k` and `variant`. The image is decoded once and preprocessed
+    once per input size, and the models run concurrently.
+
+    Returns:
+        The top-k scores of each model with the latency breakdown of its
+        run, and the top-k scores of the ensemble, which averages the
+        class probabilities of the models.
+    """
+    form = CompareForm(request)
+    await form.load_data()
+    if not form.is_valid(catalog):
+        raise HTTPException(status_code=400, detail=form.errors)
+
+    result = await ensemble.compare(form.source, form.models, k=form.top_k, variant=form.variant)
+    return {"image": form.image_id or form.filename, **result}
+
+
+@router.api_route("/similar", methods=["GET", "POST"])
+async def similar_images(request: Request):
+    """
+    Finds the gallery images most similar to an image.
+
+    The image is the `image_id` of a gallery image, in the query string or
+    a JSON body, or an uploaded `file` (multipart only). Optional
+    parameters are the `model` whose embeddings are compared
+    (embedding_model by default) and `top_k`. The images added to the
+    gallery are embedded in the background and found once embedded.
+
+    Returns:
+        The most similar gallery images, the most similar first, with
+        their cosine similarity and URLs, and the state of the index.
+    """
+    form = SimilarForm(request)
+    await form.load_data()
+    if not form.is_valid(catalog):
+        raise HTTPException(status_code=400, detail=form.errors)
+    result = await embeddings.similar(form.source, form.model, form.top_k)
+    return {"image": form.image_id or form.filename, **result}
+
+
+@router.get("/images")
+def images(
+    prefix: Optional[str] = None,
+    synset: Optional[str] = None,
+    q: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """
+    Lists the gallery images, one page at a time.
+
+    Args:
+        prefix: Only the images whose name starts with prefix.
+        synset: Only the images of the Imagenet synset, e.g. n01443537.
+        q: Only the images whose name contains q.
+        offset: Index of the first image of the page.
+        limit: Maximum number of images in the page.
+
+    Returns:
+        The total number of matching images and the metadata (name, size,
+        dimensions, content digest and synset) of the images in the page.
+    """
+    total, entries = catalog.search(prefix, synset, q, offset, limit)
+    return {
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+        "images": [entry.to_dict() for entry in entries],
+    }
+
+
+@router.get("/histograms/{image_id}")
+async def histogram(image_id: str):
+    """Returns the counts of each color channel of the gallery image."""
+    if image_id not in catalog:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return await executor.run(histograms.get_histogram, image_id)
+
+
+@jobs_router.post("")
+async def create_job(request: Request):
+    """
+    Enqueues a classification, transformation or histogram job.
+
+    The request is a JSON body with the `type` of the job and its
+    `params`, e.g. `{"type": "classification", "params": {"image_id":
+    "n01443537_goldfish.JPEG", "model_id": "resnet18"}}`.
+
+    Returns:
+        JSONResponse: The id of the job and the URLs to poll it.
+    """
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail="The JSON body must be an object")
+    task = data.get("type")
+    params = data.get("params", {})
+    if not isinstance(params, dict):
+        raise HTTPException(status_code=400, detail="params must be an object")
+    if not isinstance(task, str) or task not in TASKS:
+        raise HTTPException(
+            status_code=400, detail="type must be one of {}".format(", ".join(TASKS))
+        )
+    try:
+        inspect.signature(TASKS[task]).bind(**params)
+    except TypeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if "image_id" in params and (
+        not isinstance(params["image_id"], str) or params["image_id"] not in catalog
+    ):
+        raise HTTPException(status_code=400, detail="Unknown image id")
+    if "model_id" in params and params["model_id"] not in conf.models:
+        raise HTTPException(status_code=400, detail="Unknown model id")
+    if params.get("variant") is not None and params["variant"] not in VARIANTS:
+        raise HTTPException(
+            status_code=400, detail="variant must be one of {}".format(", ".join(VARIANTS))
+        )
+
+    job_id = await run_in_threadpool(backend.enqueue, task, **params)
+    return JSONResponse(
+        status_code=202,
+        content={
+            "id": job_id,
+            "status": "queued",
+            "url": "/jobs/{}".format(job_id),
+            "events_url": "/jobs/{}/events".format(job_id),
+        },
+    )
+
+
+async def fetch_job(job_id):
+    try:
+        return await run_in_threadpool(backend.fetch, job_id)
+    except JobNotFound:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+
+@jobs_router.get("/{job_id}")
+async def get_job(job_id: str):
+    """Returns the status of the job and, once finished, its result."""
+    return await fetch_job(job_id)
+
+
+@jobs_router.get("/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    Streams the status of the job as server-sent events: a `status`
+    event at every change, then a `result` or `error` event when the
+    job is done.
+    """
+    job = await fetch_job(job_id)
+
+    async def events():
+        status = None
+        current = job
+        while True:
+            if current["status"] != status:
+                status = current["status"]
+                yield "event: status\ndata: {}\n\n".format(json.dumps(status))
+            if status == FINISHED:
+                yield "event: result\ndata: {}\n\n".format(json.dumps(current["result"]))
+                return
+            if status == FAILED:
+                yield "event: error\ndata: {}\n\n".format(json.dumps(current["error"]))
+                return
+            await asyncio.sleep(conf.job_poll_interval_s)
+            try:
+                current = await run_in_threadpool(backend.fetch, job_id)
+            except JobNotFound:
+                yield "event: error\ndata: {}\n\n".format(json.dumps("Job expired"))
+                return
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
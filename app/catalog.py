@@ -0,0 +1,199 @@
+"""
+Catalog of the gallery images. The folder is scanned once and the
+metadata of each image (size, dimensions, content digest and Imagenet
+synset) is indexed; afterwards the folder is polled and only the added,
+changed or removed files are processed. A file is considered changed
+when its size or modification time differ.
+"""
+import logging
+import os
+import re
+import threading
+
+from app.config import Configuration
+from app.utils import file_digest
+
+conf = Configuration()
+
+SYNSET_PATTERN = re.compile(r"^(n\d{8})_")
+
+
+class ImageEntry:
+    """Metadata of a gallery image. The dimensions are read from the
+    header of the image on first use."""
+
+    __slots__ = ("name", "path", "size", "mtime_ns", "_dimensions", "digest", "synset")
+
+    def __init__(self, path, name, stat):
+        self.name = name
+        self.path = path
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self._dimensions = None
+        self.digest = file_digest(path)
+        match = SYNSET_PATTERN.match(name)
+        self.synset = match.group(1) if match else None
+
+    @property
+    def dimensions(self):
+        """The width and height of the image, None if it cannot be read."""
+        if self._dimensions is None:
+            from PIL import Image
+
+            try:
+                # only the header of the image is read
+                with Image.open(self.path) as img:
+                    self._dimensions = img.size
+            except Exception:
+                self._dimensions = (None, None)
+        return self._dimensions
+
+    @property
+    def width(self):
+        return self.dimensions[0]
+
+    @property
+    def height(self):
+        return self.dimensions[1]
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "size": self.size,
+            "width": self.width,
+            "height": self.height,
+            "digest": self.digest,
+            "synset": self.synset,
+        }
+
+
+class ImageCatalog:
+    """Index of the images of a folder, kept up to date by refresh()."""
+
+    def __init__(self, folder, extensions=(".JPEG",)):
+        self.folder = folder
+        self.extensions = extensions
+        self._entries = {}
+        self._names = ()
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+
+    def refresh(self):
+        """Updates the index with the files added, changed or removed since
+        the last refresh. Every file is checked with a stat, files
+        overwritten in place included, and only the new or changed ones
+        are read again. Returns the number of changes."""
+        with self._refresh_lock:
+            found = {}
+            changes = 0
+            try:
+                with os.scandir(self.folder) as it:
+                    items = list(it)
+            except FileNotFoundError:
+                items = []
+            for item in items:
+                if not item.name.endswith(self.extensions) or not item.is_file():
+                    continue
+                stat = item.stat()
+                entry = self._entries.get(item.name)
+                if entry is None or (entry.size, entry.mtime_ns) != (
+                    stat.st_size, stat.st_mtime_ns
+                ):
+                    try:
+                        entry = ImageEntry(item.path, item.name, stat)
+                    except Exception as e:
+                        logging.warning("Skipping image {}: {}".format(item.name, e))
+                        continue
+                    changes += 1
+                found[item.name] = entry
+            changes += len(set(self._entries) - set(found))
+            with self._lock:
+                self._entries = found
+                # the names are replaced only when they change, so that
+                # users can tell whether the catalog changed
+                if changes or not self._loaded:
+                    self._names = tuple(sorted(found))
+                self._loaded = True
+            return changes
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.refresh()
+
+    def names(self):
+        """Returns the sorted names of the images."""
+        self._ensure_loaded()
+        return self._names
+
+    def get(self, name):
+        """Returns the entry of the image, or None if it does not exist."""
+        self._ensure_loaded()
+        return self._entries.get(name)
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def search(self, prefix=None, synset=None, query=None, offset=0, limit=100):
+        """Returns the number of images matching the filters and the
+        entries in the requested page. prefix matches the start of the
+        name, synset the Imagenet class and query any part of the name."""
+        self._ensure_loaded()
+        with self._lock:
+            names, entries = self._names, self._entries
+        if prefix:
+            names = [n for n in names if n.startswith(prefix)]
+        if synset:
+            names = [n for n in names if entries[n].synset == synset]
+        if query:
+            query = query.lower()
+            names = [n for n in names if query in n.lower()]
+        page = [entries[n] for n in names[offset:offset + limit]]
+        return len(names), page
+
+    @property
+    def loaded(self):
+        """Whether the folder has been indexed once."""
+        return self._loaded
+
+    def watch(self, interval):
+        """Starts a thread that indexes the folder, if it is not indexed
+        yet, then polls it every interval seconds."""
+        if self._watcher is not None:
+            return
+        self._stop.clear()
+
+        def poll():
+            try:
+                self._ensure_loaded()
+            except Exception as e:
+                logging.warning("Image catalog indexing failed: {}".format(e))
+            while not self._stop.wait(interval):
+                try:
+                    changes = self.refresh()
+                except Exception as e:
+                    logging.warning("Image catalog refresh failed: {}".format(e))
+                    continue
+                if changes:
+                    logging.info("Image catalog updated: {} changes".format(changes))
+
+        self._watcher = threading.Thread(target=poll, name="image-catalog", daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+    def stats(self):
+        return {
+            "images": len(self._entries),
+            "loaded": self._loaded,
+            "watching": self._watcher is not None,
+        }
+
+
+catalog = ImageCatalog(conf.image_folder_path)
@@ -14,3 +14,159 @@ class Configuration:
         "vgg16",
         "inception_v3",
     )
+
+    # False builds the models with random weights, e.g. for offline benchmarks
+    pretrained_weights = True
+
+    # model registry
+    # maximum resident size of the loaded models, None means unbounded
+    model_memory_budget_mb = None
+    # load every model at startup instead of on the first request
+    warmup_models = False
+
+    # optimized model variants (see app/ml/variants.py)
+    # variant served for each model when the request does not choose one,
+    # e.g. {"vgg16": "dynamic_int8"}; the default is "fp32"
+    model_variants = {}
+    variants_folder_path = os.path.join(project_root, "data/variants")
+
+    # micro-batching
+    # maximum number of images classified together by a model
+    batch_max_size = 16
+    # maximum time an image waits for its batch to fill up
+    batch_max_wait_ms = 5
+    # maximum number of images waiting in the queue of a model
+    batch_max_queue = 256
+
+    # executor for the CPU-bound work
+    # "thread" or "process"
+    executor_kind = "thread"
+    # number of workers, None means one per core
+    executor_workers = None
+    # running and queued tasks after which requests get a 503 response
+    executor_max_pending = 64
+    # torch intra-op threads, None splits the cores among workers; with
+    # the thread pool it is a process-wide setting, shared by the threads
+    torch_threads = None
+
+    # classification result cache
+    result_cache_max_entries = 4096
+    # seconds after which a cached result expires, None means never
+    result_cache_ttl_s = 3600
+    # e.g. "redis://localhost:6379/0" to share the cache among servers
+    redis_url = None
+
+    # precomputed classification outputs of the gallery images
+    data_folder_path = os.path.join(project_root, "data")
+    score_index_path = os.path.join(data_folder_path, "scores.sqlite")
+
+    # memory used to cache the resized gallery images
+    tensor_cache_max_mb = 256
+
+    # number of classes returned by a classification
+    top_k = 5
+
+    # JSON API
+    # images preprocessed and classified together by /api/v1/classify
+    api_chunk_size = 32
+    # chunks of a request processed at the same time
+    api_concurrent_chunks = 2
+
+    # job queue
+    # "local" runs the jobs in threads of the server, "rq" sends them to
+    # the workers started with `python -m app.worker` through redis_url
+    job_backend = "local"
+    job_queue_name = "isde"
+    job_result_ttl_s = 3600
+    job_local_workers = 2
+    # interval between two status checks of the server-sent events
+    job_poll_interval_s = 0.5
+
+    # histograms
+    # "json" sends the counts to the browser, which draws the chart,
+    # "png" renders the chart on the server
+    histogram_backend = "json"
+    histogram_cache_max_entries = 1024
+
+    # rendered plots kept in memory
+    plot_cache_max_entries = 256
+
+    # uploads
+    upload_max_bytes = 10 * 2 ** 20
+    upload_max_pixels = 40_000_000
+    # maximum number of files of a request
+    upload_max_files = 32
+    # formats accepted, recognized from the first bytes of the files
+    upload_formats = ("JPEG", "PNG", "GIF", "WEBP", "BMP", "TIFF")
+
+    # previews of the uploaded images
+    # SQLite database of the previews, shared by the processes of
+    # `python -m app.serve`; None keeps them in memory only
+    preview_store_path = os.path.join(data_folder_path, "previews.sqlite")
+    preview_max_entries = 256
+    preview_max_mb = 32
+    preview_ttl_s = 600
+    # maximum width and height of a preview
+    preview_size = 512
+
+    # seconds between two checks of the image folder for new images
+    catalog_poll_interval_s = 5
+
+    # downloadable classification results
+    # SQLite database of the results, None keeps them in memory only
+    results_store_path = os.path.join(data_folder_path, "results.sqlite")
+    results_max_entries = 100_000
+    results_memory_entries = 1024
+    results_ttl_s = 24 * 3600
+
+    # per-stage timing of the requests, exposed on /metrics
+    tracing_enabled = True
+    # adds a Server-Timing header with the stage timings to the responses
+    server_timing = False
+
+    # generated artifacts and gallery images served from their own URLs
+    # seconds the browsers may reuse them before revalidating
+    artifact_max_age_s = 3600
+    # gallery thumbnails shown by the select pages
+    thumbnails_folder_path = os.path.join(data_folder_path, "thumbnails")
+    thumbnail_size = 160
+
+    # multi-process serving with `python -m app.serve`
+    # number of server processes, None means one per core
+    serve_workers = None
+    # interval of the heartbeats of the workers, and time without
+    # heartbeats after which a worker is restarted
+    serve_heartbeat_interval_s = 1
+    serve_heartbeat_timeout_s = 30
+
+    # startup
+    # time the imports of the app, reported by /startup
+    startup_profile = True
+    # subsystems ("inference", "transforms", "plotting", "images") loaded
+    # in the background at startup instead of on first use; /ready
+    # answers 503 until they are loaded
+    preload_subsystems = ()
+
+    # memory-mapped pack of the gallery images, built by
+    # `python -m app.prepare_images --pack`; unused if it does not exist
+    gallery_pack_path = os.path.join(data_folder_path, "gallery.pack")
+
+    # similar images search
+    # L2-normalized penultimate features of the gallery images, one matrix
+    # per model, filled by `python -m app.precompute_embeddings`
+    embeddings_folder_path = os.path.join(data_folder_path, "embeddings")
+    # model whose embeddings are searched when the request does not choose one
+    embedding_model = "resnet18"
+    # the server embeds the images added to the gallery in the background
+    embeddings_auto_update = True
+    embeddings_batch_size = 32
+    # "exact" scores every image, "ivf" only the images of the clusters
+    # nearest to the query, from similar_ivf_min_images images on
+    similar_index = "exact"
+    similar_ivf_min_images = 10_000
+    # clusters of the ivf index, None means the square root of the images
+    similar_ivf_lists = None
+    # clusters scored by a query
+    similar_ivf_probes = 8
+    # number of similar images returned by default
+    similar_top_k = 10
@@ -0,0 +1,109 @@
+"""
+Delivery of the generated artifacts (plots, previews, thumbnails) and of
+the gallery images from their own URLs. Responses carry a strong ETag
+derived from the content hash and a Cache-Control header, so that
+browsers revalidate them with If-None-Match and get a 304 without a
+body, and single byte ranges are served with 206 for partial downloads.
+"""
+import hashlib
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from app.config import Configuration
+
+conf = Configuration()
+
+
+def make_etag(*parts):
+    """Returns a strong ETag for the content, or for the digests and
+    parameters that determine it, so that it can be checked before the
+    content is generated."""
+    sha = hashlib.sha256()
+    for part in parts:
+        sha.update(part if isinstance(part, bytes) else str(part).encode())
+        sha.update(b"\0")
+    return '"{}"'.format(sha.hexdigest()[:32])
+
+
+def cache_control(max_age=None, immutable=False, private=False):
+    """Returns the Cache-Control header of an artifact. Artifacts whose URL
+    always identifies the same content are immutable."""
+    max_age = conf.artifact_max_age_s if max_age is None else max_age
+    value = "{}, max-age={}".format("private" if private else "public", max_age)
+    return value + ", immutable" if immutable else value
+
+
+def _etag_matches(header, etag):
+    if header is None:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison
+    return etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+def not_modified(request: Request, etag, cache=None):
+    """Returns a 304 response if the client already has the content with
+    the given ETag, None otherwise."""
+    if not _etag_matches(request.headers.get("if-none-match"), etag):
+        return None
+    return Response(
+        status_code=304,
+        headers={"ETag": etag, "Cache-Control": cache or cache_control()},
+    )
+
+
+def _byte_range(header, length):
+    """Returns the (start, end) bytes of a single range header, None if
+    the header is missing, malformed or asks for several ranges, and
+    raises ValueError if the range cannot be satisfied."""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, sep, end = header[len("bytes="):].strip().partition("-")
+    if not sep or not (start or end):
+        return None
+    try:
+        if not start:
+            # suffix range, the last end bytes
+            start, end = max(0, length - int(end)), length - 1
+        else:
+            start = int(start)
+            end = min(int(end), length - 1) if end else length - 1
+    except ValueError:
+        return None
+    if start >= length or start > end:
+        raise ValueError("Unsatisfiable range")
+    return start, end
+
+
+def artifact_response(request: Request, content, media_type, etag=None, cache=None,
+                      filename=None):
+    """Returns the content with its ETag and Cache-Control headers,
+    answering with 304 if the client has it and with 206 if it asks for
+    a byte range. filename makes it an attachment."""
+    etag = etag or make_etag(content)
+    cache = cache or cache_control()
+    response = not_modified(request, etag, cache)
+    if response is not None:
+        return response
+    headers = {"ETag": etag, "Cache-Control": cache, "Accept-Ranges": "bytes"}
+    if filename:
+        headers["Content-Disposition"] = 'attachment; filename="{}"'.format(filename)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range == etag):
+        try:
+            byte_range = _byte_range(range_header, len(content))
+        except ValueError:
+            headers["Content-Range"] = "bytes */{}".format(len(content))
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = "bytes {}-{}/{}".format(start, end, len(content))
+            return Response(
+                content[start:end + 1], status_code=206, media_type=media_type,
+                headers=headers,
+            )
+    return Response(content, media_type=media_type, headers=headers)
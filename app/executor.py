@@ -0,0 +1,116 @@
+"""
+Bounded pool that runs the CPU-bound work of the service (inference,
+image transformations, plotting) outside of the asyncio event loop.
+When too many tasks are pending, new ones are rejected so that the
+server can answer with 503 instead of queueing without limits.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from app.config import Configuration
+
+
+conf = Configuration()
+
+
+class ExecutorBusy(Exception):
+    """Raised when the executor queue is full."""
+
+
+def set_torch_threads(num_threads):
+    """Sets the number of intra-op threads used by torch in the current
+    process."""
+    if num_threads:
+        import torch
+        torch.set_num_threads(num_threads)
+
+
+class BoundedExecutor:
+    """Runs functions in a thread or process pool, accepting at most
+    max_pending tasks (running or queued) at the same time.
+
+    torch_threads is set in each worker of a process pool. torch threads
+    are a process-wide setting, so for a thread pool it is set once, when
+    the pool starts, and applies to the calls of all its threads."""
+
+    def __init__(self, kind="thread", workers=None, max_pending=64, torch_threads=None):
+        if kind not in ("thread", "process"):
+            raise ValueError("Unknown executor kind {}".format(kind))
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        if torch_threads is None:
+            # splits the cores among the workers to avoid oversubscription
+            torch_threads = max(1, (os.cpu_count() or 1) // self.workers)
+        self.torch_threads = torch_threads
+        self.pending = 0
+        self.rejected = 0
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None and self.kind == "thread":
+                    set_torch_threads(self.torch_threads)
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers)
+                elif self._pool is None:
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        initializer=set_torch_threads,
+                        initargs=(self.torch_threads,),
+                    )
+        return self._pool
+
+    def _acquire(self):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise ExecutorBusy("Executor queue is full")
+            self.pending += 1
+
+    def _release(self):
+        with self._lock:
+            self.pending -= 1
+
+    async def run(self, fn, *args, **kwargs):
+        """Runs fn(*args, **kwargs) in the pool and returns its result.
+        Raises ExecutorBusy if max_pending tasks are already pending.
+        Threads run fn in the context of the caller, e.g. its trace."""
+        self._acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            call = functools.partial(fn, *args, **kwargs)
+            if self.kind == "thread":
+                call = functools.partial(contextvars.copy_context().run, call)
+            return await loop.run_in_executor(self.pool, call)
+        finally:
+            self._release()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def stats(self):
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "torch_threads": self.torch_threads,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+        }
+
+
+executor = BoundedExecutor(
+    kind=conf.executor_kind,
+    workers=conf.executor_workers,
+    max_pending=conf.executor_max_pending,
+    torch_threads=conf.torch_threads,
+)
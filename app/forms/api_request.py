@@ -0,0 +1,70 @@
+from typing import List, Optional, Tuple
+from fastapi import Request
+
+from app.startup import lazy
+
+uploads = lazy("app.uploads")
+
+
+class RequestParams:
+    """Parameters of an API request, read from a JSON object or a
+    multipart form. The query parameters are used for the ones missing
+    from the body."""
+
+    def __init__(self, body, query_params) -> None:
+        self.body = body
+        self.query_params = query_params
+
+    def get(self, name, default=None):
+        value = self.body.get(name)
+        if value is None:
+            value = self.query_params.get(name)
+        return default if value is None else value
+
+    def getlist(self, name) -> List:
+        """Returns the values of a repeated form field, or the value of
+        the JSON field, which is expected to be a list."""
+        if isinstance(self.body, dict):
+            return self.body.get(name, [])
+        return self.body.getlist(name)
+
+    def get_int(self, name, default: int) -> int:
+        """Returns the parameter as an integer, or default if it is
+        missing. Raises ValueError if it is not an integer."""
+        value = self.get(name)
+        if value is None or value == "":
+            return default
+        if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+            raise ValueError(value)
+        try:
+            return int(value)
+        except TypeError:
+            raise ValueError(value)
+
+
+async def read_request(
+    request: Request, errors: List, max_files: Optional[int] = None
+) -> Tuple[Optional[RequestParams], List]:
+    """Reads the parameters and the uploaded files of an API request. The
+    body is a JSON object or a form, whose files are validated while they
+    are received; GET requests only have query parameters. Returns None
+    for the parameters, after appending the problem to errors, if the
+    body cannot be read."""
+    content_type = request.headers.get("content-type", "")
+    if request.method == "GET":
+        return RequestParams({}, request.query_params), []
+    if content_type.startswith("application/json"):
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            errors.append("The JSON body must be an object")
+            return None, []
+        return RequestParams(body, request.query_params), []
+    try:
+        body, files = await uploads.read_form(request, max_files=max_files)
+    except uploads.UploadError as e:
+        errors.append(str(e))
+        return None, []
+    return RequestParams(body, request.query_params), files
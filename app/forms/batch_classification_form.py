@@ -0,0 +1,71 @@
+from typing import List, Optional, Tuple
+from fastapi import Request
+
+from app.config import Configuration
+from app.forms.api_request import read_request
+from app.ml.options import OUTPUTS, VARIANTS
+
+
+class BatchClassificationForm:
+    """Request of the JSON classification API. It can be sent as a JSON
+    body or as a multipart form, which also allows uploading files. The
+    files are validated while the form is received; the rejected ones
+    are kept with their error."""
+
+    def __init__(self, request: Request) -> None:
+        self.request: Request = request
+        self.errors: List = []
+        self.image_ids: List[str] = []
+        self.files: List[Tuple[str, bytes]] = []
+        self.rejected: List[Tuple[str, str]] = []
+        self.models: List[str] = []
+        self.top_k: int = Configuration.top_k
+        self.output: str = "percentage"
+        self.variant: Optional[str] = None
+        self.stream: bool = False
+
+    async def load_data(self):
+        params, files = await read_request(self.request, self.errors)
+        if params is None:
+            return
+        self.image_ids = params.getlist("image_ids")
+        self.models = params.getlist("models")
+        files = [f for f in files if f.field == "files"]
+        self.files = [(f.filename, f.data) for f in files if f.error is None]
+        self.rejected = [(f.filename, f.error) for f in files if f.error is not None]
+        try:
+            self.top_k = params.get_int("top_k", self.top_k)
+        except ValueError:
+            self.errors.append("top_k must be an integer")
+        self.output = params.get("output") or self.output
+        self.variant = params.get("variant") or None
+        self.stream = str(params.get("stream", "")).lower() in ("1", "true", "yes")
+
+    def is_valid(self, available_images):
+        if self.errors:
+            return False
+        for name in ("image_ids", "models"):
+            values = getattr(self, name)
+            if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+                self.errors.append("{} must be a list of strings".format(name))
+        if self.errors:
+            return False
+        if not self.image_ids and not self.files and not self.rejected:
+            self.errors.append("At least one image id or file is required")
+        unknown = [i for i in self.image_ids if i not in available_images]
+        if unknown:
+            self.errors.append("Unknown image ids: {}".format(", ".join(unknown)))
+        if not self.models:
+            self.errors.append("At least one model is required")
+        unknown = [m for m in self.models if m not in Configuration.models]
+        if unknown:
+            self.errors.append("Unknown models: {}".format(", ".join(unknown)))
+        if self.top_k < 1:
+            self.errors.append("top_k must be positive")
+        if self.output not in OUTPUTS:
+            self.errors.append("output must be one of {}".format(", ".join(OUTPUTS)))
+        if self.variant is not None and self.variant not in VARIANTS:
+            self.errors.append("variant must be one of {}".format(", ".join(VARIANTS)))
+        if not self.errors:
+            return True
+        return False
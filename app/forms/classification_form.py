@@ -1,6 +1,9 @@
-from typing import List
+from typing import List, Optional
 from fastapi import Request
 
+from app.config import Configuration
+from app.ml.options import VARIANTS
+
 
 class ClassificationForm:
     def __init__(self, request: Request) -> None:
@@ -8,17 +11,28 @@ class ClassificationForm:
         self.errors: List = []
         self.image_id: str
         self.model_id: str
+        self.variant: Optional[str]
 
-    async def load_data(self):
-        form = await self.request.form()
+    async def load_data(self, form=None):
+        """form is the form of the request, if its body has already
+        been read."""
+        if form is None:
+            form = await self.request.form()
         self.image_id = form.get("image_id")
         self.model_id = form.get("model_id")
+        self.variant = form.get("variant") or self.request.query_params.get("variant")
 
-    def is_valid(self):
-        if not self.image_id or not isinstance(self.image_id, str):
+    def is_valid(self, available_images=None):
+        """Checks the model and the variant, and the image id when the
+        available images are given."""
+        if available_images is not None and (
+            not isinstance(self.image_id, str) or self.image_id not in available_images
+        ):
             self.errors.append("A valid image id is required")
-        if not self.model_id or not isinstance(self.model_id, str):
+        if self.model_id not in Configuration.models:
             self.errors.append("A valid model id is required")
+        if self.variant is not None and self.variant not in VARIANTS:
+            self.errors.append("variant must be one of {}".format(", ".join(VARIANTS)))
         if not self.errors:
             return True
         return False
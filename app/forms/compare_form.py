@@ -0,0 +1,70 @@
+from typing import List, Optional
+from fastapi import Request
+
+from app.config import Configuration
+from app.forms.api_request import read_request
+from app.ml.options import VARIANTS
+
+
+class CompareForm:
+    """Request of the model comparison API: one gallery image or uploaded
+    file, and the models to compare (all the configured ones by default).
+    It can be sent as a JSON body or as a multipart form, whose file is
+    validated while it is received."""
+
+    def __init__(self, request: Request) -> None:
+        self.request: Request = request
+        self.errors: List = []
+        self.image_id: Optional[str] = None
+        self.file: Optional[bytes] = None
+        self.filename: Optional[str] = None
+        self.models: List[str] = []
+        self.top_k: int = Configuration.top_k
+        self.variant: Optional[str] = None
+
+    async def load_data(self):
+        params, files = await read_request(self.request, self.errors, max_files=1)
+        if params is None:
+            return
+        self.image_id = params.get("image_id") or None
+        self.models = params.getlist("models") or list(Configuration.models)
+        for upload in files:
+            self.filename = upload.filename
+            if upload.error is not None:
+                self.errors.append(upload.error)
+            else:
+                self.file = upload.data
+        try:
+            self.top_k = params.get_int("top_k", self.top_k)
+        except ValueError:
+            self.errors.append("top_k must be an integer")
+        self.variant = params.get("variant") or None
+
+    @property
+    def source(self):
+        """The gallery image ID or the bytes of the uploaded file."""
+        return self.file if self.file is not None else self.image_id
+
+    def is_valid(self, available_images):
+        if self.errors:
+            return False
+        if not isinstance(self.models, list) or not all(isinstance(m, str) for m in self.models):
+            self.errors.append("models must be a list of strings")
+        if self.image_id is not None and not isinstance(self.image_id, str):
+            self.errors.append("image_id must be a string")
+        if self.errors:
+            return False
+        if (self.image_id is None) == (self.file is None):
+            self.errors.append("Either an image id or a file is required")
+        elif self.image_id is not None and self.image_id not in available_images:
+            self.errors.append("Unknown image id: {}".format(self.image_id))
+        unknown = [m for m in self.models if m not in Configuration.models]
+        if unknown:
+            self.errors.append("Unknown models: {}".format(", ".join(unknown)))
+        if self.top_k < 1:
+            self.errors.append("top_k must be positive")
+        if self.variant is not None and self.variant not in VARIANTS:
+            self.errors.append("variant must be one of {}".format(", ".join(VARIANTS)))
+        if not self.errors:
+            return True
+        return False
@@ -0,0 +1,64 @@
+from typing import List, Optional
+from fastapi import Request
+
+from app.config import Configuration
+from app.forms.api_request import read_request
+
+
+class SimilarForm:
+    """Request of the similar images API: one gallery image or uploaded
+    file, the model whose embeddings are searched and the number of
+    images to return. It can be sent as a query string, a JSON body or a
+    multipart form, whose file is validated while it is received."""
+
+    def __init__(self, request: Request) -> None:
+        self.request: Request = request
+        self.errors: List = []
+        self.image_id: Optional[str] = None
+        self.file: Optional[bytes] = None
+        self.filename: Optional[str] = None
+        self.model: str = Configuration.embedding_model
+        self.top_k: int = Configuration.similar_top_k
+
+    async def load_data(self):
+        params, files = await read_request(self.request, self.errors, max_files=1)
+        if params is None:
+            return
+        for upload in files:
+            self.filename = upload.filename
+            if upload.error is not None:
+                self.errors.append(upload.error)
+            else:
+                self.file = upload.data
+        self.image_id = params.get("image_id") or None
+        self.model = params.get("model") or self.model
+        try:
+            self.top_k = params.get_int("top_k", self.top_k)
+        except ValueError:
+            self.errors.append("top_k must be an integer")
+
+    @property
+    def source(self):
+        """The gallery image ID or the bytes of the uploaded file."""
+        return self.file if self.file is not None else self.image_id
+
+    def is_valid(self, available_images):
+        if self.errors:
+            return False
+        for name in ("image_id", "model"):
+            value = getattr(self, name)
+            if value is not None and not isinstance(value, str):
+                self.errors.append("{} must be a string".format(name))
+        if self.errors:
+            return False
+        if (self.image_id is None) == (self.file is None):
+            self.errors.append("Either an image id or a file is required")
+        elif self.image_id is not None and self.image_id not in available_images:
+            self.errors.append("Unknown image id: {}".format(self.image_id))
+        if self.model not in Configuration.models:
+            self.errors.append("Unknown model: {}".format(self.model))
+        if self.top_k < 1:
+            self.errors.append("top_k must be positive")
+        if not self.errors:
+            return True
+        return False
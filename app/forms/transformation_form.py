@@ -1,6 +1,9 @@
-from typing import List
+from typing import List, Optional
 from fastapi import Request
 
+from app.config import Configuration
+from app.ml.options import VARIANTS
+
 
 class TransformationForm():
     def __init__(self, request: Request) -> None:
@@ -8,6 +11,7 @@ class TransformationForm():
         self.errors: List = []
         self.image_id: str
         self.model_id: str
+        self.variant: Optional[str]
         self.color: float
         self.brightness: float
         self.sharpness: float
@@ -17,16 +21,25 @@ class TransformationForm():
         form = await self.request.form()
         self.image_id = form.get("image_id")
         self.model_id = form.get("model_id")
-        self.color = float(form.get("color"))
-        self.brightness = float(form.get("brightness"))
-        self.sharpness = float(form.get("sharpness"))
-        self.contrast = float(form.get("contrast"))
+        self.variant = form.get("variant") or self.request.query_params.get("variant")
+        for name in ("color", "brightness", "sharpness", "contrast"):
+            try:
+                setattr(self, name, float(form.get(name)))
+            except (TypeError, ValueError):
+                setattr(self, name, None)
+                self.errors.append("{} must be a number".format(name))
 
-    def is_valid(self):
-        if not self.image_id or not isinstance(self.image_id, str):
+    def is_valid(self, available_images=None):
+        """Checks the model, the variant and the factors, and the image id
+        when the available images are given."""
+        if available_images is not None and (
+            not isinstance(self.image_id, str) or self.image_id not in available_images
+        ):
             self.errors.append("A valid image id is required")
-        if not self.model_id or not isinstance(self.model_id, str):
+        if self.model_id not in Configuration.models:
             self.errors.append("A valid model id is required")
+        if self.variant is not None and self.variant not in VARIANTS:
+            self.errors.append("variant must be one of {}".format(", ".join(VARIANTS)))
         if not self.errors:
             return True
         return False
@@ -0,0 +1,272 @@
+"""
+Memory-mapped pack of the gallery images, built by
+`python -m app.prepare_images --pack`. A single file holds the original
+JPEG bytes of every image and its resized and center-cropped uint8
+array for each input size of the models, so that serving a gallery
+image needs neither opening its file nor decoding it. Lookups return
+slices of the mapping, without copies, and the pages are shared by all
+the processes reading the pack.
+
+Layout of the file, where the sections start at multiples of ALIGN:
+
+    MAGIC | header length (uint64) | JSON header
+    jpeg offsets: int64[N + 1], the bytes of image i are data[off[i]:off[i + 1]]
+    jpeg data
+    for each (resize, crop) input size: uint8[N, 3, crop, crop]
+
+The header lists the names, content digests and dimensions of the
+images, the input sizes and the offsets of the sections. An image of
+the pack is used only if its digest matches the one of the gallery
+image in the catalog, so a stale pack never serves outdated images.
+The pack is checked against the catalog once each time either changes,
+so that lookups use the stored digests without touching the image
+files.
+"""
+import io
+import json
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+from app.catalog import catalog
+from app.config import Configuration
+from app.utils import file_digest
+
+conf = Configuration()
+
+MAGIC = b"GALPACK1"
+VERSION = 1
+ALIGN = 4096
+# minimum time between two checks of the pack file for a rebuild
+CHECK_INTERVAL_S = 1
+
+
+def _align(offset):
+    return -(-offset // ALIGN) * ALIGN
+
+
+def _size_key(size):
+    return "{}x{}".format(*size)
+
+
+def build_pack(folder, path, image_ids, input_sizes):
+    """Writes the pack of the images image_ids of folder to path, with
+    their arrays for each (resize, crop) of input_sizes. The pack is
+    written to a temporary file, which then replaces path."""
+    from PIL import Image
+    from app.ml.preprocessing import Preprocessor
+
+    image_ids = sorted(image_ids)
+    input_sizes = sorted({tuple(size) for size in input_sizes})
+    paths = [os.path.join(folder, image_id) for image_id in image_ids]
+    jpeg_sizes = [os.path.getsize(p) for p in paths]
+    dimensions = []
+    for p in paths:
+        with Image.open(p) as img:
+            dimensions.append(img.size)
+
+    count = len(image_ids)
+    header = {
+        "version": VERSION,
+        "names": image_ids,
+        "digests": [file_digest(p) for p in paths],
+        "dimensions": dimensions,
+        "input_sizes": input_sizes,
+        "sections": {},
+    }
+    # the header length depends on the offsets, which depend on the header
+    # length: reserve room for the offsets, then compute them
+    sections = {"jpeg_offsets": 0, "jpeg_data": 0}
+    sections.update({_size_key(size): 0 for size in input_sizes})
+    header["sections"] = {name: 2 ** 62 for name in sections}
+    start = _align(len(MAGIC) + 8 + len(json.dumps(header).encode()))
+    sections["jpeg_offsets"] = start
+    sections["jpeg_data"] = _align(start + 8 * (count + 1))
+    offset = _align(sections["jpeg_data"] + sum(jpeg_sizes))
+    for resize, crop in input_sizes:
+        sections[_size_key((resize, crop))] = offset
+        offset = _align(offset + count * 3 * crop * crop)
+    header["sections"] = sections
+    encoded = json.dumps(header).encode()
+
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(encoded)) + encoded)
+        f.truncate(offset)
+    data = np.memmap(tmp_path, dtype=np.uint8, mode="r+")
+    jpeg_offsets = np.concatenate([[0], np.cumsum(jpeg_sizes)]).astype("<i8")
+    data[start:start + jpeg_offsets.nbytes] = jpeg_offsets.view(np.uint8)
+    arrays = {}
+    for resize, crop in input_sizes:
+        section = sections[_size_key((resize, crop))]
+        arrays[crop] = data[section:section + count * 3 * crop * crop].reshape(
+            count, 3, crop, crop
+        )
+    # only the crops are computed, the cache is not used
+    preprocessor = Preprocessor(0)
+    for i, p in enumerate(paths):
+        with open(p, "rb") as f:
+            content = f.read()
+        base = sections["jpeg_data"] + jpeg_offsets[i]
+        data[base:base + len(content)] = np.frombuffer(content, dtype=np.uint8)
+        with Image.open(io.BytesIO(content)) as img:
+            for crop, tensor in preprocessor.crop_sizes(img, input_sizes).items():
+                arrays[crop][i] = tensor.numpy()
+    data.flush()
+    del data, arrays
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    os.replace(tmp_path, path)
+    return count
+
+
+class GalleryPack:
+    """Read-only view of a gallery pack. The arrays are mapped copy-on-write,
+    so that they can be wrapped by tensors without copies."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("{} is not a gallery pack".format(path))
+            (length,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(length))
+        if header["version"] != VERSION:
+            raise ValueError("Unsupported gallery pack version {}".format(header["version"]))
+        self.names = header["names"]
+        self.digests = header["digests"]
+        self.dimensions = header["dimensions"]
+        self._index = {name: i for i, name in enumerate(self.names)}
+        # positions of the images matching the catalog, and the catalog
+        # names they were computed for
+        self._valid = frozenset()
+        self._validated_names = None
+        self._valid_lock = threading.Lock()
+        sections = header["sections"]
+        count = len(self.names)
+
+        self._data = np.memmap(path, dtype=np.uint8, mode="c")
+        start = sections["jpeg_offsets"]
+        self._jpeg_offsets = self._data[start:start + 8 * (count + 1)].view("<i8")
+        self._jpeg_data = sections["jpeg_data"]
+        self._arrays = {}
+        for resize, crop in header["input_sizes"]:
+            start = sections[_size_key((resize, crop))]
+            self._arrays[(resize, crop)] = self._data[
+                start:start + count * 3 * crop * crop
+            ].reshape(count, 3, crop, crop)
+
+    def __len__(self):
+        return len(self.names)
+
+    def lookup(self, name, digest=None):
+        """Returns the position of the image in the pack, or None if the
+        pack does not have it or has a different content for it."""
+        i = self._index.get(name)
+        if i is None or (digest is not None and self.digests[i] != digest):
+            return None
+        return i
+
+    def find(self, name):
+        """Returns the position of the image in the pack if its content is
+        the one of the gallery image in the catalog, None otherwise."""
+        names = catalog.names()
+        if names is not self._validated_names:
+            self._validate(names)
+        i = self._index.get(name)
+        return i if i in self._valid else None
+
+    def _validate(self, names):
+        with self._valid_lock:
+            if names is self._validated_names:
+                return
+            valid = set()
+            for name in names:
+                i = self._index.get(name)
+                entry = catalog.get(name)
+                if i is not None and entry is not None and entry.digest == self.digests[i]:
+                    valid.add(i)
+            self._valid = frozenset(valid)
+            self._validated_names = names
+
+    def jpeg(self, i):
+        """Returns the JPEG bytes of the image i, as a memoryview of the pack."""
+        start = self._jpeg_data + int(self._jpeg_offsets[i])
+        end = self._jpeg_data + int(self._jpeg_offsets[i + 1])
+        return memoryview(self._data[start:end])
+
+    def array(self, i, size):
+        """Returns the (3, crop, crop) uint8 array of the image i for the
+        (resize, crop) input size, a view of the pack, or None if the pack
+        does not have this input size."""
+        arrays = self._arrays.get(tuple(size))
+        return None if arrays is None else arrays[i]
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "images": len(self),
+            "valid_images": len(self._valid),
+            "input_sizes": [list(size) for size in self._arrays],
+            "bytes": self._data.nbytes,
+        }
+
+
+_pack = None
+_pack_signature = None
+_pack_checked_at = None
+_pack_lock = threading.Lock()
+
+
+def get_pack():
+    """Returns the gallery pack of the configuration, or None if it has not
+    been built. The file is checked at most every CHECK_INTERVAL_S
+    seconds, and the pack is opened again when it is rebuilt."""
+    global _pack, _pack_signature, _pack_checked_at
+    now = time.monotonic()
+    if _pack_checked_at is not None and now - _pack_checked_at < CHECK_INTERVAL_S:
+        return _pack
+    with _pack_lock:
+        try:
+            stat = os.stat(conf.gallery_pack_path)
+        except FileNotFoundError:
+            _pack, _pack_signature = None, None
+        else:
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if signature != _pack_signature:
+                _pack = GalleryPack(conf.gallery_pack_path)
+                _pack_signature = signature
+        _pack_checked_at = now
+        return _pack
+
+
+def _position(pack, image_id, digest=None):
+    if digest is not None:
+        return pack.lookup(image_id, digest)
+    return pack.find(image_id)
+
+
+def pack_array(image_id, size, digest=None):
+    """Returns the uint8 array of the gallery image for the (resize, crop)
+    input size from the pack, without copy, or None if it is not there.
+    The image must have the given digest, or the one in the catalog."""
+    pack = get_pack()
+    if pack is None:
+        return None
+    i = _position(pack, image_id, digest)
+    return None if i is None else pack.array(i, size)
+
+
+def open_image(image_id, digest=None):
+    """Opens the gallery image, from the pack if it has it and from its
+    file otherwise."""
+    from PIL import Image
+
+    pack = get_pack()
+    if pack is not None:
+        i = _position(pack, image_id, digest)
+        if i is not None:
+            return Image.open(io.BytesIO(pack.jpeg(i)))
+    return Image.open(os.path.join(conf.image_folder_path, image_id))
@@ -0,0 +1,53 @@
+"""
+Color histograms of the images. The counts of all the channels are
+computed in one pass by PIL, without splitting the channels, and cached
+by image content. RGB and 8-bit grayscale images are counted as they
+are; the other modes are first converted to a copy in RGB or L, which
+clips the values of 16-bit and float grayscale images to 0-255.
+"""
+import numpy as np
+
+from app.config import Configuration
+from app.gallery_pack import open_image
+from app.ml.result_cache import LRUCache
+from app.tracing import stage
+from app.utils import image_digest
+
+conf = Configuration()
+
+RGB_CHANNELS = ("red", "green", "blue")
+
+histogram_cache = LRUCache(conf.histogram_cache_max_entries)
+
+
+def compute_histogram(img):
+    """Returns the channel names and a (channels, 256) array with the
+    histogram of each channel. Grayscale images have a single "gray"
+    channel; the alpha channel is ignored and palette images are
+    histogrammed on their colors."""
+    if img.mode in ("1", "L", "I", "I;16", "F"):
+        img = img.convert("L")
+        channels = ("gray",)
+    else:
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        channels = RGB_CHANNELS
+    counts = np.asarray(img.histogram(), dtype=np.int64).reshape(len(channels), 256)
+    return channels, counts
+
+
+def get_histogram(image_id):
+    """Returns the histogram of the image with the specified ID as a
+    JSON-serializable dictionary, with the counts of each channel."""
+    digest = image_digest(image_id)
+    histogram = histogram_cache.get(digest)
+    if histogram is None:
+        with stage("histogram"), open_image(image_id, digest) as img:
+            channels, counts = compute_histogram(img)
+        histogram = {
+            "image_id": image_id,
+            "channels": list(channels),
+            "counts": counts.tolist(),
+        }
+        histogram_cache.set(digest, histogram)
+    return histogram
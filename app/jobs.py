@@ -0,0 +1,107 @@
+"""
+Asynchronous job queue. Jobs are run by rq workers through Redis, or
+by an in-process pool of threads when no Redis server is available
+(e.g. during development and tests).
+"""
+import threading
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from app.config import Configuration
+from app.tasks import TASKS
+
+conf = Configuration()
+
+# statuses of the jobs, as named by rq
+QUEUED, STARTED, FINISHED, FAILED = "queued", "started", "finished", "failed"
+
+
+class JobNotFound(Exception):
+    """Raised when the job does not exist or has expired."""
+
+
+class LocalBackend:
+    """Runs the jobs in a pool of threads of the web server, keeping the
+    last max_jobs jobs in memory."""
+
+    def __init__(self, workers=2, max_jobs=1000):
+        self.max_jobs = max_jobs
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def enqueue(self, task, **params):
+        job_id = uuid.uuid4().hex
+        job = {"id": job_id, "task": task, "status": QUEUED, "result": None, "error": None}
+        with self._lock:
+            self._jobs[job_id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+        self._pool.submit(self._run, job, params)
+        return job_id
+
+    def _run(self, job, params):
+        job["status"] = STARTED
+        try:
+            job["result"] = TASKS[job["task"]](**params)
+            job["status"] = FINISHED
+        except Exception:
+            job["error"] = traceback.format_exc()
+            job["status"] = FAILED
+
+    def fetch(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            raise JobNotFound(job_id)
+        return dict(job)
+
+
+class RQBackend:
+    """Enqueues the jobs in an rq queue, run by `python -m app.worker`."""
+
+    def __init__(self, connection, queue_name="default", result_ttl=3600, is_async=True):
+        from rq import Queue
+        self.queue = Queue(queue_name, connection=connection, is_async=is_async)
+        self.result_ttl = result_ttl
+
+    def enqueue(self, task, **params):
+        job = self.queue.enqueue(
+            TASKS[task], kwargs=params, result_ttl=self.result_ttl, meta={"task": task}
+        )
+        return job.id
+
+    def fetch(self, job_id):
+        from rq.exceptions import NoSuchJobError
+        from rq.job import Job
+        try:
+            job = Job.fetch(job_id, connection=self.queue.connection)
+        except NoSuchJobError:
+            raise JobNotFound(job_id)
+        status = job.get_status()
+        status = getattr(status, "value", status)
+        result = job.latest_result() if status in (FINISHED, FAILED) else None
+        return {
+            "id": job.id,
+            "task": job.meta.get("task"),
+            "status": status,
+            "result": result.return_value if status == FINISHED and result else None,
+            "error": result.exc_string if status == FAILED and result else None,
+        }
+
+
+def create_backend():
+    """Returns the backend set in the configuration."""
+    if conf.job_backend == "rq":
+        from redis import Redis
+        return RQBackend(
+            Redis.from_url(conf.redis_url or "redis://localhost:6379/0"),
+            queue_name=conf.job_queue_name,
+            result_ttl=conf.job_result_ttl_s,
+        )
+    return LocalBackend(workers=conf.job_local_workers)
+
+
+backend = create_backend()
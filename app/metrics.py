@@ -0,0 +1,99 @@
+"""
+Lightweight metrics collected by the service, reported by the `/stats`
+endpoint and exposed in the Prometheus text format on `/metrics`.
+"""
+import bisect
+import threading
+
+
+class Histogram:
+    """Counts observations in cumulative buckets, like a Prometheus
+    histogram. Buckets are given as sorted upper bounds."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[idx] += 1
+            self._sum += value
+
+    def snapshot(self):
+        """Returns the cumulative count of each bucket, together with
+        the total count and the sum of the observed values."""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = {}
+        running = 0
+        for bound, count in zip(self.buckets, counts):
+            running += count
+            cumulative[str(bound)] = running
+        cumulative["+Inf"] = running + counts[-1]
+        return {"buckets": cumulative, "count": running + counts[-1], "sum": total}
+
+    def samples(self):
+        """Yields the label values and the snapshot of the histogram."""
+        yield (), self.snapshot()
+
+
+class LabeledHistogram:
+    """Family of histograms with the same buckets, one for each
+    combination of the values of labelnames."""
+
+    def __init__(self, labelnames, buckets):
+        self.labelnames = tuple(labelnames)
+        self.buckets = buckets
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """Returns the histogram of the given label values."""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, Histogram(self.buckets))
+        return child
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            yield tuple(zip(self.labelnames, values)), child.snapshot()
+
+
+# metrics exposed on /metrics, as (name, help, metric) tuples
+REGISTRY = []
+
+
+def register(name, documentation, metric):
+    """Exposes the histogram (labeled or not) on /metrics under name."""
+    REGISTRY.append((name, documentation, metric))
+    return metric
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, _escape(v)) for k, v in labels) + "}"
+
+
+def exposition():
+    """Returns the registered metrics in the Prometheus text format."""
+    lines = []
+    for name, documentation, metric in REGISTRY:
+        lines.append("# HELP {} {}".format(name, documentation))
+        lines.append("# TYPE {} histogram".format(name))
+        for labels, snapshot in metric.samples():
+            for bound, count in snapshot["buckets"].items():
+                le = _format_labels(labels + (("le", bound),))
+                lines.append("{}_bucket{} {}".format(name, le, count))
+            lines.append("{}_sum{} {}".format(name, _format_labels(labels), snapshot["sum"]))
+            lines.append("{}_count{} {}".format(name, _format_labels(labels), snapshot["count"]))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,140 @@
+"""
+Dynamic micro-batching of the classification requests. Preprocessed
+images are queued per model and fed to the model together, either when
+the batch is full or when the oldest image has waited long enough.
+"""
+import asyncio
+import time
+
+import torch
+
+from app.config import Configuration
+from app.executor import ExecutorBusy, executor
+from app.metrics import Histogram, register
+from app.ml.classification_utils import classify_batch
+from app.ml.options import VARIANTS
+from app.tracing import collect, current
+
+
+conf = Configuration()
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+QUEUE_WAIT_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class BatchScheduler:
+    """Collects the images sent to each model and classifies them in
+    batches of at most max_batch_size, waiting at most max_wait_ms
+    for a batch to fill up. At most max_queue images can wait for
+    each model, further ones are rejected with ExecutorBusy. Queues are
+    only created for the given models and the known variants."""
+
+    def __init__(self, max_batch_size, max_wait_ms, max_queue=None, classify=classify_batch,
+                 models=conf.models):
+        self.models = tuple(models)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self.classify_fn = classify
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_waits = Histogram(QUEUE_WAIT_BUCKETS_MS)
+        self._loop = None
+        self._queues = {}
+        self._workers = {}
+
+    async def classify(self, model_id, tensor, variant="fp32"):
+        """Queues the preprocessed image (without batch dimension) and
+        returns its top-k classification output once its batch is done.
+        Each variant of a model has its own queue."""
+        if model_id not in self.models:
+            raise ValueError("Unknown model {}".format(model_id))
+        if variant not in VARIANTS:
+            raise ValueError("Unknown model variant {}".format(variant))
+        loop = asyncio.get_running_loop()
+        queue = self._queue((model_id, variant))
+        if self.max_queue is not None and queue.qsize() >= self.max_queue:
+            raise ExecutorBusy("Queue of model {} is full".format(model_id))
+        future = loop.create_future()
+        await queue.put((tensor, future, time.perf_counter(), current()))
+        return await future
+
+    def _queue(self, key):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # queues and workers are bound to the loop that created them
+            self._loop = loop
+            self._queues = {}
+            self._workers = {}
+        if key not in self._queues:
+            self._queues[key] = asyncio.Queue()
+            self._workers[key] = loop.create_task(self._worker(*key, self._queues[key]))
+        return self._queues[key]
+
+    async def _collect(self, queue):
+        """Waits for the first item, then gathers the next ones until the
+        batch is full or the maximum wait time is over."""
+        loop = asyncio.get_running_loop()
+        items = [await queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(items) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # requests cancelled while queued are not classified
+        return [item for item in items if not item[1].done()]
+
+    async def _worker(self, model_id, variant, queue):
+        while True:
+            items = await self._collect(queue)
+            if not items:
+                continue
+            now = time.perf_counter()
+            for _, _, queued_at, trace in items:
+                self.queue_waits.observe((now - queued_at) * 1000)
+                if trace is not None:
+                    trace.add("queue", now - queued_at, model_id)
+            self.batch_sizes.observe(len(items))
+
+            try:
+                # a mismatched tensor fails its batch, not the worker
+                batch = torch.stack([item[0] for item in items])
+                with collect() as batch_trace:
+                    results = await executor.run(
+                        self.classify_fn, model_id, batch, variant=variant
+                    )
+            except Exception as e:
+                for _, future, _, _ in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future, _, trace), result in zip(items, results):
+                # the stages of the batch are part of each of its requests
+                if trace is not None:
+                    for name, seconds in batch_trace.timings:
+                        trace.add(name, seconds, model_id)
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self):
+        """Returns the batch size and queue wait (in ms) histograms."""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_wait_ms": self.queue_waits.snapshot(),
+        }
+
+
+scheduler = BatchScheduler(
+    conf.batch_max_size, conf.batch_max_wait_ms, max_queue=conf.batch_max_queue
+)
+register("isde_batch_size", "Number of images classified together.", scheduler.batch_sizes)
+register(
+    "isde_batch_queue_wait_ms",
+    "Time the images wait in the queue before their batch starts, in ms.",
+    scheduler.queue_waits,
+)
@@ -1,16 +1,18 @@
 """
 This is a simple classification service. It accepts an url of an
-image and returns the top-5 classification labels and scores.
+image and returns the top-k classification labels and scores.
 """
-import importlib
-import json
-import logging
-import os
+import io
 import torch
 from PIL import Image
-from torchvision import transforms
 
 from app.config import Configuration
+from app.gallery_pack import open_image, pack_array
+from app.ml.model_registry import registry
+from app.ml.postprocessing import postprocessor
+from app.ml.preprocessing import input_size, normalize, preprocessor
+from app.tracing import stage
+from app.utils import image_digest
 
 
 conf = Configuration()
@@ -18,68 +20,123 @@ conf = Configuration()
 
 def fetch_image(image_id):
     """Gets the image from the specified ID. It returns only images
-    downloaded in the folder specified in the configuration object."""
-    image_path = os.path.join(conf.image_folder_path, image_id)
-    img = Image.open(image_path)
-    return img
+    downloaded in the folder specified in the configuration object,
+    read from the gallery pack when it has them."""
+    return open_image(image_id)
+
+
+def pack_crop(img_id, model_id=None):
+    """Returns the resized and cropped image corresponding to img_id as a
+    uint8 tensor from the gallery pack, without copy, or None if the pack
+    does not have it."""
+    array = pack_array(img_id, input_size(model_id))
+    return None if array is None else torch.from_numpy(array)
 
 
 def get_labels():
-    """Returns the labels of Imagenet dataset as a list, where
-    the index of the list corresponds to the output class."""
-    labels_path = os.path.join(conf.image_folder_path, "imagenet_labels.json")
-    with open(labels_path) as f:
-        labels = json.load(f)
-    return labels
-
-
-def get_model(model_id):
-    """Imports a pretrained model from the ones that are specified in
-    the configuration file. This is needed as we want to pre-download the
-    specified model in order to avoid unnecessary waits for the user."""
-    if model_id in conf.models:
-        try:
-            module = importlib.import_module("torchvision.models")
-            return module.__getattribute__(model_id)(weights="DEFAULT")
-        except ImportError:
-            logging.error("Model {} not found".format(model_id))
-    else:
-        raise ImportError
-
-
-def classify_image(model_id, img_id):
-    """Returns the top-5 classification score output from the
-    model specified in model_id when it is fed with the
-    image corresponding to img_id."""
-    img = fetch_image(img_id)
-    model = get_model(model_id)
-    model.eval()
-    transform = transforms.Compose(
-        (
-            transforms.Resize(256),
-            transforms.CenterCrop(224),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-        )
+    """Returns the labels of Imagenet dataset as a tuple, where
+    the index of the tuple corresponds to the output class."""
+    return postprocessor.labels
+
+
+def get_model(model_id, variant=None):
+    """Returns a pretrained model from the ones that are specified in
+    the configuration file. Models are loaded once by the registry and
+    then reused, in order to avoid unnecessary waits for the user.
+    variant selects an optimized version of the model, see app.ml.variants."""
+    with stage("model", model_id):
+        return registry.get(model_id, variant)
+
+
+def preprocess(img, model_id=None, draft=False):
+    """Resizes, crops and normalizes the image for the model specified
+    in model_id and returns the tensor, without the batch dimension."""
+    return preprocessor(img, model_id, draft)
+
+
+def load_tensor(img_id, model_id=None, cache=True, draft=False):
+    """Returns the preprocessed tensor of the image corresponding to img_id.
+    With cache, the resized image is kept in memory for the next requests."""
+    with stage("preprocess", model_id):
+        cropped = pack_crop(img_id, model_id)
+        if cropped is not None:
+            return normalize(cropped)
+        if cache:
+            return preprocessor.cached(
+                image_digest(img_id), lambda: fetch_image(img_id), model_id
+            )
+        with fetch_image(img_id) as img:
+            return preprocess(img, model_id, draft)
+
+
+def load_upload(source, model_id=None):
+    """Returns the preprocessed tensor of an uploaded image, given as
+    bytes or as the image already decoded by uploads.decode_upload. JPEG
+    images are downscaled while decoding."""
+    if not isinstance(source, bytes):
+        with stage("preprocess", model_id):
+            return preprocess(source, model_id)
+    with stage("preprocess", model_id), Image.open(io.BytesIO(source)) as img:
+        return preprocess(img, model_id, draft=True)
+
+
+def load_crop(img_id, model_id=None):
+    """Returns the resized and cropped image corresponding to img_id as a
+    uint8 tensor, before normalization. It is kept in the tensor cache,
+    unless it is read from the gallery pack."""
+    cropped = pack_crop(img_id, model_id)
+    if cropped is not None:
+        return cropped
+    crop = preprocessor.cached_crops(
+        image_digest(img_id), lambda: fetch_image(img_id), [model_id]
+    )
+    return next(iter(crop.values()))
+
+
+def load_tensors(source, model_ids):
+    """Returns the preprocessed tensors of an image for each model. source
+    is either a gallery image ID or the bytes of an uploaded image. The
+    image is decoded once, and gallery images are cached."""
+    if isinstance(source, bytes):
+        with Image.open(io.BytesIO(source)) as img:
+            return preprocessor.many(img, model_ids, draft=True)
+    crops = {input_size(m)[1]: pack_crop(source, m) for m in model_ids}
+    if all(cropped is not None for cropped in crops.values()):
+        normalized = {crop: normalize(cropped) for crop, cropped in crops.items()}
+        return {m: normalized[input_size(m)[1]] for m in model_ids}
+    return preprocessor.cached_many(
+        image_digest(source), lambda: fetch_image(source), model_ids
     )
 
-    # apply transform from torchvision
-    img = img.convert("RGB")
-    preprocessed = transform(img).unsqueeze(0)
 
-    # gets the output from the model
-    out = model(preprocessed)
-    _, indices = torch.sort(out, descending=True)
+def load_batches(sources, model_ids):
+    """Preprocesses the images for each model and returns, for each
+    model, the batch of the preprocessed images."""
+    tensors = [load_tensors(source, model_ids) for source in sources]
+    return {m: torch.stack([t[m] for t in tensors]) for m in model_ids}
 
-    # transforms scores as percentages
-    percentage = torch.nn.functional.softmax(out, dim=1)[0] * 100
 
-    # gets the labels
-    labels = get_labels()
+def predict(model_id, batch, variant=None):
+    """Returns the logits of the model specified in model_id for the
+    batch of preprocessed images."""
+    model = get_model(model_id, variant)
+    with stage("forward", model_id), torch.inference_mode():
+        return model(batch)
 
-    # takes the top-5 classification output and returns it
-    # as a list of tuples (label_name, score)
-    output = [[labels[idx], percentage[idx].item()] for idx in indices[0][:5]]
 
-    img.close()
-    return output
+def classify_batch(model_id, batch, k=None, output="percentage", variant=None):
+    """Feeds the batch of preprocessed images to the model specified in
+    model_id and returns, for each image, the top-k classification
+    output as a list of [label_name, score] pairs. Scores are
+    percentages by default, see app.ml.postprocessing.OUTPUTS."""
+    logits = predict(model_id, batch, variant)
+    with stage("labels", model_id):
+        return postprocessor(logits, k, output)
+
+
+def classify_image(model_id, img_id, variant=None, cache=True):
+    """Returns the top-k classification score output from the
+    model specified in model_id when it is fed with the
+    image corresponding to img_id."""
+    preprocessed = load_tensor(img_id, model_id, cache=cache).unsqueeze(0)
+    return classify_batch(model_id, preprocessed, variant=variant)[0]
@@ -0,0 +1,425 @@
+"""
+Embeddings of the images and search of the most similar gallery images.
+The embedding of an image is the output of the penultimate layer of a
+classification model, L2-normalized, so that the dot product of two
+embeddings is their cosine similarity.
+
+The embeddings of the gallery images are stored for each model in
+embeddings_folder_path: a float32 matrix with one row per embedded image
+(<model>.f32), which is only appended to, and the names and content
+digests of its rows (<model>.json). A row is used as long as the content
+of its image is unchanged, so the images added to or changed in the
+gallery are embedded incrementally, by `python -m app.precompute_embeddings`
+or in the background by the server.
+
+A query scores every row with one matrix-vector product or, with the
+"ivf" index, only the rows of the clusters nearest to the query.
+"""
+import asyncio
+import contextlib
+import copy
+import fcntl
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+import numpy as np
+import torch
+from starlette.concurrency import run_in_threadpool
+
+from app.catalog import catalog
+from app.config import Configuration
+from app.executor import ExecutorBusy, executor
+from app.ml.classification_utils import get_model, load_tensor, load_upload
+from app.tracing import stage
+
+conf = Configuration()
+
+
+def _last_linear(model):
+    """Returns the name of the last linear layer of the model."""
+    name = None
+    for module_name, module in model.named_modules():
+        if isinstance(module, torch.nn.Linear):
+            name = module_name
+    if name is None:
+        raise ValueError("The model has no linear layer")
+    return name
+
+
+def _replace(module, path, replacement):
+    """Returns a shallow copy of module where the submodule at path is
+    replaced; the other submodules and the weights are shared."""
+    clone = copy.copy(module)
+    clone._modules = module._modules.copy()
+    head, _, rest = path.partition(".")
+    clone._modules[head] = (
+        _replace(module._modules[head], rest, replacement) if rest else replacement
+    )
+    return clone
+
+
+def feature_model(model_id):
+    """Returns the model without its last linear layer, which outputs the
+    penultimate features. It shares the weights of the fp32 model held by
+    the registry."""
+    model = get_model(model_id, "fp32")
+    return _replace(model, _last_linear(model), torch.nn.Identity())
+
+
+def embed_batch(model_id, batch):
+    """Returns the embeddings of the batch of preprocessed images as a
+    float32 array, one row per image."""
+    model = feature_model(model_id)
+    with stage("forward", model_id), torch.inference_mode():
+        features = torch.flatten(model(batch), 1)
+    return torch.nn.functional.normalize(features, dim=1).numpy()
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    """Holds an exclusive lock on path among the processes."""
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class EmbeddingStore:
+    """On-disk matrix of the embeddings of the gallery images computed by
+    a model. The matrix is memory-mapped, and mapped again when another
+    process appends to it."""
+
+    def __init__(self, folder, model_id):
+        self.folder = folder
+        self.model_id = model_id
+        self.matrix_path = os.path.join(folder, "{}.f32".format(model_id))
+        self.meta_path = os.path.join(folder, "{}.json".format(model_id))
+        self.names = []
+        self.digests = []
+        self.matrix = None
+        # size and modification time of the metadata read by load()
+        self.signature = None
+
+    def load(self):
+        """Reads the store again if it changed on disk. Returns whether
+        it changed."""
+        try:
+            stat = os.stat(self.meta_path)
+        except FileNotFoundError:
+            return False
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if signature == self.signature:
+            return False
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+        rows = len(meta["names"])
+        if rows:
+            # rows being appended by another process are beyond the metadata
+            matrix = np.memmap(
+                self.matrix_path, dtype="<f4", mode="r", shape=(rows, meta["dim"])
+            )
+        else:
+            matrix = np.empty((0, meta["dim"]), dtype="<f4")
+        self.names, self.digests, self.matrix = meta["names"], meta["digests"], matrix
+        self.signature = signature
+        return True
+
+    def __len__(self):
+        return len(self.names)
+
+    def append(self, entries, vectors):
+        """Appends the embeddings of the images, given as (name, digest)
+        pairs, except those another process stored in the meantime."""
+        os.makedirs(self.folder, exist_ok=True)
+        with _file_lock(self.meta_path + ".lock"):
+            self.load()
+            stored = set(zip(self.names, self.digests))
+            keep = [i for i, entry in enumerate(entries) if tuple(entry) not in stored]
+            if not keep:
+                return 0
+            vectors = np.ascontiguousarray(vectors[keep], dtype="<f4")
+            rows = len(self.names)
+            with open(self.matrix_path, "ab") as f:
+                # drops the rows of an interrupted append
+                f.truncate(rows * vectors.shape[1] * 4)
+                f.write(vectors.tobytes())
+            meta = {
+                "dim": vectors.shape[1],
+                "names": self.names + [entries[i][0] for i in keep],
+                "digests": self.digests + [entries[i][1] for i in keep],
+            }
+            # the metadata is replaced last, so readers never see missing rows
+            tmp_path = "{}.{}.tmp".format(self.meta_path, os.getpid())
+            with open(tmp_path, "w") as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, self.meta_path)
+            self.load()
+        return len(keep)
+
+
+class IVFIndex:
+    """Inverted file index of the rows of a matrix of normalized vectors.
+    The rows are clustered with spherical k-means, and a query scores only
+    the rows of the probes clusters whose centroids are nearest to it."""
+
+    def __init__(self, matrix, rows, lists, probes, iterations=10, sample=20_000, seed=0):
+        rng = np.random.default_rng(seed)
+        lists = min(lists, len(rows))
+        train = np.asarray(matrix[np.sort(rng.choice(rows, min(sample, len(rows)), replace=False))])
+        centroids = train[rng.choice(len(train), lists, replace=False)]
+        for _ in range(iterations):
+            assignments = np.argmax(train @ centroids.T, axis=1)
+            one_hot = np.zeros((lists, len(train)), dtype=np.float32)
+            one_hot[assignments, np.arange(len(train))] = 1
+            sums = one_hot @ train
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # the empty clusters keep their centroid
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+        self.centroids = centroids.astype(np.float32)
+        self.probes = min(probes, lists)
+        self.trained_rows = len(rows)
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.lists = []
+        self.add(matrix)
+
+    def __len__(self):
+        return len(self.assignments)
+
+    def add(self, matrix, block=8192):
+        """Assigns the rows of the matrix that are not indexed yet to
+        their nearest cluster."""
+        assignments = [self.assignments]
+        for start in range(len(self), len(matrix), block):
+            scores = np.asarray(matrix[start:start + block]) @ self.centroids.T
+            assignments.append(np.argmax(scores, axis=1).astype(np.int32))
+        self.assignments = np.concatenate(assignments)
+        order = np.argsort(self.assignments, kind="stable")
+        bounds = np.searchsorted(self.assignments[order], np.arange(1, len(self.centroids)))
+        self.lists = np.split(order, bounds)
+
+    def candidates(self, query):
+        """Returns the rows of the clusters nearest to the query."""
+        scores = self.centroids @ query
+        nearest = np.argpartition(-scores, self.probes - 1)[:self.probes]
+        return np.concatenate([self.lists[c] for c in nearest])
+
+
+class SimilarityIndex:
+    """Search of the gallery images most similar to an image, on the
+    embeddings of a model. sync() matches the rows of the store with the
+    current gallery images and returns the images to embed."""
+
+    def __init__(self, model_id, kind=None):
+        self.model_id = model_id
+        self.kind = kind or conf.similar_index
+        self.store = EmbeddingStore(conf.embeddings_folder_path, model_id)
+        self.updating = False
+        self.task = None
+        self.embedded = 0
+        # the store as of the last sync(), which the rows and the mask
+        # refer to; the store may have grown since
+        self._matrix = None
+        self._row_names = []
+        self._rows = {}
+        self._mask = np.zeros(0, dtype=bool)
+        self._missing = []
+        self._names = None
+        self._signature = None
+        self._ivf = None
+        self._lock = threading.Lock()
+
+    def sync(self):
+        """Returns the gallery images whose embedding is missing or stale,
+        as (name, digest) pairs."""
+        with self._lock:
+            self.store.load()
+            names = catalog.names()
+            if self.store.signature == self._signature and names is self._names:
+                return self._missing
+            digests = {}
+            for name in names:
+                entry = catalog.get(name)
+                if entry is not None:
+                    digests[name] = entry.digest
+            rows = {}
+            for row, (name, digest) in enumerate(zip(self.store.names, self.store.digests)):
+                if digests.get(name) == digest:
+                    rows[name] = row
+            mask = np.zeros(len(self.store), dtype=bool)
+            mask[list(rows.values())] = True
+            self._matrix, self._row_names = self.store.matrix, self.store.names
+            self._rows, self._mask, self._names = rows, mask, names
+            self._signature = self.store.signature
+            self._missing = [(name, d) for name, d in digests.items() if name not in rows]
+            self._update_ivf()
+            return self._missing
+
+    def _update_ivf(self):
+        if self.kind != "ivf" or len(self._rows) < conf.similar_ivf_min_images:
+            self._ivf = None
+            return
+        # the clusters are trained again when the gallery doubled, or when
+        # the store was rebuilt
+        if (
+            self._ivf is None
+            or len(self._rows) > 2 * self._ivf.trained_rows
+            or len(self._ivf) > len(self.store)
+        ):
+            start = time.perf_counter()
+            lists = conf.similar_ivf_lists or int(math.sqrt(len(self._rows)))
+            self._ivf = IVFIndex(
+                self._matrix, np.flatnonzero(self._mask), lists, conf.similar_ivf_probes
+            )
+            logging.info("Built the ivf index of {} with {} images in {:.2f}s".format(
+                self.model_id, len(self._rows), time.perf_counter() - start))
+        else:
+            self._ivf.add(self._matrix)
+
+    def embedding(self, source):
+        """Returns the embedding of a gallery image ID, from the store if
+        it is there, or of the bytes of an uploaded image."""
+        if isinstance(source, bytes):
+            batch = load_upload(source, self.model_id).unsqueeze(0)
+        else:
+            with self._lock:
+                row = self._rows.get(source)
+                matrix = self._matrix
+            if row is not None:
+                return np.array(matrix[row])
+            batch = load_tensor(source, self.model_id).unsqueeze(0)
+        return embed_batch(self.model_id, batch)[0]
+
+    def search(self, query, k, exclude=None):
+        """Returns the names and similarities of the k gallery images most
+        similar to the embedding query, the most similar first."""
+        with self._lock:
+            matrix, names, mask, ivf = self._matrix, self._row_names, self._mask, self._ivf
+            excluded = self._rows.get(exclude)
+        if matrix is None or not mask.any():
+            return []
+        with stage("search", self.model_id):
+            if ivf is not None:
+                rows = ivf.candidates(query)
+                rows = rows[mask[rows] & (rows != excluded)]
+                scores = np.asarray(matrix[rows]) @ query
+            else:
+                rows = None
+                scores = np.where(mask, np.asarray(matrix) @ query, -np.inf)
+                if excluded is not None:
+                    scores[excluded] = -np.inf
+            k = min(k, len(scores))
+            if k == 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+        return [
+            (names[i if rows is None else rows[i]], float(scores[i]))
+            for i in top if scores[i] > -np.inf
+        ]
+
+    def embed(self, entries):
+        """Embeds the images, given as (name, digest) pairs, and appends
+        them to the store."""
+        batch = torch.stack([load_tensor(name, self.model_id, cache=False) for name, _ in entries])
+        vectors = embed_batch(self.model_id, batch)
+        with self._lock:
+            added = self.store.append(entries, vectors)
+        self.embedded += added
+        return added
+
+    def stats(self):
+        return {
+            "kind": "ivf" if self._ivf is not None else "exact",
+            "rows": len(self.store),
+            "images": len(self._rows),
+            "missing": len(self._missing),
+            "updating": self.updating,
+            "embedded": self.embedded,
+        }
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(model_id):
+    with _indexes_lock:
+        if model_id not in _indexes:
+            _indexes[model_id] = SimilarityIndex(model_id)
+        return _indexes[model_id]
+
+
+# the model runs in the executor, which may be a process pool: its tasks
+# take the model ID and use the index of their process
+
+def embed_source(model_id, source):
+    index = get_index(model_id)
+    index.sync()
+    return index.embedding(source)
+
+
+def embed_images(model_id, entries):
+    return get_index(model_id).embed(entries)
+
+
+async def update(index):
+    """Embeds the missing gallery images in the executor, one batch at a
+    time, so that the requests are not held up by the update."""
+    if index.updating:
+        return
+    index.updating = True
+    try:
+        while True:
+            missing = await run_in_threadpool(index.sync)
+            if not missing:
+                break
+            batch = missing[:conf.embeddings_batch_size]
+            await executor.run(embed_images, index.model_id, batch)
+            # with a process pool, the rows were appended by another process
+            await run_in_threadpool(index.sync)
+    except ExecutorBusy:
+        # the update resumes with the next request
+        pass
+    except Exception:
+        logging.exception("Cannot update the embeddings of {}".format(index.model_id))
+    finally:
+        index.updating = False
+        index.task = None
+
+
+async def similar(source, model_id=None, k=None):
+    """Returns the k gallery images most similar to the image. source is a
+    gallery image ID, which is excluded from the results, or the bytes of
+    an uploaded image."""
+    start = time.perf_counter()
+    index = get_index(model_id or conf.embedding_model)
+    missing = await run_in_threadpool(index.sync)
+    if missing and conf.embeddings_auto_update and index.task is None:
+        index.task = asyncio.ensure_future(update(index))
+    query = await executor.run(embed_source, index.model_id, source)
+    exclude = None if isinstance(source, bytes) else source
+    results = await run_in_threadpool(index.search, query, k or conf.similar_top_k, exclude)
+    return {
+        "model": index.model_id,
+        "results": [
+            {
+                "image": name,
+                "similarity": round(similarity, 6),
+                "url": "/gallery/{}".format(name),
+                "thumbnail_url": "/gallery/{}/thumbnail".format(name),
+            }
+            for name, similarity in results
+        ],
+        "index": index.stats(),
+        "latency_ms": round((time.perf_counter() - start) * 1000, 3),
+    }
+
+
+def stats():
+    return {model_id: index.stats() for model_id, index in _indexes.items()}
@@ -0,0 +1,78 @@
+"""
+Comparison of the models on the same image, and their ensemble. The
+image is decoded once and preprocessed once per input size, then every
+model runs concurrently in the executor. The ensemble averages the
+class probabilities of the models.
+"""
+import asyncio
+import time
+
+import torch
+
+from app.executor import executor
+from app.ml.classification_utils import get_model, load_tensors
+from app.ml.postprocessing import postprocessor
+from app.tracing import stage
+
+
+def _ms(start, end):
+    return round((end - start) * 1000, 3)
+
+
+def model_probabilities(model_id, tensor, variant=None):
+    """Returns the class probabilities of the model for the preprocessed
+    image, and the time in ms spent getting the model (loading it on the
+    first use) and in the forward pass."""
+    start = time.perf_counter()
+    model = get_model(model_id, variant)
+    loaded = time.perf_counter()
+    with stage("forward", model_id), torch.inference_mode():
+        logits = model(tensor.unsqueeze(0))
+    done = time.perf_counter()
+    probabilities = torch.nn.functional.softmax(logits, dim=1)[0]
+    return probabilities, {"model_ms": _ms(start, loaded), "forward_ms": _ms(loaded, done)}
+
+
+def ensemble_probabilities(probabilities):
+    """Returns the average of the class probabilities of the models."""
+    return torch.stack(list(probabilities)).mean(dim=0)
+
+
+async def compare(source, model_ids, k=None, variant=None):
+    """Classifies the image with each model and with their ensemble.
+    source is a gallery image ID or the bytes of an uploaded image.
+
+    Returns the top-k scores (percentages) of each model, with the
+    latency breakdown of its run, and of the ensemble."""
+    start = time.perf_counter()
+    tensors = await executor.run(load_tensors, source, model_ids)
+    preprocessed = time.perf_counter()
+
+    async def run_model(model_id):
+        submitted = time.perf_counter()
+        probabilities, latency = await executor.run(
+            model_probabilities, model_id, tensors[model_id], variant
+        )
+        latency["total_ms"] = _ms(submitted, time.perf_counter())
+        # the rest of the total is the wait for a worker of the executor
+        latency["queue_ms"] = round(
+            latency["total_ms"] - latency["model_ms"] - latency["forward_ms"], 3
+        )
+        return probabilities, latency
+
+    runs = await asyncio.gather(*(run_model(m) for m in model_ids))
+    probabilities = [p for p, _ in runs]
+    with stage("labels"):
+        scores = postprocessor.top(torch.stack(probabilities) * 100, k)
+        ensemble = postprocessor.top(ensemble_probabilities(probabilities)[None] * 100, k)[0]
+    return {
+        "models": {
+            model_id: {"scores": model_scores, "latency": latency}
+            for model_id, model_scores, (_, latency) in zip(model_ids, scores, runs)
+        },
+        "ensemble": {"models": list(model_ids), "scores": ensemble},
+        "latency": {
+            "preprocess_ms": _ms(start, preprocessed),
+            "total_ms": _ms(start, time.perf_counter()),
+        },
+    }
@@ -0,0 +1,63 @@
+"""
+Entry point of the classification requests. It looks up the
+precomputed score index and the result cache and, on a miss,
+preprocesses the image in the executor and classifies it through the
+batch scheduler.
+"""
+import functools
+
+from starlette.concurrency import run_in_threadpool
+
+from app.executor import executor
+from app.ml.batching import scheduler
+from app.ml.classification_utils import load_tensor, load_upload
+from app.ml.result_cache import cache_key, result_cache
+from app.ml.score_index import score_index
+from app.ml.transformations import transform_tensor
+from app.ml.variants import resolve_variant
+from app.utils import bytes_digest, image_digest
+
+
+async def classify(model_id, image_id, params=None, variant=None):
+    """Returns the top-k classification output of the gallery image
+    image_id, transformed in memory with the color, brightness, contrast
+    and sharpness values in params, if given. variant selects an
+    optimized version of the model."""
+    variant = resolve_variant(model_id, variant)
+    digest = await executor.run(image_digest, image_id)
+    if params is None and variant == "fp32":
+        classification_scores = await run_in_threadpool(
+            score_index.lookup, image_id, model_id, digest
+        )
+        if classification_scores is not None:
+            return classification_scores
+    if params is not None:
+        load = functools.partial(transform_tensor, image_id, model_id, params)
+    else:
+        load = functools.partial(load_tensor, image_id, model_id)
+    return await _classify_cached(model_id, variant, digest, params, load)
+
+
+async def classify_upload(model_id, data, variant=None, image=None):
+    """Returns the top-k classification output of the uploaded image,
+    given as bytes. The image is decoded in memory and never stored, but
+    its result is cached by content digest, like those of the gallery
+    images. image is the upload already decoded, if available, so that it
+    is not decoded again."""
+    variant = resolve_variant(model_id, variant)
+    digest = await executor.run(bytes_digest, data)
+    load = functools.partial(load_upload, data if image is None else image, model_id)
+    return await _classify_cached(model_id, variant, digest, None, load)
+
+
+async def _classify_cached(model_id, variant, digest, params, load):
+    """Looks up the result cache and, on a miss, runs load in the executor
+    to get the preprocessed image and classifies it."""
+    model_key = model_id if variant == "fp32" else "{}:{}".format(model_id, variant)
+    key = cache_key(digest, model_key, params)
+    classification_scores = await run_in_threadpool(result_cache.get, key)
+    if classification_scores is None:
+        tensor = await executor.run(load)
+        classification_scores = await scheduler.classify(model_id, tensor, variant)
+        await run_in_threadpool(result_cache.set, key, classification_scores)
+    return classification_scores
@@ -0,0 +1,158 @@
+"""
+Process-wide registry of the torchvision models served by the app.
+Each model is loaded once, kept in eval mode and reused by every
+request. When a memory budget is configured, the least recently used
+models are unloaded to make room for new ones.
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from app.config import Configuration
+from app.ml.variants import load_model, resolve_variant, serialized_size
+
+
+conf = Configuration()
+
+
+def model_size(model):
+    """Returns the resident size in bytes of the parameters and
+    buffers of the given model."""
+    tensors = list(model.parameters()) + list(model.buffers())
+    size = sum(t.numel() * t.element_size() for t in tensors)
+    # frozen TorchScript models keep their weights as constants
+    return size or serialized_size(model)
+
+
+class ModelEntry:
+    """A model held by the registry, together with its statistics."""
+
+    def __init__(self, model, load_time, size):
+        self.model = model
+        self.load_time = load_time
+        self.size = size
+        self.hits = 0
+
+    def stats(self):
+        return {
+            "load_time_s": self.load_time,
+            "size_bytes": self.size,
+            "hits": self.hits,
+        }
+
+
+class ModelRegistry:
+    """Loads models on first use and keeps them resident, evicting the
+    least recently used ones when the memory budget is exceeded. Each
+    variant of a model (see app.ml.variants) is a separate entry."""
+
+    def __init__(self, models, memory_budget_mb=None, loader=load_model):
+        self.models = tuple(models)
+        self.memory_budget = (
+            None if memory_budget_mb is None else int(memory_budget_mb * 2 ** 20)
+        )
+        self.loader = loader
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = defaultdict(threading.Lock)
+
+    def get(self, model_id, variant=None):
+        """Returns the model named model_id, loading it if needed."""
+        if model_id not in self.models:
+            raise ImportError("Model {} is not configured".format(model_id))
+        variant = resolve_variant(model_id, variant)
+        key = model_id if variant == "fp32" else "{}:{}".format(model_id, variant)
+        entry = self._lookup(key)
+        if entry is not None:
+            return entry.model
+        # only one thread loads a given model, the others wait for it
+        with self._lock:
+            loading = self._loading[key]
+        with loading:
+            entry = self._lookup(key)
+            if entry is not None:
+                return entry.model
+            start = time.perf_counter()
+            model = self.loader(model_id, variant)
+            entry = ModelEntry(model, time.perf_counter() - start, model_size(model))
+            entry.hits += 1
+            logging.info(
+                "Loaded model {} in {:.2f}s ({:.1f} MB)".format(
+                    key, entry.load_time, entry.size / 2 ** 20
+                )
+            )
+            with self._lock:
+                self._entries[key] = entry
+                self._evict(keep=key)
+            return model
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.hits += 1
+                self._entries.move_to_end(key)
+            return entry
+
+    def _evict(self, keep):
+        """Unloads the least recently used models until the resident
+        size fits in the budget. The model in keep is never evicted."""
+        if self.memory_budget is None:
+            return
+        while self.resident_size() > self.memory_budget:
+            victim = next((m for m in self._entries if m != keep), None)
+            if victim is None:
+                break
+            del self._entries[victim]
+            self.evictions += 1
+            logging.info("Evicted model {} from the registry".format(victim))
+
+    def unload(self, model_id):
+        """Removes the model and its variants from the registry."""
+        with self._lock:
+            for key in list(self._entries):
+                if key.split(":")[0] == model_id:
+                    del self._entries[key]
+
+    def share_memory(self):
+        """Moves the weights of the loaded models to shared memory, so that
+        the processes forked afterwards use the same physical pages.
+        Returns the number of bytes shared."""
+        shared = 0
+        with self._lock:
+            models = [(key, entry.model) for key, entry in self._entries.items()]
+        for key, model in models:
+            for tensor in itertools.chain(model.parameters(), model.buffers()):
+                try:
+                    tensor.share_memory_()
+                except RuntimeError as e:
+                    # e.g. some quantized tensors, shared copy-on-write instead
+                    logging.warning("Cannot share a tensor of {}: {}".format(key, e))
+                    continue
+                shared += tensor.numel() * tensor.element_size()
+        return shared
+
+    def resident_size(self):
+        return sum(entry.size for entry in self._entries.values())
+
+    def warm_up(self, model_ids=None):
+        """Loads the given models (all the configured ones by default)
+        so that the first requests do not pay the loading time."""
+        for model_id in model_ids or self.models:
+            self.get(model_id)
+
+    def stats(self):
+        """Returns the load time and resident size of the loaded models."""
+        with self._lock:
+            return {
+                "loaded": {m: e.stats() for m, e in self._entries.items()},
+                "resident_bytes": self.resident_size(),
+                "budget_bytes": self.memory_budget,
+                "evictions": self.evictions,
+            }
+
+
+registry = ModelRegistry(conf.models, memory_budget_mb=conf.model_memory_budget_mb)
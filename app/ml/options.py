@@ -0,0 +1,11 @@
+"""
+Names of the model variants and of the kinds of scores. They are kept
+apart from the modules implementing them, so that forms and pages can
+use them without importing torch.
+"""
+VARIANTS = ("fp32", "channels_last", "dynamic_int8", "static_int8", "jit", "compiled")
+# variants stored as TorchScript artifacts
+SAVED_VARIANTS = ("dynamic_int8", "static_int8", "jit")
+
+# kinds of scores returned by the classifications
+OUTPUTS = ("percentage", "probability", "logit")
@@ -0,0 +1,74 @@
+"""
+Postprocessing of the model outputs. The Imagenet labels are loaded
+once, and the top-k labels and scores of a whole batch of logits are
+extracted at once with torch.topk.
+"""
+import json
+import os
+import threading
+
+import torch
+
+from app.config import Configuration
+from app.ml.options import OUTPUTS
+
+
+conf = Configuration()
+
+
+class Postprocessor:
+    """Turns batches of logits into lists of [label, score] pairs."""
+
+    def __init__(self, labels_path, k=5):
+        self.labels_path = labels_path
+        self.k = k
+        self._labels = None
+        self._lock = threading.Lock()
+
+    @property
+    def labels(self):
+        """The Imagenet labels as a tuple, where the index corresponds to
+        the output class. They are read from disk on first use."""
+        if self._labels is None:
+            with self._lock:
+                if self._labels is None:
+                    with open(self.labels_path) as f:
+                        self._labels = tuple(json.load(f))
+        return self._labels
+
+    @staticmethod
+    def scores(logits, output="percentage"):
+        """Converts the logits into the requested kind of scores."""
+        if output not in OUTPUTS:
+            raise ValueError("Unknown output {}".format(output))
+        if output == "logit":
+            return logits
+        probabilities = torch.nn.functional.softmax(logits, dim=1)
+        if output == "percentage":
+            probabilities = probabilities * 100
+        return probabilities
+
+    def __call__(self, logits, k=None, output="percentage"):
+        """Returns, for each row of the logits, the top-k classes as a
+        list of [label_name, score] pairs."""
+        return self.top(self.scores(logits, output), k)
+
+    def top(self, scores, k=None):
+        """Returns, for each row of scores already converted from the
+        logits, the top-k classes as a list of [label_name, score] pairs."""
+        k = min(k or self.k, scores.shape[1])
+        values, indices = torch.topk(scores, k, dim=1)
+        labels = self.labels
+        return [
+            [[labels[idx], value] for idx, value in zip(row_indices, row_values)]
+            for row_indices, row_values in zip(indices.tolist(), values.tolist())
+        ]
+
+    def raw(self, logits, output="logit"):
+        """Returns, for each row of the logits, the scores of all the classes."""
+        return self.scores(logits, output).tolist()
+
+
+postprocessor = Postprocessor(
+    os.path.join(conf.image_folder_path, "imagenet_labels.json"), k=conf.top_k
+)
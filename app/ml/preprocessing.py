@@ -0,0 +1,156 @@
+"""
+Preprocessing of the images fed to the models. Images are resized and
+center-cropped to the input size of each model and kept in a cache as
+uint8 tensors, keyed by the content digest of the image, so that the
+gallery images are decoded and resized only once.
+"""
+import threading
+from collections import OrderedDict
+
+import torch
+from torchvision import transforms
+from torchvision.transforms import functional as F
+
+from app.config import Configuration
+from app.tracing import stage
+
+
+conf = Configuration()
+
+MEAN = torch.tensor([0.485, 0.456, 0.406]).view(3, 1, 1)
+STD = torch.tensor([0.229, 0.224, 0.225]).view(3, 1, 1)
+
+# (resize, crop) sizes of the models that do not use the default ones
+INPUT_SIZES = {
+    "inception_v3": (342, 299),
+}
+DEFAULT_INPUT_SIZE = (256, 224)
+
+
+def input_size(model_id=None):
+    """Returns the resize and crop sizes expected by the model."""
+    return INPUT_SIZES.get(model_id, DEFAULT_INPUT_SIZE)
+
+
+def normalize(cropped):
+    """Converts a uint8 image tensor into the normalized float tensor
+    fed to the models."""
+    return (cropped.float().div_(255) - MEAN).div_(STD)
+
+
+class Preprocessor:
+    """Resizes, crops and normalizes images, caching the cropped uint8
+    tensors of the images up to max_bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def crop(self, img, model_id=None, draft=False):
+        """Returns the resized and center-cropped image as a uint8 tensor.
+        With draft, JPEG images are downscaled while decoding, which is
+        much faster for large uploads."""
+        return self.crops(img, [model_id], draft)[input_size(model_id)[1]]
+
+    def crops(self, img, model_ids, draft=False):
+        """Returns the image resized and center-cropped for the input size
+        of each model, as uint8 tensors keyed by crop size. The image is
+        decoded only once for all the models."""
+        return self.crop_sizes(img, {input_size(model_id) for model_id in model_ids}, draft)
+
+    def crop_sizes(self, img, sizes, draft=False):
+        """Returns the image resized and center-cropped for each of the
+        (resize, crop) sizes, as uint8 tensors keyed by crop size."""
+        if draft and img.format == "JPEG":
+            largest = max(resize for resize, _ in sizes)
+            img.draft("RGB", (largest, largest))
+        with stage("decode"):
+            img = img.convert("RGB")
+        cropped = {}
+        for resize, crop in sizes:
+            resized = F.resize(
+                img, resize, interpolation=transforms.InterpolationMode.BILINEAR
+            )
+            cropped[crop] = F.pil_to_tensor(F.center_crop(resized, crop))
+        return cropped
+
+    def __call__(self, img, model_id=None, draft=False):
+        """Returns the normalized tensor of the image, without caching it."""
+        return normalize(self.crop(img, model_id, draft))
+
+    def many(self, img, model_ids, draft=False):
+        """Returns the normalized tensors of the image for each model,
+        without caching them."""
+        normalized = {
+            crop: normalize(cropped)
+            for crop, cropped in self.crops(img, model_ids, draft).items()
+        }
+        return {m: normalized[input_size(m)[1]] for m in model_ids}
+
+    def cached(self, digest, open_image, model_id=None):
+        """Returns the normalized tensor of the image with the given
+        content digest. open_image is called to get the image on a miss."""
+        return self.cached_many(digest, open_image, [model_id])[model_id]
+
+    def cached_many(self, digest, open_image, model_ids):
+        """Returns the normalized tensors of the image with the given
+        content digest for each model."""
+        normalized = {
+            crop: normalize(tensor)
+            for crop, tensor in self.cached_crops(digest, open_image, model_ids).items()
+        }
+        return {m: normalized[input_size(m)[1]] for m in model_ids}
+
+    def cached_crops(self, digest, open_image, model_ids):
+        """Returns the cropped uint8 tensors of the image with the given
+        content digest, keyed by crop size. The image is opened (at most
+        once) only if some input size is not in the cache."""
+        cropped = {}
+        with self._lock:
+            for _, crop in {input_size(m) for m in model_ids}:
+                tensor = self._cache.get((digest, crop))
+                if tensor is not None:
+                    self._cache.move_to_end((digest, crop))
+                    self.hits += 1
+                    cropped[crop] = tensor
+        missing = [m for m in model_ids if input_size(m)[1] not in cropped]
+        if missing:
+            with open_image() as img:
+                for crop, tensor in self.crops(img, missing).items():
+                    cropped[crop] = tensor
+                    self._store((digest, crop), tensor)
+        return cropped
+
+    def _store(self, key, cropped):
+        size = cropped.numel() * cropped.element_size()
+        with self._lock:
+            self.misses += 1
+            if size > self.max_bytes or key in self._cache:
+                return
+            self._cache[key] = cropped
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self.nbytes -= evicted.numel() * evicted.element_size()
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """Returns the memory footprint and the hit counters of the cache."""
+        return {
+            "entries": len(self._cache),
+            "bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+preprocessor = Preprocessor(int(conf.tensor_cache_max_mb * 2 ** 20))
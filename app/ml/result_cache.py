@@ -0,0 +1,152 @@
+"""
+Cache of the classification results, keyed by the content of the image,
+the model and the transformation parameters. Results are kept in an
+in-memory LRU tier and, if a Redis URL is configured, in a shared
+Redis tier.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from app.config import Configuration
+
+
+conf = Configuration()
+
+
+def cache_key(digest, model_id, params=None):
+    """Builds the cache key of the classification of the image with the
+    given content digest, optionally transformed with params."""
+    key = "classification:{}:{}".format(model_id, digest)
+    if params:
+        key += ":" + json.dumps(params, sort_keys=True, separators=(",", ":"))
+    return key
+
+
+class LRUCache:
+    """Thread-safe in-memory cache holding at most max_entries values,
+    each one for at most ttl seconds (None means forever)."""
+
+    def __init__(self, max_entries, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ResultCache:
+    """Two-tier cache of the classification results. The Redis tier is
+    used only when a client or a URL is given; any client with the
+    get/set interface of redis.Redis (e.g. fakeredis) can be used."""
+
+    def __init__(self, max_entries, ttl=None, redis_url=None, redis_client=None):
+        self.memory = LRUCache(max_entries, ttl)
+        # the counters are updated by the executor threads, under the
+        # lock of the memory tier
+        self._lock = self.memory._lock
+        self.ttl = ttl
+        if redis_client is None and redis_url:
+            import redis
+            redis_client = redis.Redis.from_url(redis_url)
+        self.redis = redis_client
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.redis_errors = 0
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            return value
+        if self.redis is not None:
+            try:
+                raw = self.redis.get(key)
+            except Exception as e:
+                self._count_redis_error(e)
+                raw = None
+            if raw is not None:
+                value = json.loads(raw)
+                self.memory.set(key, value)
+                with self._lock:
+                    self.redis_hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.redis is not None:
+            try:
+                ttl = None if self.ttl is None else int(self.ttl)
+                self.redis.set(key, json.dumps(value), ex=ttl)
+            except Exception as e:
+                self._count_redis_error(e)
+
+    def _count_redis_error(self, e):
+        with self._lock:
+            self.redis_errors += 1
+        logging.warning("Redis cache unavailable: {}".format(e))
+
+    def clear(self):
+        self.memory.clear()
+
+    def stats(self):
+        with self._lock:
+            hits, redis_hits = self.hits, self.redis_hits
+            misses, redis_errors = self.misses, self.redis_errors
+            entries = len(self.memory._data)
+        lookups = hits + redis_hits + misses
+        return {
+            "entries": entries,
+            "max_entries": self.memory.max_entries,
+            "ttl_s": self.ttl,
+            "redis": self.redis is not None,
+            "hits": hits,
+            "redis_hits": redis_hits,
+            "misses": misses,
+            "redis_errors": redis_errors,
+            "hit_rate": (hits + redis_hits) / lookups if lookups else 0.0,
+        }
+
+
+result_cache = ResultCache(
+    conf.result_cache_max_entries,
+    ttl=conf.result_cache_ttl_s,
+    redis_url=conf.redis_url,
+)
@@ -0,0 +1,100 @@
+"""
+On-disk index of the precomputed classification outputs of the gallery
+images, stored in a SQLite database. It is filled by
+`app/precompute_scores.py` and read by the classification endpoint.
+"""
+import json
+import os
+import sqlite3
+import threading
+
+from app.config import Configuration
+
+
+conf = Configuration()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scores (
+    image_id TEXT NOT NULL,
+    model_id TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    top_k TEXT NOT NULL,
+    PRIMARY KEY (image_id, model_id)
+) WITHOUT ROWID
+"""
+
+
+class ScoreIndex:
+    """Maps (image_id, model_id) to the top-k classification output of
+    the image. Each entry records the content digest of the image, so
+    that outputs of images changed on disk are not returned."""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self, create=False):
+        if self._conn is None:
+            if not create and not os.path.exists(self.path):
+                return None
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def lookup(self, image_id, model_id, digest=None):
+        """Returns the precomputed output, or None if it is missing
+        or it was computed on a different content."""
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return None
+            row = conn.execute(
+                "SELECT digest, top_k FROM scores WHERE image_id = ? AND model_id = ?",
+                (image_id, model_id),
+            ).fetchone()
+        if row is None or (digest is not None and row[0] != digest):
+            return None
+        return json.loads(row[1])
+
+    def digests(self, model_id):
+        """Returns the digests of the images indexed for the model."""
+        with self._lock:
+            conn = self._connect(create=True)
+            rows = conn.execute(
+                "SELECT image_id, digest FROM scores WHERE model_id = ?", (model_id,)
+            ).fetchall()
+        return dict(rows)
+
+    def add(self, model_id, entries):
+        """Stores the outputs of the model, given as a list of
+        (image_id, digest, top_k) tuples, in one transaction."""
+        with self._lock:
+            conn = self._connect(create=True)
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)",
+                    [
+                        (image_id, model_id, digest, json.dumps(top_k))
+                        for image_id, digest, top_k in entries
+                    ],
+                )
+
+    def count(self):
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return 0
+            return conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+score_index = ScoreIndex(conf.score_index_path)
@@ -0,0 +1,68 @@
+"""
+Image transformations of the /transformations endpoint, applied to the
+resized and cropped image tensor instead of the full-size image. The
+color, brightness, contrast and sharpness adjustments of PIL's
+ImageEnhance are each one vectorized blend of the tensor, clipped and
+truncated like the intermediate uint8 images of PIL, so that the result
+matches ImageEnhance up to the float rounding of the blends (see
+benchmarks/transformations.py).
+"""
+from io import BytesIO
+
+import torch
+from PIL import Image
+
+from app.ml.classification_utils import load_crop
+from app.ml.preprocessing import normalize
+from app.tracing import stage
+
+# weights of the RGB to L conversion of PIL
+LUMA = torch.tensor([0.299, 0.587, 0.114])
+# ImageFilter.SMOOTH, used by ImageEnhance.Sharpness
+SMOOTH = torch.tensor([[1., 1., 1.], [1., 5., 1.], [1., 1., 1.]]).div_(13).expand(3, 1, 3, 3)
+
+
+def _to_uint8_range(x):
+    """Clips and truncates the blended image in place, as PIL does when
+    it stores each intermediate image as uint8."""
+    return x.clamp_(0, 255).floor_()
+
+
+def enhance(cropped, color=1.0, brightness=1.0, contrast=1.0, sharpness=1.0):
+    """Applies the ImageEnhance Color, Brightness, Contrast and Sharpness
+    adjustments, in this order, to a (3, H, W) uint8 tensor and returns
+    the transformed uint8 tensor."""
+    x = cropped.float()
+    # Color blends with the luminance, rounded as by PIL's L conversion
+    gray = torch.tensordot(LUMA, x, dims=1).round_()
+    x = _to_uint8_range(torch.lerp(gray.expand_as(x), x, color))
+    # Brightness blends with black
+    x = _to_uint8_range(x.mul_(brightness))
+    # Contrast blends with the rounded mean luminance
+    mean = torch.tensordot(LUMA, x, dims=1).round_().mean().add_(0.5).floor_()
+    x = _to_uint8_range(x.sub_(mean).mul_(contrast).add_(mean))
+
+    if sharpness != 1.0:
+        # blends with the smoothed image, the border pixels are unchanged
+        smoothed = torch.nn.functional.conv2d(x.unsqueeze(0), SMOOTH, groups=3)[0].round_()
+        inner = x[:, 1:-1, 1:-1]
+        inner.copy_(_to_uint8_range(torch.lerp(smoothed, inner, sharpness)))
+    return x.to(torch.uint8)
+
+
+def transform_tensor(image_id, model_id, params):
+    """Returns the normalized tensor of the gallery image transformed with
+    params, ready to be fed to the model."""
+    with stage("preprocess", model_id):
+        cropped = load_crop(image_id, model_id)
+    with stage("transform", model_id):
+        return normalize(enhance(cropped, **params))
+
+
+def transform_preview(image_id, params, fmt="JPEG"):
+    """Returns the transformed gallery image encoded as fmt, for display."""
+    with stage("preview"):
+        transformed = enhance(load_crop(image_id), **params)
+        buffer = BytesIO()
+        Image.fromarray(transformed.permute(1, 2, 0).numpy()).save(buffer, format=fmt)
+        return buffer.getvalue()
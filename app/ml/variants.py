@@ -0,0 +1,189 @@
+"""
+Optimized variants of the torchvision models. Besides the full-precision
+eager model ("fp32"), each model can be served as:
+
+- "channels_last": eager model using the channels-last memory format;
+- "dynamic_int8": linear layers dynamically quantized to int8;
+- "static_int8": whole model statically quantized to int8 (FX graph
+  mode), calibrated on the gallery images;
+- "jit": traced and frozen TorchScript model;
+- "compiled": model compiled with torch.compile.
+
+The quantized and TorchScript variants are built once by
+`app/prepare_models.py` and stored in the variants folder. The other
+ones are built when they are loaded, except "static_int8", which must
+be calibrated on real images: until it is prepared, fp32 is served.
+"""
+import importlib
+import io
+import json
+import logging
+import os
+import time
+
+import torch
+
+from app.config import Configuration
+from app.ml.options import SAVED_VARIANTS, VARIANTS
+
+
+conf = Configuration()
+
+# variants that cannot be built without calibration images
+CALIBRATED_VARIANTS = ("static_int8",)
+
+# (model, variant) pairs already reported as not prepared
+_unprepared = set()
+
+
+def resolve_variant(model_id, variant=None):
+    """Returns the variant to use for the model: the requested one, or the
+    one set in the configuration, or "fp32". Calibrated variants fall
+    back to "fp32" until they are prepared."""
+    variant = variant or conf.model_variants.get(model_id, "fp32")
+    if variant not in VARIANTS:
+        raise ValueError("Unknown model variant {}".format(variant))
+    if variant in CALIBRATED_VARIANTS and not os.path.exists(artifact_path(model_id, variant)):
+        if (model_id, variant) not in _unprepared:
+            _unprepared.add((model_id, variant))
+            logging.warning("Variant {} of {} was not prepared, serving fp32".format(
+                variant, model_id))
+        return "fp32"
+    return variant
+
+
+def artifact_path(model_id, variant):
+    return os.path.join(conf.variants_folder_path, "{}-{}.pt".format(model_id, variant))
+
+
+def load_torchvision_model(model_id):
+    """Builds the torchvision model named model_id with its pretrained
+    weights (random ones if pretrained_weights is disabled in the
+    configuration) and puts it in eval mode."""
+    module = importlib.import_module("torchvision.models")
+    weights = "DEFAULT" if conf.pretrained_weights else None
+    model = module.__getattribute__(model_id)(weights=weights)
+    model.eval()
+    return model
+
+
+class ChannelsLast(torch.nn.Module):
+    """Runs the wrapped model on channels-last inputs."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model.to(memory_format=torch.channels_last)
+
+    def forward(self, x):
+        return self.model(x.contiguous(memory_format=torch.channels_last))
+
+
+def example_inputs(model_id, batch_size=1):
+    from app.ml.preprocessing import input_size
+    crop = input_size(model_id)[1]
+    return torch.randn(batch_size, 3, crop, crop)
+
+
+def build_variant(model_id, variant, calibration=None):
+    """Builds the variant from the pretrained model. calibration is a
+    batch of preprocessed images, required by static quantization."""
+    if variant in CALIBRATED_VARIANTS and calibration is None:
+        raise ValueError("Variant {} needs calibration images".format(variant))
+    model = load_torchvision_model(model_id)
+    if variant == "fp32":
+        return model
+    if variant == "channels_last":
+        return ChannelsLast(model).eval()
+    if variant == "compiled":
+        return torch.compile(model)
+    example = example_inputs(model_id)
+    with torch.no_grad():
+        if variant == "dynamic_int8":
+            model = torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        elif variant == "static_int8":
+            from torch.ao.quantization import get_default_qconfig_mapping
+            from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+            prepared = prepare_fx(model, get_default_qconfig_mapping("x86"), (example,))
+            prepared(calibration)
+            model = convert_fx(prepared)
+        traced = torch.jit.trace(model, example)
+    return torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+
+
+def save_variant(model_id, variant, calibration=None):
+    """Builds the TorchScript variant and stores it in the variants folder."""
+    model = build_variant(model_id, variant, calibration)
+    os.makedirs(conf.variants_folder_path, exist_ok=True)
+    torch.jit.save(model, artifact_path(model_id, variant))
+    return model
+
+
+def load_model(model_id, variant="fp32"):
+    """Returns the variant of the model, loading the stored artifact when
+    it exists and building it otherwise. Calibrated variants are never
+    built here: they must have been prepared by app.prepare_models."""
+    if variant in SAVED_VARIANTS:
+        path = artifact_path(model_id, variant)
+        if os.path.exists(path):
+            return torch.jit.load(path).eval()
+        if variant in CALIBRATED_VARIANTS:
+            raise ValueError(
+                "Variant {} of {} was not prepared, run app.prepare_models".format(
+                    variant, model_id)
+            )
+        logging.warning(
+            "Variant {} of {} was not prepared, building it".format(variant, model_id)
+        )
+    return build_variant(model_id, variant)
+
+
+def serialized_size(model):
+    """Returns the size in bytes of the serialized weights of the model."""
+    buffer = io.BytesIO()
+    if isinstance(model, torch.jit.ScriptModule):
+        torch.jit.save(model, buffer)
+    else:
+        torch.save(getattr(model, "_orig_mod", model).state_dict(), buffer)
+    return buffer.tell()
+
+
+def measure_latency(model, batch, repeat=10):
+    """Returns the median latency in ms of the forward pass on the batch."""
+    timings = []
+    with torch.inference_mode():
+        model(batch)  # warm-up, e.g. compilation
+        for _ in range(repeat):
+            start = time.perf_counter()
+            model(batch)
+            timings.append((time.perf_counter() - start) * 1000)
+    return sorted(timings)[len(timings) // 2]
+
+
+def predict_top1(model, images, batch_size=8):
+    """Returns the top-1 class predicted by the model for each image."""
+    with torch.inference_mode():
+        return torch.cat([
+            model(images[i:i + batch_size]).argmax(dim=1)
+            for i in range(0, len(images), batch_size)
+        ])
+
+
+def compare_variants(model_id, images, variants=VARIANTS, batch_size=8, repeat=10):
+    """Returns, for each variant of the model, its latency on a batch,
+    its size and the top-1 agreement with the fp32 model on images,
+    a tensor of preprocessed images."""
+    reference = predict_top1(load_model(model_id, "fp32"), images, batch_size)
+    report = {}
+    for variant in variants:
+        model = load_model(model_id, variant)
+        top1 = predict_top1(model, images, batch_size)
+        report[variant] = {
+            "latency_ms": measure_latency(model, images[:batch_size], repeat),
+            "batch_size": min(batch_size, len(images)),
+            "size_bytes": serialized_size(model),
+            "top1_agreement": (top1 == reference).float().mean().item(),
+        }
+        logging.info("{} {}: {}".format(model_id, variant, json.dumps(report[variant])))
+    return report
@@ -0,0 +1,84 @@
+"""
+Rendering of the plots of the service with the object-oriented
+matplotlib API and the Agg canvas. Unlike pyplot, it keeps no global
+state, so plots can be rendered concurrently by the worker threads.
+Rendered images are cached by content.
+"""
+import hashlib
+import json
+from io import BytesIO
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from app.config import Configuration
+from app.ml.result_cache import LRUCache
+
+conf = Configuration()
+
+FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+SCORE_COLORS = ['#1A4A04', '#750014', '#795703', '#06216C', '#3F0355']
+
+plot_cache = LRUCache(conf.plot_cache_max_entries)
+
+
+def _cached(kind, data, fmt, draw):
+    """Returns the bytes of the plot of data in the format fmt, drawing
+    it with draw(figure, data) only if it is not in the cache."""
+    if fmt not in FORMATS:
+        raise ValueError("Unknown plot format {}".format(fmt))
+    key = hashlib.sha256(
+        json.dumps([kind, fmt, data], sort_keys=True).encode()
+    ).hexdigest()
+    content = plot_cache.get(key)
+    if content is None:
+        figure = Figure()
+        FigureCanvasAgg(figure)
+        draw(figure, data)
+        buffer = BytesIO()
+        figure.savefig(buffer, format=fmt)
+        content = buffer.getvalue()
+        plot_cache.set(key, content)
+    return content
+
+
+def _draw_histogram(figure, histogram):
+    ax = figure.add_subplot()
+    edges = np.arange(257)
+    for channel, counts in zip(histogram["channels"], histogram["counts"]):
+        ax.stairs(counts, edges, fill=True, color=channel, alpha=0.5,
+                  label=channel.capitalize())
+    ax.legend()
+
+
+def _draw_scores(figure, classification_scores):
+    # Extract class labels and scores from the list
+    classes, scores = zip(*classification_scores)
+
+    # Create an index for each class, in inverted order
+    class_indices = list(range(len(classes), 0, -1))
+
+    # Create the appropriate dimension figure
+    figure.set_size_inches(11, len(classes))
+    ax = figure.add_subplot()
+    ax.grid(alpha=0.2)
+    ax.barh(class_indices, scores, color=SCORE_COLORS[:len(classes)])
+    ax.set_yticks(class_indices)
+    ax.set_yticklabels(classes, ha='right')
+    ax.set_ylabel('Class')
+    ax.set_xlabel('Score')
+    ax.set_title('Classification Scores')
+    figure.tight_layout()
+
+
+def render_histogram(histogram, fmt="png"):
+    """Returns the plot of the color histogram computed by
+    app.histogram.get_histogram as PNG or SVG bytes."""
+    data = {"channels": histogram["channels"], "counts": histogram["counts"]}
+    return _cached("histogram", data, fmt, _draw_histogram)
+
+
+def render_scores(classification_scores, fmt="png"):
+    """Returns the bar plot of the classification scores as PNG or SVG bytes."""
+    return _cached("scores", classification_scores, fmt, _draw_scores)
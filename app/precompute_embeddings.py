@@ -0,0 +1,61 @@
+"""
+Computes the embeddings of the gallery images with the configured models
+and appends them to the embedding stores searched by /api/v1/similar.
+Only the images missing from a store, or whose content changed, are
+embedded, so the job can be interrupted and run again at any time.
+
+    python -m app.precompute_embeddings
+"""
+import argparse
+import logging
+
+import torch
+from torch.utils.data import DataLoader
+
+from app.config import Configuration
+from app.ml.embeddings import embed_batch, get_index
+from app.ml.model_registry import registry
+from app.precompute_scores import GalleryDataset
+
+conf = Configuration()
+
+
+def precompute_embeddings(models=None, batch_size=32, num_workers=2):
+    """Fills the embedding stores of the given models (the one searched
+    by default if not given) with the gallery images they miss."""
+    for model_id in models or [conf.embedding_model]:
+        index = get_index(model_id)
+        missing = dict(index.sync())
+        logging.info(
+            "Model {}: {} images to embed, {} up to date".format(
+                model_id, len(missing), index.stats()["images"]
+            )
+        )
+        if not missing:
+            continue
+        loader = DataLoader(
+            GalleryDataset(list(missing), model_id), batch_size=batch_size,
+            num_workers=num_workers,
+        )
+        for batch, image_ids in loader:
+            # every batch is appended, so an interrupted job can be resumed
+            index.store.append(
+                [(image_id, missing[image_id]) for image_id in image_ids],
+                embed_batch(model_id, batch),
+            )
+        index.sync()
+        # frees the memory before loading the next model
+        registry.unload(model_id)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Precomputes the embeddings of the gallery images."
+    )
+    parser.add_argument("--models", nargs="+", choices=conf.models)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+    with torch.inference_mode():
+        precompute_embeddings(args.models, args.batch_size, args.workers)
@@ -0,0 +1,83 @@
+"""
+Classifies every gallery image with every configured model and stores
+the outputs in the score index. Only the images (or models) missing from
+the index, or whose content changed, are computed, so the job can be
+interrupted and run again at any time.
+
+    python -m app.precompute_scores
+"""
+import argparse
+import logging
+
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from app.config import Configuration
+from app.ml.classification_utils import classify_batch, load_tensor
+from app.ml.model_registry import registry
+from app.ml.score_index import score_index
+from app.utils import image_digest, list_images
+
+conf = Configuration()
+
+
+class GalleryDataset(Dataset):
+    """Gallery images preprocessed for the model, returned with their IDs."""
+
+    def __init__(self, image_ids, model_id):
+        self.image_ids = image_ids
+        self.model_id = model_id
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def __getitem__(self, idx):
+        image_id = self.image_ids[idx]
+        return load_tensor(image_id, self.model_id, cache=False), image_id
+
+
+def precompute_scores(models=None, batch_size=32, num_workers=2):
+    """Fills the score index with the outputs of the given models (all
+    the configured ones by default) on the gallery images."""
+    digests = {image_id: image_digest(image_id) for image_id in list_images()}
+    for model_id in models or conf.models:
+        indexed = score_index.digests(model_id)
+        missing = [
+            image_id for image_id, digest in digests.items()
+            if indexed.get(image_id) != digest
+        ]
+        logging.info(
+            "Model {}: {} images to classify, {} up to date".format(
+                model_id, len(missing), len(digests) - len(missing)
+            )
+        )
+        if not missing:
+            continue
+        loader = DataLoader(
+            GalleryDataset(missing, model_id), batch_size=batch_size, num_workers=num_workers
+        )
+        for batch, image_ids in loader:
+            outputs = classify_batch(model_id, batch)
+            # every batch is committed, so an interrupted job can be resumed
+            score_index.add(
+                model_id,
+                [
+                    (image_id, digests[image_id], output)
+                    for image_id, output in zip(image_ids, outputs)
+                ],
+            )
+        # frees the memory before loading the next model
+        registry.unload(model_id)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Precomputes the classification outputs of the gallery images."
+    )
+    parser.add_argument("--models", nargs="+", choices=conf.models)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+    with torch.inference_mode():
+        precompute_scores(args.models, args.batch_size, args.workers)
@@ -1,3 +1,4 @@
+import argparse
 import json
 import logging
 import os
@@ -8,7 +9,7 @@ from zipfile import ZipFile
 
 import requests
 
-from config import Configuration
+from app.config import Configuration
 
 
 def prepare_images():
@@ -48,6 +49,32 @@ def prepare_labels():
     logging.info(f"Labels downloaded and stored in {labels_path}.")
 
 
+def prepare_pack():
+    """Builds the memory-mapped pack of the gallery images, with their
+    arrays for the input size of each configured model."""
+    from app.gallery_pack import build_pack
+    from app.ml.preprocessing import input_size
+
+    conf = Configuration()
+    images = [
+        f for f in os.listdir(conf.image_folder_path) if f.endswith(".JPEG")
+    ]
+    count = build_pack(
+        conf.image_folder_path,
+        conf.gallery_pack_path,
+        images,
+        {input_size(model_id) for model_id in conf.models},
+    )
+    logging.info(f"Pack of {count} images stored in {conf.gallery_pack_path}.")
+
+
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Downloads the gallery images.")
+    parser.add_argument("--pack", action="store_true",
+                        help="also build the memory-mapped pack of the gallery")
+    args = parser.parse_args()
     prepare_images()
     prepare_labels()
+    if args.pack:
+        prepare_pack()
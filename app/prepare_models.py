@@ -1,7 +1,10 @@
+import argparse
 import importlib
+import json
 import logging
+import os
 
-from config import Configuration
+from app.config import Configuration
 
 conf = Configuration()
 
@@ -18,5 +21,67 @@ def prepare_models():
             logging.error("Model {} not found".format(model_name))
 
 
+def gallery_batch(model_id, num_images):
+    """Returns the first num_images gallery images, preprocessed for the model."""
+    import torch
+    from app.ml.classification_utils import load_tensor
+    from app.utils import list_images
+
+    image_ids = sorted(list_images())[:num_images]
+    return torch.stack([load_tensor(i, model_id, cache=False) for i in image_ids])
+
+
+def prepare_variants(variants, num_images=64):
+    """Builds the optimized variants of the models and stores them in the
+    variants folder. Static quantization is calibrated on gallery images."""
+    from app.ml.variants import SAVED_VARIANTS, save_variant
+
+    for model_id in conf.models:
+        for variant in variants:
+            if variant not in SAVED_VARIANTS:
+                continue
+            calibration = (
+                gallery_batch(model_id, num_images) if variant == "static_int8" else None
+            )
+            save_variant(model_id, variant, calibration)
+            logging.info("Variant {} of {} prepared".format(variant, model_id))
+
+
+def report_variants(variants, num_images=200):
+    """Compares the variants of each model on the gallery images and saves
+    the latency, size and top-1 agreement with fp32 as a JSON report."""
+    from app.ml.variants import compare_variants
+
+    report = {
+        model_id: compare_variants(model_id, gallery_batch(model_id, num_images), variants)
+        for model_id in conf.models
+    }
+    path = os.path.join(conf.variants_folder_path, "report.json")
+    os.makedirs(conf.variants_folder_path, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    logging.info(f"Variants report stored in {path}.")
+    return report
+
+
 if __name__ == "__main__":
+    from app.ml.variants import VARIANTS
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Prepares the models of the service.")
+    parser.add_argument(
+        "--variants", nargs="*", choices=VARIANTS, default=[],
+        help="optimized variants to build and store",
+    )
+    parser.add_argument(
+        "--report", action="store_true",
+        help="compare the variants against fp32 on the gallery images",
+    )
+    parser.add_argument("--images", type=int, default=200)
+    args = parser.parse_args()
+
     prepare_models()
+    if args.variants:
+        prepare_variants(args.variants)
+    if args.report:
+        report_variants(["fp32"] + [v for v in args.variants if v != "fp32"], args.images)
@@ -0,0 +1,134 @@
+"""
+Bounded store of the preview images shown in the result pages, such as
+the uploaded images. Previews expire after a TTL and the least recently
+added ones are dropped when the store is full. They are kept in memory
+and, when a path is configured, in a SQLite database shared by the
+server processes, so that any of them can serve a preview.
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from app.config import Configuration
+
+conf = Configuration()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS previews (
+    key TEXT PRIMARY KEY,
+    expires REAL NOT NULL,
+    media_type TEXT NOT NULL,
+    content BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS previews_expires ON previews (expires);
+"""
+
+
+class PreviewStore:
+    """Keeps at most max_entries previews, max_bytes in total, each one
+    for ttl seconds. Without a path, the previews are kept in the memory
+    of the process only."""
+
+    def __init__(self, max_entries, max_bytes, ttl, path=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.path = path
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def put(self, content, media_type="image/jpeg"):
+        """Stores the preview and returns its key."""
+        key = uuid.uuid4().hex
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._expire()
+            self._data[key] = (content, media_type, expires)
+            self.nbytes += len(content)
+            while self._data and (
+                len(self._data) > self.max_entries or self.nbytes > self.max_bytes
+            ):
+                self._pop()
+            if self.path is not None:
+                conn = self._connect()
+                with conn:
+                    conn.execute(
+                        "INSERT INTO previews VALUES (?, ?, ?, ?)",
+                        (key, expires, media_type, content),
+                    )
+                    self._evict(conn)
+        return key
+
+    def _evict(self, conn):
+        """Deletes the expired previews, and the oldest ones beyond
+        max_entries or max_bytes."""
+        conn.execute("DELETE FROM previews WHERE expires < ?", (time.time(),))
+        conn.execute(
+            "DELETE FROM previews WHERE key IN (SELECT key FROM ("
+            "SELECT key, COUNT(*) OVER w AS n, SUM(LENGTH(content)) OVER w AS total "
+            "FROM previews WINDOW w AS (ORDER BY expires DESC)) "
+            "WHERE n > ? OR total > ?)",
+            (self.max_entries, self.max_bytes),
+        )
+
+    def get(self, key):
+        """Returns the content and media type of the preview, or None if
+        it does not exist or has expired."""
+        with self._lock:
+            self._expire()
+            item = self._data.get(key)
+            if item is None and self.path is not None:
+                item = self._connect().execute(
+                    "SELECT content, media_type FROM previews WHERE key = ? AND expires >= ?",
+                    (key, time.time()),
+                ).fetchone()
+        if item is None:
+            return None
+        return bytes(item[0]), item[1]
+
+    def _pop(self):
+        _, (content, _, _) = self._data.popitem(last=False)
+        self.nbytes -= len(content)
+
+    def _expire(self):
+        # entries are sorted by expiration time, as they share the same TTL
+        now = time.time()
+        while self._data and next(iter(self._data.values()))[2] < now:
+            self._pop()
+
+    def stats(self):
+        stats = {
+            "memory_entries": len(self._data),
+            "memory_bytes": self.nbytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_s": self.ttl,
+        }
+        if self.path is not None:
+            with self._lock:
+                count, size = self._connect().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(LENGTH(content)), 0) FROM previews"
+                ).fetchone()
+            stats.update({"entries": count, "bytes": size})
+        return stats
+
+
+preview_store = PreviewStore(
+    conf.preview_max_entries,
+    int(conf.preview_max_mb * 2 ** 20),
+    conf.preview_ttl_s,
+    conf.preview_store_path,
+)
@@ -0,0 +1,122 @@
+"""
+Store of the classification results that can be downloaded after a
+classification. Results get a collision-free random id and are kept in
+an in-memory tier and in a SQLite tier, both bounded in size, and
+expire after a TTL.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from app.config import Configuration
+from app.ml.result_cache import LRUCache
+
+conf = Configuration()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id TEXT PRIMARY KEY,
+    expires REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_expires ON results (expires);
+"""
+
+EVICT_EVERY = 100
+
+
+class ResultsStore:
+    """Keeps at most max_entries results (plus the ones inserted since the
+    last eviction) for ttl seconds. The most recent
+    memory_entries results are also kept in memory. Without a path, the
+    results are kept in memory only."""
+
+    def __init__(self, path, max_entries, ttl, memory_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.memory = LRUCache(min(memory_entries, max_entries), ttl)
+        self._puts = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def put(self, value):
+        """Stores the result and returns its id."""
+        result_id = uuid.uuid4().hex
+        self.memory.set(result_id, value)
+        if self.path is not None:
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    conn.execute(
+                        "INSERT INTO results VALUES (?, ?, ?)",
+                        (result_id, time.time() + self.ttl, json.dumps(value)),
+                    )
+                    # evicting is done in bulk, every EVICT_EVERY insertions
+                    self._puts += 1
+                    if self._puts % EVICT_EVERY == 0:
+                        self._evict(conn)
+        return result_id
+
+    def _evict(self, conn):
+        """Deletes the expired results and the oldest ones beyond max_entries."""
+        conn.execute("DELETE FROM results WHERE expires < ?", (time.time(),))
+        conn.execute(
+            "DELETE FROM results WHERE id IN (SELECT id FROM results "
+            "ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def get(self, result_id):
+        """Returns the result, or None if it does not exist or has expired."""
+        value = self.memory.get(result_id)
+        if value is not None or self.path is None:
+            return value
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT data FROM results WHERE id = ? AND expires >= ?",
+                (result_id, time.time()),
+            ).fetchone()
+        if row is None:
+            return None
+        value = json.loads(row[0])
+        self.memory.set(result_id, value)
+        return value
+
+    def delete(self, result_id):
+        self.memory.delete(result_id)
+        if self.path is not None:
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    conn.execute("DELETE FROM results WHERE id = ?", (result_id,))
+
+    def stats(self):
+        """Returns the number of entries and the bytes of the stored results."""
+        stats = {"memory_entries": len(self.memory), "max_entries": self.max_entries}
+        if self.path is not None:
+            with self._lock:
+                count, size = self._connect().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM results"
+                ).fetchone()
+            stats.update({"entries": count, "bytes": size})
+        return stats
+
+
+results_store = ResultsStore(
+    conf.results_store_path,
+    max_entries=conf.results_max_entries,
+    ttl=conf.results_ttl_s,
+    memory_entries=conf.results_memory_entries,
+)
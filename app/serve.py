@@ -0,0 +1,213 @@
+"""
+Multi-process serving with shared model weights. A supervisor process
+loads every configured model once, moves the weights to shared memory
+and forks the server workers, which accept connections on the same
+listening socket. The workers use the physical pages of the supervisor
+for the weights, so the memory of each worker does not grow with the
+number of models.
+
+The workers send heartbeats from their event loop; a worker that exits
+or stops sending them for serve_heartbeat_timeout_s is (re)started.
+
+Any worker may answer a request, so the state kept between requests
+must be shared: the jobs need job_backend = "rq" and the previews
+preview_store_path. Otherwise a single worker is started.
+
+    python -m app.serve --host 0.0.0.0 --port 8000 --workers 4
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+import torch
+import uvicorn
+
+from app.config import Configuration
+from app.executor import executor
+from app.ml.model_registry import registry
+
+conf = Configuration()
+
+# minimum time between two starts of the same worker, against crash loops
+RESTART_DELAY_S = 1
+
+
+def unshared_state():
+    """Returns the state of the server that the configuration keeps in the
+    memory of each process."""
+    unshared = []
+    if conf.job_backend != "rq":
+        unshared.append('the jobs (job_backend = "rq" shares them)')
+    if conf.preview_store_path is None:
+        unshared.append("the previews (preview_store_path shares them)")
+    return unshared
+
+
+def bind_socket(host, port):
+    """Returns the listening socket shared by the workers."""
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Supervisor:
+    """Forks num_workers server processes serving app on sock, and
+    restarts the ones that exit or stop sending heartbeats."""
+
+    def __init__(self, app, sock, num_workers, heartbeat_interval, heartbeat_timeout,
+                 log_level="info"):
+        self.app = app
+        self.sock = sock
+        self.num_workers = num_workers
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.log_level = log_level
+        # time of the last heartbeat of each worker, in shared memory
+        self.heartbeats = multiprocessing.Array("d", num_workers, lock=False)
+        self.pids = [None] * num_workers
+        self.started = [0.0] * num_workers
+        self.restarts = 0
+        self._stopping = False
+
+    def start_worker(self, index):
+        self.heartbeats[index] = 0.0
+        self.started[index] = time.monotonic()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                self._run_worker(index)
+                code = 0
+            except Exception:
+                logging.exception("Worker {} failed".format(index))
+            finally:
+                os._exit(code)
+        self.pids[index] = pid
+        logging.info("Started worker {} (pid {})".format(index, pid))
+
+    def _run_worker(self, index):
+        """Runs the server in the forked worker."""
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(sig, signal.SIG_DFL)
+        # the cores are split among the server processes, then among the
+        # workers of their executor
+        cores = max(1, (os.cpu_count() or 1) // self.num_workers)
+        if conf.executor_workers is None:
+            executor.workers = cores
+        if conf.torch_threads is None:
+            executor.torch_threads = max(1, cores // executor.workers)
+
+        async def heartbeat():
+            while True:
+                self.heartbeats[index] = time.monotonic()
+                await asyncio.sleep(self.heartbeat_interval)
+
+        tasks = []
+        self.app.add_event_handler(
+            "startup", lambda: tasks.append(asyncio.ensure_future(heartbeat()))
+        )
+        config = uvicorn.Config(self.app, log_level=self.log_level)
+        uvicorn.Server(config).run(sockets=[self.sock])
+
+    def check_workers(self):
+        """Reaps the exited workers, kills the unresponsive ones and
+        starts the missing ones."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            if pid in self.pids:
+                index = self.pids.index(pid)
+                self.pids[index] = None
+                if not self._stopping:
+                    logging.warning("Worker {} (pid {}) exited with status {}".format(
+                        index, pid, os.waitstatus_to_exitcode(status)))
+        now = time.monotonic()
+        for index, pid in enumerate(self.pids):
+            if self._stopping:
+                break
+            if pid is None:
+                if now - self.started[index] >= RESTART_DELAY_S:
+                    self.restarts += 1
+                    self.start_worker(index)
+                continue
+            # before the first heartbeat, the worker is still starting up
+            last = self.heartbeats[index] or self.started[index]
+            if now - last > self.heartbeat_timeout:
+                logging.warning("Worker {} (pid {}) is unresponsive, killing it".format(
+                    index, pid))
+                os.kill(pid, signal.SIGKILL)
+
+    def stop(self, *_):
+        self._stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.num_workers):
+            self.start_worker(index)
+        while not self._stopping:
+            self.check_workers()
+            time.sleep(self.heartbeat_interval)
+
+        for pid in self.pids:
+            if pid is not None:
+                os.kill(pid, signal.SIGTERM)
+        for pid in self.pids:
+            if pid is not None:
+                os.waitpid(pid, 0)
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serves the app with several processes sharing the model weights."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=conf.serve_workers)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper())
+    workers = args.workers or os.cpu_count() or 1
+    unshared = unshared_state()
+    if workers > 1 and unshared:
+        parser.error(
+            "{} workers would not share {}; share them or pass --workers 1".format(
+                workers, " and ".join(unshared))
+        )
+
+    from main import app
+
+    # a single thread while loading, so that no thread pool of torch
+    # exists when the workers are forked
+    torch.set_num_threads(1)
+    registry.warm_up()
+    shared = registry.share_memory()
+    logging.info("Shared {:.1f} MB of model weights".format(shared / 2 ** 20))
+
+    sock = bind_socket(args.host, args.port)
+    logging.info("Listening on {}:{}".format(args.host, args.port))
+    Supervisor(
+        app,
+        sock,
+        workers,
+        conf.serve_heartbeat_interval_s,
+        conf.serve_heartbeat_timeout_s,
+        args.log_level,
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Fast startup of the server. The heavy dependencies are grouped in
+subsystems (inference: torch and torchvision, transforms, plotting:
+matplotlib, images: PIL and numpy), which are imported on first use
+through lazy modules, or preloaded in the background at startup. The
+imports done while the app starts are timed, to report where the
+startup time goes.
+
+Import this module before anything else, so that the profile covers
+all the imports of the app.
+"""
+import builtins
+import importlib
+import logging
+import sys
+import threading
+import time
+
+from app.config import Configuration
+
+conf = Configuration()
+
+started_at = time.perf_counter()
+
+
+class ImportProfiler:
+    """Times the first import of each module, including the modules it
+    imports in turn, like `python -X importtime` does."""
+
+    def __init__(self):
+        self.times = {}
+        self.active = False
+        self._import = builtins.__import__
+
+    def start(self):
+        builtins.__import__ = self._timed_import
+        self.active = True
+
+    def stop(self):
+        if self.active:
+            builtins.__import__ = self._import
+            self.active = False
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        # relative imports and modules already imported are not timed
+        if level or name in sys.modules:
+            return self._import(name, globals, locals, fromlist, level)
+        start = time.perf_counter()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            self.times.setdefault(name, time.perf_counter() - start)
+
+    def report(self, top=30):
+        """Returns the slowest imports, in seconds, the slowest first."""
+        slowest = sorted(self.times.items(), key=lambda item: item[1], reverse=True)
+        return [{"module": name, "seconds": round(s, 4)} for name, s in slowest[:top]]
+
+
+class Subsystem:
+    """Group of modules imported together on first use."""
+
+    def __init__(self, name, modules):
+        self.name = name
+        self.modules = tuple(modules)
+        self.load_time = None
+        self._lock = threading.Lock()
+
+    @property
+    def warm(self):
+        return self.load_time is not None
+
+    def load(self):
+        """Imports the modules of the subsystem, once."""
+        if self.load_time is None:
+            with self._lock:
+                if self.load_time is None:
+                    start = time.perf_counter()
+                    for module in self.modules:
+                        importlib.import_module(module)
+                    self.load_time = time.perf_counter() - start
+                    logging.info("Loaded subsystem {} in {:.2f}s".format(
+                        self.name, self.load_time))
+
+    def stats(self):
+        return {"warm": self.warm, "load_time_s": self.load_time}
+
+
+SUBSYSTEMS = {
+    subsystem.name: subsystem
+    for subsystem in (
+        Subsystem("inference", (
+            "app.ml.preprocessing",
+            "app.ml.classification_utils",
+            "app.ml.model_registry",
+            "app.ml.batching",
+            "app.ml.inference",
+            "app.ml.ensemble",
+            "app.ml.embeddings",
+        )),
+        Subsystem("transforms", ("app.ml.transformations",)),
+        Subsystem("plotting", ("app.plotting",)),
+        Subsystem("images", (
+            "app.gallery_pack", "app.histogram", "app.uploads", "app.thumbnails",
+        )),
+    )
+}
+
+
+class LazyModule:
+    """Stands for a module of a subsystem, which is loaded when an
+    attribute of the module is first accessed."""
+
+    def __init__(self, name):
+        self._name = name
+        self._subsystem = next(
+            s for s in SUBSYSTEMS.values() if name in s.modules
+        )
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._subsystem.load()
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+def lazy(name):
+    """Returns the module name of a subsystem, imported on first use."""
+    return LazyModule(name)
+
+
+def preload(names):
+    """Loads the given subsystems in a background thread."""
+    def run():
+        for name in names:
+            try:
+                SUBSYSTEMS[name].load()
+            except Exception:
+                logging.exception("Cannot load subsystem {}".format(name))
+
+    thread = threading.Thread(target=run, name="preload-subsystems", daemon=True)
+    thread.start()
+    return thread
+
+
+def subsystems_stats():
+    return {name: subsystem.stats() for name, subsystem in SUBSYSTEMS.items()}
+
+
+profiler = ImportProfiler()
+if conf.startup_profile:
+    profiler.start()
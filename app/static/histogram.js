@@ -0,0 +1,50 @@
+
+$(document).ready(function () {
+    var scripts = document.getElementById('makeHistogram');
+    var histogram = scripts.getAttribute('histogram');
+    makeHistogram(histogram);
+});
+
+function makeHistogram(histogram) {
+    histogram = JSON.parse(histogram);
+    var colors = {
+        'red': 'rgba(255,0,0,0.5)',
+        'green': 'rgba(0,128,0,0.5)',
+        'blue': 'rgba(0,0,255,0.5)',
+        'gray': 'rgba(128,128,128,0.5)',
+    };
+    var labels = [];
+    for (var i = 0; i < 256; i++) {
+        labels.push(i);
+    }
+    var datasets = histogram.channels.map(function (channel, idx) {
+        return {
+            label: channel.charAt(0).toUpperCase() + channel.slice(1),
+            data: histogram.counts[idx],
+            backgroundColor: colors[channel],
+            borderColor: colors[channel],
+            borderWidth: 1,
+            pointRadius: 0,
+            lineTension: 0,
+            steppedLine: true,
+        };
+    });
+    var ctx = document.getElementById("histogramOutput").getContext('2d');
+    var myChart = new Chart(ctx, {
+        type: 'line',
+        data: {
+            labels: labels,
+            datasets: datasets
+        },
+        options: {
+            animation: false,
+            scales: {
+                yAxes: [{
+                    ticks: {
+                        beginAtZero: true
+                    }
+                }]
+            }
+        }
+    });
+}
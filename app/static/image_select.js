@@ -0,0 +1,44 @@
+
+$(document).ready(function () {
+    var select = $('#imageSelect');
+    var search = $('#imageSearch');
+    var more = $('#loadMoreImages');
+    var thumbnail = $('#imageThumbnail');
+    var pageSize = 100;
+    var timer = null;
+
+    function loadImages(offset) {
+        $.getJSON('/api/v1/images', {q: search.val(), offset: offset, limit: pageSize}, function (data) {
+            if (offset === 0) {
+                select.empty();
+            }
+            data.images.forEach(function (image) {
+                select.append($('<option>').val(image.name).text(image.name));
+            });
+            select.data('offset', offset + data.images.length);
+            more.toggle(offset + data.images.length < data.total);
+            showThumbnail();
+        });
+    }
+
+    // thumbnails are cached by the browser and revalidated with their ETag
+    function showThumbnail() {
+        var image = select.val();
+        thumbnail.toggle(Boolean(image));
+        if (image) {
+            thumbnail.attr('src', '/gallery/' + encodeURIComponent(image) + '/thumbnail');
+        }
+    }
+
+    search.on('input', function () {
+        clearTimeout(timer);
+        timer = setTimeout(function () {
+            loadImages(0);
+        }, 250);
+    });
+    select.on('change', showThumbnail);
+    more.on('click', function () {
+        loadImages(select.data('offset'));
+    });
+    loadImages(0);
+});
@@ -0,0 +1,61 @@
+"""
+Tasks run by the job queue. They are plain functions returning
+JSON-serializable results, so that they can be executed by an rq
+worker on another machine as well as in-process. The modules used by
+the tasks are imported when they run, so that enqueueing a job does not
+import torch.
+"""
+from app.config import Configuration
+
+conf = Configuration()
+
+
+def classification_task(image_id, model_id, variant=None):
+    """Returns the top-k classification output of the gallery image."""
+    from app.ml.classification_utils import classify_image
+
+    return {
+        "image_id": image_id,
+        "model_id": model_id,
+        "classification_scores": classify_image(model_id, image_id, variant),
+    }
+
+
+def transformation_task(image_id, model_id, color, brightness, contrast, sharpness,
+                        variant=None):
+    """Returns the top-k classification output of the transformed image."""
+    from app.ml.classification_utils import classify_batch
+    from app.ml.transformations import transform_tensor
+
+    params = {
+        "color": color,
+        "brightness": brightness,
+        "contrast": contrast,
+        "sharpness": sharpness,
+    }
+    tensor = transform_tensor(image_id, model_id, params).unsqueeze(0)
+    classification_scores = classify_batch(model_id, tensor, variant=variant)[0]
+    return {
+        "image_id": image_id,
+        "model_id": model_id,
+        "classification_scores": classification_scores,
+    }
+
+
+def histogram_task(image_id, png=False):
+    """Returns the counts of each color channel of the image and,
+    with png, the histogram plot as a base64 PNG."""
+    from app.histogram import get_histogram
+    from app.utils import generate_histogram
+
+    histogram = get_histogram(image_id)
+    if png:
+        histogram = {**histogram, "histogram_base64": generate_histogram(image_id)}
+    return histogram
+
+
+TASKS = {
+    "classification": classification_task,
+    "transformation": transformation_task,
+    "histogram": histogram_task,
+}
@@ -0,0 +1,68 @@
+"""
+Thumbnails of the gallery images shown by the select pages. They are
+stored in the thumbnails folder, named after the content digest of the
+image, so that they are computed once and follow the changes of the
+gallery. Run `python -m app.thumbnails` to precompute all of them;
+missing ones are created on first request.
+"""
+import argparse
+import logging
+import os
+
+from app.catalog import catalog
+from app.config import Configuration
+from app.uploads import make_preview
+
+conf = Configuration()
+
+
+def thumbnail_path(digest, size=None):
+    size = size or conf.thumbnail_size
+    return os.path.join(conf.thumbnails_folder_path, "{}-{}.jpg".format(digest, size))
+
+
+def get_thumbnail(image_id):
+    """Returns the JPEG thumbnail of the gallery image and its content
+    digest, or None if the image does not exist or was removed since the
+    catalog was refreshed."""
+    entry = catalog.get(image_id)
+    if entry is None:
+        return None
+    path = thumbnail_path(entry.digest)
+    try:
+        with open(path, "rb") as f:
+            return f.read(), entry.digest
+    except FileNotFoundError:
+        pass
+    try:
+        with open(os.path.join(conf.image_folder_path, image_id), "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    content = make_preview(data, conf.thumbnail_size)
+    os.makedirs(conf.thumbnails_folder_path, exist_ok=True)
+    # written to a temporary file first, so that readers never see a partial one
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    return content, entry.digest
+
+
+def precompute_thumbnails(image_ids=None):
+    """Creates the missing thumbnails of the given gallery images, all of
+    them by default. Returns the number of images processed."""
+    image_ids = image_ids or catalog.names()
+    for image_id in image_ids:
+        get_thumbnail(image_id)
+    return len(image_ids)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Precomputes the gallery thumbnails.")
+    parser.add_argument("images", nargs="*", help="image IDs, all the gallery by default")
+    args = parser.parse_args()
+    count = precompute_thumbnails(args.images)
+    logging.info("Thumbnails of {} images stored in {}".format(
+        count, conf.thumbnails_folder_path))
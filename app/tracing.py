@@ -0,0 +1,162 @@
+"""
+Per-stage timing of the requests. The steps of the request pipeline
+(form parsing, decoding, preprocessing, model loading, forward pass,
+labels, rendering, ...) are timed with stage() and recorded in the
+Prometheus histograms exposed on `/metrics`, labeled by stage, model
+and endpoint. TracingMiddleware keeps track of the current request, so
+that the stages know their endpoint, records the request durations and
+optionally sends the stage timings in a Server-Timing header.
+
+Stages run in the thread executor are attributed to the request that
+submitted them; with the process executor only the stages run in the
+server process are recorded.
+"""
+import contextlib
+import contextvars
+import time
+
+from starlette.datastructures import MutableHeaders
+
+from app.config import Configuration
+from app.metrics import LabeledHistogram, register
+
+
+conf = Configuration()
+
+SECONDS_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+
+stage_seconds = register(
+    "isde_stage_seconds",
+    "Time spent in each stage of the request pipeline.",
+    LabeledHistogram(("stage", "model", "endpoint"), SECONDS_BUCKETS),
+)
+request_seconds = register(
+    "isde_request_seconds",
+    "Time spent serving the requests.",
+    LabeledHistogram(("method", "endpoint", "status"), SECONDS_BUCKETS),
+)
+
+# label values must come from fixed sets, so that clients cannot
+# create new series
+METHODS = ("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS")
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+def model_label(model):
+    """Returns the model label of a stage: the model if it is a
+    configured one, "unknown" otherwise."""
+    if not model:
+        return ""
+    return model if model in conf.models else "unknown"
+
+
+class Trace:
+    """Stage timings of a request. scope is the ASGI scope of the request,
+    None for work that is not tied to a single request."""
+
+    def __init__(self, scope=None):
+        self.scope = scope
+        self.timings = []
+
+    @property
+    def endpoint(self):
+        """The path of the route of the request, once it is routed."""
+        if self.scope is None:
+            return ""
+        route = self.scope.get("route")
+        if route is not None:
+            return getattr(route, "path", "")
+        endpoint = self.scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        return getattr(endpoint, "__name__", type(endpoint).__name__)
+
+    def add(self, name, seconds, model=None):
+        """Records that the stage name took the given time."""
+        self.timings.append((name, seconds))
+        if self.scope is not None:
+            stage_seconds.labels(name, model_label(model), self.endpoint).observe(seconds)
+
+    def server_timing(self, total):
+        """Returns the value of the Server-Timing header of the request."""
+        entries = ["{};dur={:.2f}".format(name, s * 1000) for name, s in self.timings]
+        entries.append("total;dur={:.2f}".format(total * 1000))
+        return ", ".join(entries)
+
+
+def current():
+    """Returns the trace of the current request, if any."""
+    return _current.get()
+
+
+@contextlib.contextmanager
+def stage(name, model=None):
+    """Times the block as the stage name of the current request. The
+    model label is set for the stages that depend on the model."""
+    if not conf.tracing_enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        trace = _current.get()
+        if trace is None:
+            stage_seconds.labels(name, model_label(model), "").observe(elapsed)
+        else:
+            trace.add(name, elapsed, model)
+
+
+@contextlib.contextmanager
+def collect():
+    """Runs the block under a new trace, not tied to a request, and yields
+    it. Used for work shared by several requests, such as a batch."""
+    trace = Trace()
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+class TracingMiddleware:
+    """ASGI middleware that sets the trace of each HTTP request and records
+    its duration. With server_timing, the stage timings collected until
+    the response starts are sent in the Server-Timing header."""
+
+    def __init__(self, app, server_timing=False):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trace = Trace(scope)
+        token = _current.set(trace)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    headers = MutableHeaders(scope=message)
+                    headers.append(
+                        "Server-Timing", trace.server_timing(time.perf_counter() - start)
+                    )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            method = scope["method"] if scope["method"] in METHODS else "other"
+            request_seconds.labels(method, trace.endpoint, str(status)).observe(
+                time.perf_counter() - start
+            )
@@ -0,0 +1,333 @@
+"""
+Validation of the images uploaded by the users. Uploads are kept in
+memory: they are checked, decoded and classified without being written
+to the gallery folder.
+
+Multipart bodies are parsed as they are received: the format of each
+file is sniffed from its first bytes and its size and pixel count are
+checked while it is read, so that a file is rejected without buffering
+more than upload_max_bytes of it.
+"""
+import asyncio
+from io import BytesIO
+
+from PIL import Image
+from starlette.datastructures import ImmutableMultiDict
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from app.config import Configuration
+from app.executor import executor
+from app.tracing import stage
+
+conf = Configuration()
+
+# leading bytes of the files of each image format
+SIGNATURES = {
+    "JPEG": (b"\xff\xd8\xff",),
+    "PNG": (b"\x89PNG\r\n\x1a\n",),
+    "GIF": (b"GIF87a", b"GIF89a"),
+    "BMP": (b"BM",),
+    "TIFF": (b"II*\x00", b"MM\x00*"),
+}
+SNIFF_BYTES = 12
+# the header of an image is parsed once HEADER_MIN_BYTES are received,
+# then each time the received bytes double, up to HEADER_MAX_BYTES; the
+# pixel count of larger headers is checked once the file is complete
+HEADER_MIN_BYTES = 2 ** 10
+HEADER_MAX_BYTES = 256 * 2 ** 10
+# limits of the form fields that are not files: size of each one, number
+# and total size
+FIELD_MAX_BYTES = 16 * 2 ** 10
+MAX_FIELDS = 100
+FIELDS_MAX_BYTES = 64 * 2 ** 10
+# allowance for the headers and boundaries of each part of a body
+PART_OVERHEAD_BYTES = 1024
+
+
+class UploadError(Exception):
+    """Raised when the uploaded file is not an acceptable image."""
+
+
+def sniff_format(head):
+    """Returns the image format of a file starting with the bytes head,
+    or None if it is not a known one."""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    for img_format, signatures in SIGNATURES.items():
+        if head.startswith(signatures):
+            return img_format
+    return None
+
+
+class UploadReader:
+    """Receives an uploaded file chunk by chunk. It is rejected as soon as
+    its first bytes are not those of an accepted format, it is larger than
+    upload_max_bytes or its header has more than upload_max_pixels
+    pixels; the rest of a rejected file is discarded."""
+
+    def __init__(self, field, filename):
+        self.field = field
+        self.filename = filename
+        self.format = None
+        self.dimensions = None
+        self.error = None
+        self.size = 0
+        self._buffer = bytearray()
+        self._header_at = HEADER_MIN_BYTES
+
+    def feed(self, chunk):
+        if self.error is not None:
+            return
+        try:
+            self._feed(chunk)
+        except UploadError as e:
+            self.reject(str(e))
+
+    def _feed(self, chunk):
+        self.size += len(chunk)
+        if self.size > conf.upload_max_bytes:
+            raise UploadError(
+                "The uploaded file is larger than {} MB".format(conf.upload_max_bytes // 2 ** 20)
+            )
+        self._buffer += chunk
+        if self.format is None and len(self._buffer) >= SNIFF_BYTES:
+            self._sniff()
+        if (
+            self.dimensions is None
+            and self._header_at <= HEADER_MAX_BYTES
+            and len(self._buffer) >= self._header_at
+        ):
+            # doubling the threshold keeps the parsing work linear in the
+            # size of the header
+            self._header_at = 2 * len(self._buffer)
+            self._read_header()
+
+    def _sniff(self):
+        self.format = sniff_format(bytes(self._buffer[:SNIFF_BYTES]))
+        if self.format is None or self.format not in conf.upload_formats:
+            raise UploadError("The uploaded file is not a supported image")
+
+    def _read_header(self):
+        try:
+            with Image.open(BytesIO(self._buffer)) as img:
+                self.dimensions = img.size
+        except Exception:
+            # the header has not been received yet
+            return
+        width, height = self.dimensions
+        if width * height > conf.upload_max_pixels:
+            raise UploadError("The uploaded image has too many pixels")
+
+    def finish(self):
+        """Called once the whole file has been received."""
+        if self.error is None and not self._buffer:
+            self.reject("The uploaded file is empty")
+        elif self.error is None and self.format is None:
+            try:
+                self._sniff()
+            except UploadError as e:
+                self.reject(str(e))
+        # the data is then shared without copies
+        self._buffer = bytes(self._buffer)
+
+    def reject(self, error):
+        self.error = error
+        self._buffer = bytearray()
+
+    @property
+    def data(self):
+        return bytes(self._buffer)
+
+
+class MultipartReader:
+    """Incremental parser of a multipart/form-data body. The fields are
+    collected as strings and the files are read by UploadReaders."""
+
+    def __init__(self, boundary, max_files):
+        self.max_files = max_files
+        self.fields = []
+        self.files = []
+        self.fields_size = 0
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._name = None
+        self._part = None
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def write(self, chunk):
+        self._parser.write(chunk)
+
+    def finalize(self):
+        self._parser.finalize()
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._name = options.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" in options:
+            if len(self.files) >= self.max_files:
+                raise UploadError("At most {} files can be uploaded at once".format(
+                    self.max_files))
+            filename = options[b"filename"].decode("utf-8", "replace")
+            self._part = UploadReader(self._name, filename)
+            self.files.append(self._part)
+        else:
+            if len(self.fields) >= MAX_FIELDS:
+                raise UploadError("Too many form fields")
+            self._part = bytearray()
+
+    def _on_part_data(self, data, start, end):
+        if isinstance(self._part, UploadReader):
+            self._part.feed(data[start:end])
+        elif len(self._part) + end - start > FIELD_MAX_BYTES:
+            raise UploadError("The form field {} is too large".format(self._name))
+        else:
+            self.fields_size += end - start
+            if self.fields_size > FIELDS_MAX_BYTES:
+                raise UploadError("The form fields are too large")
+            self._part += data[start:end]
+
+    def _on_part_end(self):
+        if isinstance(self._part, UploadReader):
+            self._part.finish()
+        else:
+            self.fields.append((self._name, self._part.decode("utf-8", "replace")))
+        self._part = None
+
+
+async def read_form(request, max_files=None):
+    """Reads the form of the request. A multipart body is parsed as it is
+    received, and each uploaded file is validated while it is read, then
+    checked in full in the executor, concurrently.
+
+    Returns the fields that are not files, as an ImmutableMultiDict, and
+    an UploadReader for each file, in the order of the form; the error of
+    the rejected files is set. Raises UploadError if the body is not a
+    valid form or exceeds the limits on its size or on the number and
+    size of the files and fields."""
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data":
+        return await request.form(), []
+    boundary = options.get(b"boundary")
+    if not boundary:
+        raise UploadError("The multipart boundary is missing")
+    max_files = max_files or conf.upload_max_files
+    max_size = (
+        max_files * (conf.upload_max_bytes + PART_OVERHEAD_BYTES)
+        + FIELDS_MAX_BYTES + MAX_FIELDS * PART_OVERHEAD_BYTES
+    )
+    too_large = UploadError("The request is larger than {} MB".format(max_size // 2 ** 20))
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) > max_size:
+        raise too_large
+    reader = MultipartReader(boundary, max_files)
+    size = 0
+    try:
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > max_size:
+                raise too_large
+            reader.write(chunk)
+        reader.finalize()
+    except UploadError:
+        raise
+    except Exception:
+        raise UploadError("The request body is not a valid multipart form")
+
+    async def check(upload):
+        if upload.error is None:
+            try:
+                await executor.run(check_upload, upload.data)
+            except UploadError as e:
+                upload.reject(str(e))
+
+    await asyncio.gather(*(check(upload) for upload in reader.files))
+    return ImmutableMultiDict(reader.fields), reader.files
+
+
+def check_upload(data):
+    """Checks that data is a valid image within the size and pixel
+    limits of the configuration, reading only its header and structure.
+    Returns the format of the image."""
+    if not data:
+        raise UploadError("The uploaded file is empty")
+    if len(data) > conf.upload_max_bytes:
+        raise UploadError(
+            "The uploaded file is larger than {} MB".format(conf.upload_max_bytes // 2 ** 20)
+        )
+    try:
+        with Image.open(BytesIO(data)) as img:
+            width, height = img.size
+            if width * height > conf.upload_max_pixels:
+                raise UploadError("The uploaded image has too many pixels")
+            img_format = img.format
+            img.verify()
+    except UploadError:
+        raise
+    except Exception:
+        raise UploadError("The uploaded file is not a valid image")
+    return img_format
+
+
+def decode_upload(data, size=conf.preview_size):
+    """Decodes the uploaded image as an RGB image. JPEG images are
+    downscaled while decoding, keeping at least size pixels on each side,
+    enough for the preview and the inputs of the models. Raises
+    UploadError if the image cannot be decoded."""
+    try:
+        with Image.open(BytesIO(data)) as img:
+            img.draft("RGB", (size, size))
+            return img.convert("RGB")
+    except (OSError, ValueError, Image.DecompressionBombError):
+        raise UploadError("The uploaded file is not a valid image")
+
+
+def open_upload(data, size=conf.preview_size):
+    """Decodes the uploaded image once and returns it with its JPEG
+    preview, at most size pixels wide and high."""
+    with stage("decode"):
+        img = decode_upload(data, size)
+    with stage("preview"):
+        return img, preview_image(img, size)
+
+
+def preview_image(img, size=conf.preview_size):
+    """Returns a JPEG thumbnail of the RGB image, at most size pixels wide
+    and high."""
+    img = img.copy()
+    img.thumbnail((size, size))
+    buffer = BytesIO()
+    img.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def make_preview(data, size=conf.preview_size):
+    """Returns a JPEG thumbnail of the image given as bytes, at most size
+    pixels wide and high."""
+    return preview_image(decode_upload(data, size), size)
@@ -1,55 +1,64 @@
+import hashlib
 import os
 
 from app.config import Configuration
-import matplotlib.pyplot as plt
-from PIL import Image
-import numpy as np
 import base64
-from io import BytesIO
-from fastapi.responses import StreamingResponse
-import io
 
 conf = Configuration()
 
 
-def list_images():
-    """Returns the list of available images."""
-    img_names = filter(
-        lambda x: x.endswith(".JPEG"), os.listdir(conf.image_folder_path)
-    )
-    return list(img_names)
+_digests = {}
 
-def generate_histogram(image_id):
 
-    """Generates and returns a color histogram of the image with the specified ID."""
-    img_path = os.path.join(conf.image_folder_path, image_id)
-    img = Image.open(img_path)
+def file_digest(path):
+    """Returns the SHA-256 hex digest of the content of the file. Digests
+    are remembered until the size or modification time of the file change."""
+    stat = os.stat(path)
+    signature = (stat.st_size, stat.st_mtime_ns)
+    cached = _digests.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    _digests[path] = (signature, digest)
+    return digest
 
-    # Convert the image to a numpy array
-    img_array = np.array(img)
 
-    # Flatten the image into separate 1D arrays for each color channel
-    red_channel = img_array[:, :, 0].flatten()
-    green_channel = img_array[:, :, 1].flatten()
-    blue_channel = img_array[:, :, 2].flatten()
+def bytes_digest(data):
+    """Returns the SHA-256 hex digest of the bytes."""
+    return hashlib.sha256(data).hexdigest()
 
-    # Create a new figure
-    plt.figure()
 
-    # Generate the color histograms
-    plt.hist(red_channel, bins=256, color='red', alpha=0.5, label='Red')
-    plt.hist(green_channel, bins=256, color='green', alpha=0.5, label='Green')
-    plt.hist(blue_channel, bins=256, color='blue', alpha=0.5, label='Blue')
+def image_digest(image_id):
+    """Returns the content digest of the image with the specified ID, as
+    indexed by the catalog, or computed from its file for the images
+    that are not in the catalog."""
+    from app.catalog import catalog
 
-    # Display the legend
-    plt.legend()
+    entry = catalog.get(image_id)
+    if entry is not None:
+        return entry.digest
+    return file_digest(os.path.join(conf.image_folder_path, image_id))
 
-    # Save the plot to a BytesIO object
-    buffer = BytesIO()
-    plt.savefig(buffer, format='png')
-    buffer.seek(0)
 
-    # Convert the image to base64
-    image_base64 = base64.b64encode(buffer.read()).decode('utf-8')
+def list_images():
+    """Returns the list of available images."""
+    from app.catalog import catalog
+
+    return list(catalog.names())
+
+def generate_histogram(image_id):
+
+    """Generates and returns a color histogram of the image with the specified ID."""
+    from app.histogram import get_histogram
+    from app.plotting import render_histogram
+    from app.tracing import stage
 
-    return image_base64
+    histogram = get_histogram(image_id)
+    with stage("plot"):
+        png = render_histogram(histogram)
+    # Convert the PNG image to base64
+    return base64.b64encode(png).decode('utf-8')
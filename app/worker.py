@@ -0,0 +1,28 @@
+"""
+rq worker running the jobs of the service. Models are loaded before
+the worker starts and stay resident, since jobs are run in the worker
+process instead of a forked one.
+
+    python -m app.worker
+"""
+import logging
+
+from redis import Redis
+from rq import SimpleWorker
+
+from app.config import Configuration
+from app.ml.model_registry import registry
+
+conf = Configuration()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    registry.warm_up()
+    connection = Redis.from_url(conf.redis_url or "redis://localhost:6379/0")
+    worker = SimpleWorker([conf.job_queue_name], connection=connection)
+    worker.work()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""
+Load test of the service endpoints. The app is run in-process (through
+httpx's ASGI transport), under a uvicorn subprocess, or an already
+running server is targeted with --url. Each endpoint is driven at the
+requested concurrency, and the p50/p95/p99 latency, the throughput and
+the CPU time and peak RSS of the server are recorded, per model for the
+classification endpoints. Results are written as JSON, and can be
+compared with a previous run to catch regressions.
+
+    python -m benchmarks.load --requests 200 --concurrency 8 --output run.json
+    python -m benchmarks.load --compare baseline.json --output run.json
+
+The gallery must have been downloaded with `app.prepare_images`. When
+the pretrained weights are not in the torch cache, the models are
+built with random weights (see --weights), so the test runs offline.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import re
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+from app.config import Configuration
+
+conf = Configuration()
+
+ENDPOINTS = (
+    "info", "classifications", "transformations", "histograms", "upload", "download_plot",
+)
+# endpoints whose requests depend on the model
+MODEL_ENDPOINTS = ("classifications", "transformations", "upload")
+
+
+def weights_available(model_id):
+    """Returns whether the pretrained weights of the model are in the
+    torch hub cache, so that they can be loaded without network."""
+    import torch
+    import torchvision
+
+    weights = torchvision.models.get_model_weights(model_id).DEFAULT
+    path = os.path.join(torch.hub.get_dir(), "checkpoints", os.path.basename(weights.url))
+    return os.path.exists(path)
+
+
+class ProcessMonitor:
+    """Reads the CPU time and the peak RSS of a process from /proc, or of
+    the current process through getrusage when pid is None."""
+
+    def __init__(self, pid=None):
+        self.pid = pid
+
+    def cpu_seconds(self):
+        if self.pid is None:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            return usage.ru_utime + usage.ru_stime
+        with open("/proc/{}/stat".format(self.pid)) as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def peak_rss_mb(self):
+        if self.pid is None:
+            # kilobytes on Linux
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        with open("/proc/{}/status".format(self.pid)) as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+        return None
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    idx = min(len(values) - 1, max(0, int(round(q / 100 * len(values) + 0.5)) - 1))
+    return values[idx]
+
+
+class Scenarios:
+    """Builds the requests of each endpoint from the local gallery."""
+
+    def __init__(self, client, images):
+        self.client = client
+        self.images = images
+        self.result_ids = []
+
+    def image_bytes(self, image_id):
+        with open(os.path.join(conf.image_folder_path, image_id), "rb") as f:
+            return f.read()
+
+    async def request(self, endpoint, model_id):
+        image_id = random.choice(self.images)
+        if endpoint == "info":
+            return await self.client.get("/info")
+        if endpoint == "classifications":
+            return await self.client.post(
+                "/classifications", data={"image_id": image_id, "model_id": model_id}
+            )
+        if endpoint == "transformations":
+            return await self.client.post("/transformations", data={
+                "image_id": image_id,
+                "model_id": model_id,
+                "color": random.uniform(0, 1),
+                "brightness": random.uniform(0.5, 2),
+                "contrast": random.uniform(0.5, 2),
+                "sharpness": random.uniform(0, 2),
+            })
+        if endpoint == "histograms":
+            return await self.client.post("/histograms", data={"image_id": image_id})
+        if endpoint == "upload":
+            return await self.client.post(
+                "/upload/",
+                data={"model_id": model_id},
+                files={"image_id": (image_id, self.image_bytes(image_id), "image/jpeg")},
+            )
+        if endpoint == "download_plot":
+            return await self.client.get(
+                "/download_plot", params={"unique_id": random.choice(self.result_ids)}
+            )
+        raise ValueError(endpoint)
+
+    async def prepare_downloads(self, count=20):
+        """Runs some classifications to get result ids to download."""
+        for _ in range(count):
+            response = await self.request("classifications", conf.models[0])
+            match = re.search(r"unique_id=([0-9a-f]+)", response.text)
+            if match:
+                self.result_ids.append(match.group(1))
+
+
+async def run_scenario(scenarios, endpoint, model_id, num_requests, concurrency, monitor):
+    """Sends num_requests requests to the endpoint, concurrency at a time,
+    and returns the statistics of the run."""
+    latencies = []
+    errors = {}
+    pending = iter(range(num_requests))
+
+    async def worker():
+        for _ in pending:
+            start = time.perf_counter()
+            try:
+                response = await scenarios.request(endpoint, model_id)
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - start) * 1000)
+            if status != 200:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+
+    cpu_start = monitor.cpu_seconds()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = time.perf_counter() - start
+    return {
+        "endpoint": endpoint,
+        "model": model_id,
+        "requests": num_requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": sum(latencies) / len(latencies) if latencies else None,
+        "throughput_rps": num_requests / duration,
+        "cpu_s": monitor.cpu_seconds() - cpu_start,
+        "peak_rss_mb": monitor.peak_rss_mb(),
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_uvicorn(random_weights, workers):
+    """Starts the app under uvicorn in a subprocess and waits until it
+    answers. Returns the process and its URL."""
+    port = free_port()
+    code = (
+        "from app.config import Configuration\n"
+        "Configuration.pretrained_weights = {}\n"
+        "import uvicorn\n"
+        "uvicorn.run('main:app', port={}, workers={}, log_level='warning')\n"
+    ).format(not random_weights, port, workers)
+    process = subprocess.Popen([sys.executable, "-c", code])
+    url = "http://127.0.0.1:{}".format(port)
+    for _ in range(600):
+        try:
+            httpx.get(url + "/info", timeout=1)
+            return process, url
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("uvicorn did not start")
+
+
+async def run(args):
+    random_weights = args.weights == "random" or (
+        args.weights == "auto" and not all(weights_available(m) for m in conf.models)
+    )
+    process = None
+    lifespan = contextlib.AsyncExitStack()
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+        monitor = ProcessMonitor(args.pid) if args.pid else None
+    elif args.uvicorn:
+        process, url = start_uvicorn(random_weights, args.workers)
+        client = httpx.AsyncClient(base_url=url, timeout=args.timeout)
+        monitor = ProcessMonitor(process.pid)
+    else:
+        Configuration.pretrained_weights = not random_weights
+        from main import app
+        # runs the startup and shutdown handlers of the app
+        await lifespan.enter_async_context(app.router.lifespan_context(app))
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://test",
+            timeout=args.timeout,
+        )
+        monitor = ProcessMonitor()
+
+    if monitor is None:
+        class NoMonitor:
+            def cpu_seconds(self):
+                return 0.0
+
+            def peak_rss_mb(self):
+                return None
+        monitor = NoMonitor()
+
+    results = []
+    try:
+        images = (await client.get("/info")).json()["images"]
+        scenarios = Scenarios(client, images)
+        models = args.models or list(conf.models)
+        if "download_plot" in args.endpoints:
+            await scenarios.prepare_downloads()
+        for endpoint in args.endpoints:
+            for model_id in (models if endpoint in MODEL_ENDPOINTS else [None]):
+                # warm-up, e.g. model loading
+                await run_scenario(scenarios, endpoint, model_id, args.warmup, 1, monitor)
+                result = await run_scenario(
+                    scenarios, endpoint, model_id, args.requests, args.concurrency, monitor
+                )
+                results.append(result)
+                print("{:<16} {:<13} p50 {:>8.1f} ms  p95 {:>8.1f} ms  p99 {:>8.1f} ms  "
+                      "{:>7.1f} req/s  errors {}".format(
+                          endpoint, model_id or "-", result["p50_ms"], result["p95_ms"],
+                          result["p99_ms"], result["throughput_rps"], result["errors"] or 0))
+    finally:
+        await client.aclose()
+        if process is not None:
+            process.terminate()
+            process.wait()
+        await lifespan.aclose()
+
+    return {
+        "meta": {
+            "timestamp": time.time(),
+            "mode": "url" if args.url else "uvicorn" if args.uvicorn else "in-process",
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "random_weights": random_weights,
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+
+def compare(report, baseline_path, threshold):
+    """Prints the p95 latency and throughput changes with respect to the
+    baseline report. Returns the number of regressions beyond threshold%."""
+    with open(baseline_path) as f:
+        baseline = {(r["endpoint"], r["model"]): r for r in json.load(f)["results"]}
+    regressions = 0
+    for result in report["results"]:
+        base = baseline.get((result["endpoint"], result["model"]))
+        if base is None or not base["p95_ms"] or not result["p95_ms"]:
+            continue
+        p95_change = (result["p95_ms"] / base["p95_ms"] - 1) * 100
+        rps_change = (result["throughput_rps"] / base["throughput_rps"] - 1) * 100
+        regressed = p95_change > threshold or rps_change < -threshold
+        regressions += regressed
+        print("{:<16} {:<13} p95 {:>+7.1f}%  throughput {:>+7.1f}%{}".format(
+            result["endpoint"], result["model"] or "-", p95_change, rps_change,
+            "  REGRESSION" if regressed else ""))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test of the service endpoints.")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--models", nargs="+", choices=conf.models)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--weights", choices=("auto", "pretrained", "random"), default="auto")
+    parser.add_argument("--uvicorn", action="store_true",
+                        help="run the app under uvicorn instead of in-process")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--url", help="URL of an already running server")
+    parser.add_argument("--pid", type=int, help="PID of the server given with --url")
+    parser.add_argument("--output", help="JSON file where the results are written")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    parser.add_argument("--threshold", type=float, default=10,
+                        help="percentage change reported as a regression")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare and compare(report, args.compare, args.threshold):
+        sys.exit(1)
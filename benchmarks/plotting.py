@@ -0,0 +1,78 @@
+"""
+Benchmark of the plot rendering under concurrency: compares the
+previous pyplot code, which must be serialized with a lock because of
+the global pyplot state, against app.plotting, which renders with the
+object-oriented Figure API in parallel threads. The plot cache is
+cleared before each render to measure the drawing itself, and then a
+run with the cache shows the cost of repeated downloads.
+
+    python -m benchmarks.plotting
+"""
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+from app.plotting import plot_cache, render_scores
+
+pyplot_lock = threading.Lock()
+
+
+def pyplot_scores(classification_scores):
+    """The rendering previously done by the /download_plot endpoint."""
+    classes, scores = zip(*classification_scores)
+    class_indices = list(range(1, len(classes) + 1))[::-1]
+    with pyplot_lock:
+        plt.figure(figsize=(11, len(classes)))
+        plt.grid(alpha=0.2)
+        plt.barh(class_indices, scores, color=[
+            '#1A4A04', '#750014', '#795703', '#06216C', '#3F0355'])
+        plt.yticks(class_indices, classes, ha='right')
+        plt.ylabel('Class')
+        plt.xlabel('Score')
+        plt.title('Classification Scores')
+        buffer = BytesIO()
+        plt.savefig(buffer, format="png")
+        plt.close()
+    return buffer.getvalue()
+
+
+def figure_scores(classification_scores, cached):
+    if not cached:
+        plot_cache.clear()
+    return render_scores(classification_scores)
+
+
+def throughput(render, inputs, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(render, inputs))
+    return len(inputs) / (time.perf_counter() - start)
+
+
+def run(num_plots, threads):
+    inputs = [
+        [["class {}".format(i), random.uniform(0, 100)] for i in range(5)]
+        for _ in range(num_plots)
+    ]
+    print("{:>8} {:>14} {:>14} {:>14}".format(
+        "threads", "pyplot (/s)", "figure (/s)", "cached (/s)"))
+    for n in threads:
+        legacy = throughput(pyplot_scores, inputs, n)
+        figure = throughput(lambda x: figure_scores(x, cached=False), inputs, n)
+        cached = throughput(lambda x: figure_scores(inputs[0], cached=True), inputs, n)
+        print("{:>8} {:>14.1f} {:>14.1f} {:>14.1f}".format(n, legacy, figure, cached))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plot rendering benchmark.")
+    parser.add_argument("--plots", type=int, default=64)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+    run(args.plots, args.threads)
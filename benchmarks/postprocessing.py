@@ -0,0 +1,63 @@
+"""
+Microbenchmark of the postprocessing of the model outputs: compares the
+Postprocessor (labels loaded once, vectorized torch.topk) against the
+previous code path (labels read from JSON, full torch.sort, softmax and
+a Python loop of .item() calls).
+
+    python -m benchmarks.postprocessing
+"""
+import argparse
+import json
+import os
+import tempfile
+import timeit
+
+import torch
+
+from app.ml.postprocessing import Postprocessor
+
+
+def legacy_postprocess(out, labels_path):
+    """The postprocessing previously done by classify_image, applied to
+    each row of the batch."""
+    results = []
+    for row in range(out.shape[0]):
+        logits = out[row:row + 1]
+        _, indices = torch.sort(logits, descending=True)
+        percentage = torch.nn.functional.softmax(logits, dim=1)[0] * 100
+        with open(labels_path) as f:
+            labels = json.load(f)
+        results.append([[labels[idx], percentage[idx].item()] for idx in indices[0][:5]])
+    return results
+
+
+def run(batch_sizes, repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        labels_path = os.path.join(tmp, "imagenet_labels.json")
+        with open(labels_path, "w") as f:
+            json.dump(["class {}".format(i) for i in range(1000)], f)
+        postprocessor = Postprocessor(labels_path)
+
+        print("{:>6} {:>14} {:>14} {:>8}".format("batch", "legacy (ms)", "topk (ms)", "speedup"))
+        for batch_size in batch_sizes:
+            out = torch.randn(batch_size, 1000)
+            assert [
+                [label for label, _ in row] for row in legacy_postprocess(out, labels_path)
+            ] == [[label for label, _ in row] for row in postprocessor(out)]
+            legacy = min(timeit.repeat(
+                lambda: legacy_postprocess(out, labels_path), number=10, repeat=repeat
+            )) / 10
+            fast = min(timeit.repeat(
+                lambda: postprocessor(out), number=10, repeat=repeat
+            )) / 10
+            print("{:>6} {:>14.3f} {:>14.3f} {:>7.1f}x".format(
+                batch_size, legacy * 1000, fast * 1000, legacy / fast
+            ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Postprocessing microbenchmark.")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(args.batch_sizes, args.repeat)
@@ -0,0 +1,108 @@
+"""
+Checks that the fused transformation pipeline (app.ml.transformations)
+matches PIL's ImageEnhance on the cropped gallery images, and compares
+its speed and its output with the previous pipeline, which enhanced the
+full-size image in four passes and saved it to disk to classify it.
+The previous pipeline enhances the image before resizing it, so its
+output is only expected to be close to the fused one.
+
+    python -m benchmarks.transformations
+
+Exits with status 1 if the mean difference per pixel of an image is
+above the tolerance, or above the legacy tolerance for the previous
+pipeline.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+from PIL import Image, ImageEnhance
+
+from app.ml.classification_utils import fetch_image, load_crop, preprocess
+from app.ml.preprocessing import STD, normalize
+from app.ml.transformations import enhance
+from app.utils import list_images
+
+
+def image_enhance(img, color, brightness, contrast, sharpness):
+    img = ImageEnhance.Color(img).enhance(color)
+    img = ImageEnhance.Brightness(img).enhance(brightness)
+    img = ImageEnhance.Contrast(img).enhance(contrast)
+    return ImageEnhance.Sharpness(img).enhance(sharpness)
+
+
+def legacy_pipeline(image_id, params, folder):
+    """Enhances the full-size image, saves it and preprocesses it again."""
+    with fetch_image(image_id) as img:
+        img = image_enhance(img, **params)
+        path = os.path.join(folder, "temp." + image_id)
+        img.save(path)
+    with Image.open(path) as img:
+        tensor = preprocess(img)
+    os.remove(path)
+    return tensor
+
+
+def run(num_images, tolerance, legacy_tolerance):
+    """Returns the number of images whose mean difference is above the
+    tolerance, or above legacy_tolerance for the previous pipeline."""
+    image_ids = sorted(list_images())[:num_images]
+    worst = legacy_worst = 0
+    failures = 0
+    legacy_time = fused_time = 0.0
+    with tempfile.TemporaryDirectory() as folder:
+        for image_id in image_ids:
+            params = {
+                "color": random.uniform(0, 1),
+                "brightness": random.uniform(0.2, 2),
+                "contrast": random.uniform(0.2, 2),
+                "sharpness": random.uniform(0, 2),
+            }
+            cropped = load_crop(image_id)
+            reference = image_enhance(
+                Image.fromarray(cropped.permute(1, 2, 0).numpy()), **params
+            )
+            reference = torch.from_numpy(np.array(reference)).permute(2, 0, 1)
+
+            start = time.perf_counter()
+            fused = enhance(cropped, **params)
+            fused_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            legacy = legacy_pipeline(image_id, params, folder)
+            legacy_time += time.perf_counter() - start
+
+            diff = (fused.int() - reference.int()).abs()
+            worst = max(worst, diff.max().item())
+            # the normalized tensors, compared in pixel values
+            legacy_diff = (legacy - normalize(fused)).abs().mul_(STD * 255).mean().item()
+            legacy_worst = max(legacy_worst, legacy_diff)
+            if diff.float().mean() > tolerance or legacy_diff > legacy_tolerance:
+                failures += 1
+                print("{}: mean difference {:.2f}, {:.2f} with the previous pipeline, "
+                      "with {}".format(image_id, diff.float().mean().item(), legacy_diff, params))
+
+    print("max pixel difference: {}".format(worst))
+    print("max mean difference with the previous pipeline: {:.2f}".format(legacy_worst))
+    print("legacy pipeline: {:.2f} ms/image".format(legacy_time * 1000 / len(image_ids)))
+    print("fused pipeline:  {:.2f} ms/image".format(fused_time * 1000 / len(image_ids)))
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transformation pipeline check.")
+    parser.add_argument("--images", type=int, default=50)
+    parser.add_argument("--tolerance", type=float, default=1.0,
+                        help="maximum mean difference per pixel")
+    parser.add_argument("--legacy-tolerance", type=float, default=8.0,
+                        help="maximum mean difference per pixel with the previous pipeline")
+    args = parser.parse_args()
+    failures = run(args.images, args.tolerance, args.legacy_tolerance)
+    if failures:
+        print("{} images above the tolerance".format(failures))
+        sys.exit(1)
@@ -1,27 +1,101 @@
-import matplotlib.pyplot as plt
-import os
-from fastapi.responses import FileResponse, HTMLResponse
+# imported first, to profile the imports of the app
+from app.startup import SUBSYSTEMS, lazy, preload, profiler, started_at, subsystems_stats
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 import json
+import logging
+import time
+import os
+from pathlib import Path
 from typing import Dict, List
-from fastapi import FastAPI, Request, File, UploadFile, BackgroundTasks
+from urllib.parse import urlencode
+from fastapi import FastAPI, Request, BackgroundTasks, HTTPException
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-import shutil
+from app.api import jobs_router, router as api_router
+from app.catalog import catalog
 from app.config import Configuration
+from app.delivery import artifact_response, cache_control, make_etag, not_modified
+from app.executor import ExecutorBusy, executor
+from app.metrics import exposition
 from app.forms.classification_form import ClassificationForm
-from app.ml.classification_utils import classify_image
-from app.utils import list_images, generate_histogram
+from app.previews import preview_store
+from app.results_store import results_store
+from app.ml.result_cache import result_cache
+from app.ml.score_index import score_index
+from app.ml.options import VARIANTS
+from app.utils import list_images
 from app.forms.transformation_form import TransformationForm
-from PIL import Image, ImageEnhance
-import time
+from app.tracing import TracingMiddleware, stage
+from starlette.concurrency import run_in_threadpool
 from starlette.datastructures import URL
-import random
 
 app = FastAPI()
 config = Configuration()
 
+# heavy modules, imported on first use (see app/startup.py)
+histograms = lazy("app.histogram")
+inference = lazy("app.ml.inference")
+model_registry = lazy("app.ml.model_registry")
+batching = lazy("app.ml.batching")
+preprocessing = lazy("app.ml.preprocessing")
+embeddings = lazy("app.ml.embeddings")
+gallery_pack = lazy("app.gallery_pack")
+transformations = lazy("app.ml.transformations")
+plotting = lazy("app.plotting")
+thumbnails = lazy("app.thumbnails")
+uploads = lazy("app.uploads")
+
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 templates = Jinja2Templates(directory="app/templates")
+app.include_router(api_router)
+app.include_router(jobs_router)
+if Configuration.tracing_enabled:
+    app.add_middleware(TracingMiddleware, server_timing=Configuration.server_timing)
+
+
+@app.on_event("startup")
+def warm_up_models():
+    """Loads all the models at startup, if enabled in the configuration."""
+    if Configuration.warmup_models:
+        model_registry.registry.warm_up()
+
+
+@app.on_event("startup")
+def watch_images():
+    """Indexes the gallery images in the background, then watches the
+    folder for changes."""
+    catalog.watch(Configuration.catalog_poll_interval_s)
+
+
+@app.on_event("startup")
+def report_startup():
+    """Stops the import profiler, logs the startup time and starts loading
+    the subsystems to preload."""
+    profiler.stop()
+    startup_time = time.perf_counter() - started_at
+    slowest = ", ".join(
+        "{} {:.2f}s".format(i["module"], i["seconds"]) for i in profiler.report(5)
+    )
+    logging.info("Started in {:.2f}s, slowest imports: {}".format(startup_time, slowest))
+    app.state.startup_time = startup_time
+    preload(Configuration.preload_subsystems)
+
+
+@app.on_event("shutdown")
+def shutdown_executor():
+    """Stops the workers of the executor and the catalog watcher."""
+    executor.shutdown()
+    catalog.stop()
+
+
+@app.exception_handler(ExecutorBusy)
+def executor_busy(request: Request, exc: ExecutorBusy):
+    """Answers with 503 when the server has too much pending work."""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "The server is busy, retry later"},
+        headers={"Retry-After": "1"},
+    )
 
 
 @app.get("/info")
@@ -37,6 +111,66 @@ def info() -> Dict[str, List[str]]:
     return data
 
 
+@app.get("/stats")
+def stats() -> Dict:
+    """Returns the runtime statistics of the service, such as the
+    load time and resident size of the loaded models."""
+    stats = {
+        "executor": executor.stats(),
+        "result_cache": result_cache.stats(),
+        "score_index": {"entries": score_index.count()},
+        "previews": preview_store.stats(),
+        "catalog": catalog.stats(),
+        "results": results_store.stats(),
+        "subsystems": subsystems_stats(),
+    }
+    # the statistics of the models are reported once they are in use
+    if SUBSYSTEMS["inference"].warm:
+        stats["models"] = model_registry.registry.stats()
+        stats["batching"] = batching.scheduler.stats()
+        stats["tensor_cache"] = preprocessing.preprocessor.stats()
+        stats["embeddings"] = embeddings.stats()
+    if SUBSYSTEMS["images"].warm:
+        pack = gallery_pack.get_pack()
+        stats["gallery_pack"] = pack.stats() if pack is not None else None
+    return stats
+
+
+@app.get("/ready")
+def ready():
+    """Returns whether the server is ready to serve, that is whether it has
+    started, the gallery is indexed and the subsystems to preload are
+    loaded, and which subsystems are loaded. Answers with 503 when it is
+    not ready."""
+    warm = {name: subsystem.warm for name, subsystem in SUBSYSTEMS.items()}
+    is_ready = (
+        hasattr(app.state, "startup_time")
+        and catalog.loaded
+        and all(warm[name] for name in Configuration.preload_subsystems)
+    )
+    return JSONResponse(
+        {"ready": is_ready, "catalog": catalog.loaded, "subsystems": warm},
+        status_code=200 if is_ready else 503,
+    )
+
+
+@app.get("/startup")
+def startup_profile():
+    """Returns the startup time of the server, the slowest imports done
+    while starting and the load time of each subsystem."""
+    return {
+        "startup_time_s": getattr(app.state, "startup_time", None),
+        "imports": profiler.report(),
+        "subsystems": subsystems_stats(),
+    }
+
+
+@app.get("/metrics")
+def metrics():
+    """Returns the request and stage timings in the Prometheus text format."""
+    return Response(exposition(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/", response_class=HTMLResponse)
 def home(request: Request):
     """The home page of the service."""
@@ -48,14 +182,29 @@ def home(request: Request):
     )
 
 
+def classification_errors(request, errors, user_image):
+    """Returns the classification select page with the errors of the form."""
+    return templates.TemplateResponse(
+        "classification_select.html",
+        {
+            "request": request,
+            "models": Configuration.models,
+            "variants": VARIANTS,
+            "userImage": int(user_image),
+            "errors": errors,
+        },
+        status_code=400,
+    )
+
+
 @app.get("/classifications")
 def create_classify(request: Request):
     return templates.TemplateResponse(
         "classification_select.html",
         {
             "request": request,
-            "images": list_images(),
             "models": Configuration.models,
+            "variants": VARIANTS,
             "userImage": 0
         },
     )
@@ -66,25 +215,26 @@ async def request_classification(
     request: Request
 ):
     form = ClassificationForm(request)
-    await form.load_data()
+    with stage("form"):
+        await form.load_data()
+    if not form.is_valid(catalog):
+        return classification_errors(request, form.errors, user_image=False)
     image_id = form.image_id
     model_id = form.model_id
-    classification_scores = classify_image(model_id=model_id, img_id=image_id)
+    classification_scores = await inference.classify(model_id, image_id, variant=form.variant)
 
-    unique_id = str(random.randint(1, 100000))
-    path = f"app/scores/classification_scores{unique_id}.json"
-    with open(path, 'w') as f:
-        json.dump(classification_scores, f)
-    return templates.TemplateResponse(
-        "classification_output.html",
-        {
-            "request": request,
-            "image_id": image_id,
-            "unique_id": unique_id,
-            "classification_scores": json.dumps(classification_scores),
-            "backButton": "/classifications"
-        },
-    )
+    unique_id = await run_in_threadpool(results_store.put, classification_scores)
+    with stage("render"):
+        return templates.TemplateResponse(
+            "classification_output.html",
+            {
+                "request": request,
+                "image_id": image_id,
+                "unique_id": unique_id,
+                "classification_scores": json.dumps(classification_scores),
+                "backButton": "/classifications"
+            },
+        )
 
 
 @app.get("/users_image")
@@ -102,8 +252,8 @@ def create_classify(request: Request):
         "classification_select.html",
         {
             "request": request,
-            "images": list_images(),
             "models": Configuration.models,
+            "variants": VARIANTS,
             "userImage": 1
         },
     )
@@ -121,10 +271,13 @@ async def users_image(request: Request):
         TemplateResponse: The template response containing the classification output.
     """
     form = ClassificationForm(request)
-    await form.load_data()
+    with stage("form"):
+        await form.load_data()
+    if not form.is_valid():
+        return classification_errors(request, form.errors, user_image=True)
     image_id = "n00000000_usersImage.JPEG"
     model_id = form.model_id
-    classification_scores = classify_image(model_id=model_id, img_id=image_id)
+    classification_scores = await inference.classify(model_id, image_id, variant=form.variant)
     return templates.TemplateResponse(
         "classification_output.html",
         {
@@ -137,62 +290,74 @@ async def users_image(request: Request):
 
 
 @app.post("/upload/")
-async def create_upload_file(
-    request: Request,
-    background_tasks: BackgroundTasks,
-    image_id: UploadFile = File(...)
-):
+async def create_upload_file(request: Request):
     """
-    Create an upload file.
-    Checks whether the file is an image.
-    If this is the case, gives it a random name.
+    Classify an uploaded image.
+    The file, sent in the image_id field, is checked while it is received
+    and rejected as soon as it is not an image within the size limits,
+    then it is classified in memory, without writing it to disk.
 
     Args:
         request (Request): The request object.
-        background_tasks (BackgroundTasks): The background tasks object.
-        image_id (UploadFile): The uploaded image file.
 
     Returns:
         TemplateResponse: The response containing the classification output or the classification selection page.
     """
-    rand = random.randint(1, 10000000)
-
+    form = ClassificationForm(request)
     try:
-        temp_name = f"n{rand}_usersImage.JPEG"
-        temp_path = f"./app/static/imagenet_subset/{temp_name}"
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(image_id.file, buffer)
-            form = ClassificationForm(request)
-        await form.load_data()
-        image_id = temp_name
-        model_id = form.model_id
-        classification_scores = classify_image(
-            model_id=model_id, img_id=image_id)
-        request._url = URL("/classifications")
-        response = templates.TemplateResponse(
+        with stage("form"):
+            fields, files = await uploads.read_form(request, max_files=1)
+            await form.load_data(fields)
+        if not form.is_valid():
+            return classification_errors(request, form.errors, user_image=True)
+        if not files:
+            raise uploads.UploadError("An image file is required")
+        upload = files[0]
+        if upload.error is not None:
+            raise uploads.UploadError(upload.error)
+        data = upload.data
+        # decoded once for the preview and the model input
+        image, preview = await executor.run(uploads.open_upload, data)
+    except uploads.UploadError as e:
+        return classification_errors(request, [str(e)], user_image=True)
+
+    classification_scores = await inference.classify_upload(
+        form.model_id, data, variant=form.variant, image=image
+    )
+    preview_key = await run_in_threadpool(preview_store.put, preview)
+    request._url = URL("/classifications")
+    with stage("render"):
+        return templates.TemplateResponse(
             "classification_output.html",
             {
                 "request": request,
-                "image_id": image_id,
+                "image_id": upload.filename,
+                "image_url": f"/previews/{preview_key}",
                 "classification_scores": json.dumps(classification_scores),
             },
         )
-        background_tasks.add_task(delete_temp_img, temp_path)
-        
-        return response
-    except:
-        response= templates.TemplateResponse(
-            "classification_select.html",
-            {
-                "request": request,
-                "images": list_images(),
-                "models": Configuration.models,
-                "userImage": 1
-            },
-        )
 
-        background_tasks.add_task(delete_temp_img, temp_path)
-        return response
+
+@app.get("/previews/{key}")
+def get_preview(request: Request, key: str):
+    """
+    Returns a preview image, such as an uploaded image, from the preview store.
+
+    Args:
+        key (str): The key of the preview.
+
+    Returns:
+        Response: The preview image.
+    """
+    preview = preview_store.get(key)
+    if preview is None:
+        raise HTTPException(status_code=404, detail="Preview not found or expired")
+    content, media_type = preview
+    # the key always identifies the same preview
+    return artifact_response(
+        request, content, media_type,
+        cache=cache_control(Configuration.preview_ttl_s, immutable=True, private=True),
+    )
 
 
 @app.get("/histograms")
@@ -208,7 +373,7 @@ def create_histograms(request: Request):
     """
     return templates.TemplateResponse(
         "histogram_select.html",
-        {"request": request, "images": list_images()},
+        {"request": request},
     )
 
 
@@ -224,21 +389,35 @@ async def request_histogram(request: Request):
         TemplateResponse: The response containing the histogram of the selected image.
     """
     form = ClassificationForm(request)
-    await form.load_data()
+    with stage("form"):
+        await form.load_data()
     image_id = form.image_id
+    if not isinstance(image_id, str) or image_id not in catalog:
+        return templates.TemplateResponse(
+            "histogram_select.html",
+            {"request": request, "errors": ["A valid image id is required"]},
+            status_code=400,
+        )
 
-    # Generate the histogram
-    histogram_base64 = generate_histogram(image_id)
-
-    return templates.TemplateResponse(
-        "histogram_output.html",
-        {
-            "request": request,
-            "image_id": image_id,
-            # Pass the histogram base64 to the context
-            "histogram_base64": histogram_base64,
-        },
-    )
+    # Send the histogram as counts drawn by the browser, or link the
+    # PNG rendered by /gallery/{image_id}/histogram
+    histogram = None
+    histogram_url = None
+    if Configuration.histogram_backend == "png":
+        histogram_url = f"/gallery/{image_id}/histogram"
+    else:
+        histogram = json.dumps(await executor.run(histograms.get_histogram, image_id))
+
+    with stage("render"):
+        return templates.TemplateResponse(
+            "histogram_output.html",
+            {
+                "request": request,
+                "image_id": image_id,
+                "histogram": histogram,
+                "histogram_url": histogram_url,
+            },
+        )
 
 
 @app.get("/transformations")
@@ -251,76 +430,200 @@ def create_transformation(request: Request):
     
     Returns:
         TemplateResponse: The template response containing the 'transformation_select.html' template,
-        along with the request object and the list of images and models.
+        along with the request object and the list of models (images are loaded by the page).
     """
     return templates.TemplateResponse(
         "transformation_select.html",
-        {"request": request, "images": list_images(), "models": Configuration.models},
+        {
+            "request": request,
+            "models": Configuration.models,
+            "variants": VARIANTS,
+        },
     )
 
 
-# This function is used to delete the temporary image created after the transformation
-
-def delete_temp_img(temp_path):
-    """
-    Deletes the temporary image file at the specified path.
-
-    Args:
-        temp_path (str): The path of the temporary image file to be deleted.
-
-    Returns:
-        None
-    """
-    time.sleep(1)
-    os.remove(temp_path)
-
-
 # This function is used to apply the transformation to the image and classify it
 @app.post("/transformations")
-async def request_transformation(request: Request, background_tasks: BackgroundTasks):
+async def request_transformation(request: Request):
     """
     Handle the POST request for image transformations.
 
     Args:
         request (Request): The incoming request object.
-        background_tasks (BackgroundTasks): The background task, used to delete the temporary image after a set amount of time.
 
     Returns:
         TemplateResponse: The response containing the transformed image and classification scores.
     """
     form = TransformationForm(request)
-    await form.load_data()
+    with stage("form"):
+        await form.load_data()
+    if not form.is_valid(catalog):
+        return templates.TemplateResponse(
+            "transformation_select.html",
+            {
+                "request": request,
+                "models": Configuration.models,
+                "variants": VARIANTS,
+                "errors": form.errors,
+            },
+            status_code=400,
+        )
     image_id = form.image_id
     model_id = form.model_id
 
-    # Open the image and apply the transformations
-    with Image.open("app/static/imagenet_subset/" + image_id) as img:
-        img = ImageEnhance.Color(img).enhance(form.color)
-        img = ImageEnhance.Brightness(img).enhance(form.brightness)
-        img = ImageEnhance.Contrast(img).enhance(form.contrast)
-        img = ImageEnhance.Sharpness(img).enhance(form.sharpness)
-
-        # Save the transformed image
-        temp_name = f"temp.{image_id}"
-        temp_path = f"app/static/imagenet_subset/{temp_name}"
-        img.save(temp_path)
-        img.close()
-
-        classification_scores = classify_image(model_id=model_id, img_id=temp_name)
-
-        # Render the response
-        response = templates.TemplateResponse(
+    params = {
+        "color": form.color,
+        "brightness": form.brightness,
+        "contrast": form.contrast,
+        "sharpness": form.sharpness,
+    }
+    # The transformed image is classified in memory, the preview shown
+    # in the page is loaded from /gallery/{image_id}/transformed
+    classification_scores = await inference.classify(
+        model_id, image_id, params=params, variant=form.variant)
+
+    # Render the response
+    with stage("render"):
+        return templates.TemplateResponse(
             "transformation_output.html",
             {
                 "request": request,
-                "image_id": temp_name,
+                "image_id": image_id,
+                "preview_url": f"/gallery/{image_id}/transformed?{urlencode(params)}",
                 "classification_scores": json.dumps(classification_scores),
             },
         )
 
-        # Delete the temporary image after the response is sent
-        background_tasks.add_task(delete_temp_img, temp_path)
+
+def gallery_entry(image_id):
+    """
+    Returns the catalog entry of the gallery image.
+
+    Raises:
+        HTTPException: 404 if the image does not exist.
+    """
+    entry = catalog.get(image_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return entry
+
+
+@app.get("/gallery/{image_id}")
+async def gallery_image(request: Request, image_id: str):
+    """
+    Returns a gallery image, validated by its content digest.
+
+    Args:
+        request (Request): The HTTP request object.
+        image_id (str): The ID of the image.
+
+    Returns:
+        Response: The image, or 304 if the browser already has it.
+    """
+    etag = make_etag(gallery_entry(image_id).digest)
+    response = not_modified(request, etag)
+    if response is not None:
         return response
+    path = os.path.join(Configuration.image_folder_path, image_id)
+    content = await run_in_threadpool(Path(path).read_bytes)
+    return artifact_response(request, content, "image/jpeg", etag=etag)
+
+
+@app.get("/gallery/{image_id}/thumbnail")
+async def gallery_thumbnail(request: Request, image_id: str):
+    """
+    Returns the precomputed thumbnail of a gallery image, shown by the select pages.
+
+    Args:
+        request (Request): The HTTP request object.
+        image_id (str): The ID of the image.
+
+    Returns:
+        Response: The JPEG thumbnail, or 304 if the browser already has it.
+    """
+    etag = make_etag(gallery_entry(image_id).digest, "thumbnail", Configuration.thumbnail_size)
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+    thumbnail = await executor.run(thumbnails.get_thumbnail, image_id)
+    # the image may have been removed since it was looked up
+    if thumbnail is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    content, _ = thumbnail
+    return artifact_response(request, content, "image/jpeg", etag=etag)
+
+
+@app.get("/gallery/{image_id}/histogram")
+async def gallery_histogram(request: Request, image_id: str, format: str = "png"):
+    """
+    Returns the histogram plot of a gallery image.
+
+    Args:
+        request (Request): The HTTP request object.
+        image_id (str): The ID of the image.
+        format (str): The format of the plot, png or svg.
+
+    Returns:
+        Response: The plot, or 304 if the browser already has it.
+    """
+    if format not in plotting.FORMATS:
+        raise HTTPException(status_code=400, detail="Unknown plot format")
+    etag = make_etag(gallery_entry(image_id).digest, "histogram", format)
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+    histogram = await executor.run(histograms.get_histogram, image_id)
+    content = await executor.run(plotting.render_histogram, histogram, format)
+    return artifact_response(request, content, plotting.FORMATS[format], etag=etag)
+
+
+@app.get("/gallery/{image_id}/transformed")
+async def gallery_transformed(
+    request: Request,
+    image_id: str,
+    color: float = 1.0,
+    brightness: float = 1.0,
+    contrast: float = 1.0,
+    sharpness: float = 1.0,
+):
+    """
+    Returns the preview of a gallery image transformed with the given
+    color, brightness, contrast and sharpness values.
+
+    Args:
+        request (Request): The HTTP request object.
+        image_id (str): The ID of the image.
+
+    Returns:
+        Response: The JPEG preview, or 304 if the browser already has it.
+    """
+    params = {
+        "color": color,
+        "brightness": brightness,
+        "contrast": contrast,
+        "sharpness": sharpness,
+    }
+    etag = make_etag(gallery_entry(image_id).digest, "transformed", json.dumps(params))
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+    content = await executor.run(transformations.transform_preview, image_id, params)
+    return artifact_response(request, content, "image/jpeg", etag=etag)
+
+
+async def get_result(unique_id):
+    """
+    Returns the classification result stored with the specified id.
+
+    Raises:
+        HTTPException: 404 if the result does not exist or has expired.
+    """
+    classification_scores = None
+    if unique_id:
+        classification_scores = await run_in_threadpool(results_store.get, unique_id)
+    if classification_scores is None:
+        raise HTTPException(status_code=404, detail="Result not found or expired")
+    return classification_scores
 
 
 @app.get("/download_scores")
@@ -335,11 +638,16 @@ async def download_scores(request: Request, background_tasks: BackgroundTasks):
     - background_tasks: Background tasks to be executed.
 
     Returns:
-    - FileResponse: The file response containing the classification scores in JSON format.
+    - JSONResponse: The response containing the classification scores in JSON format.
     """
-    unique_id = request.query_params.get("unique_id")
-    temp_path = "app/scores/classification_scores"+unique_id+".json"
-    return FileResponse(temp_path, media_type='application/json', filename='classification_scores.json')
+    classification_scores = await get_result(request.query_params.get("unique_id"))
+    return artifact_response(
+        request,
+        json.dumps(classification_scores).encode(),
+        "application/json",
+        cache=cache_control(private=True),
+        filename="classification_scores.json",
+    )
 
 
 @app.get("/download_plot")
@@ -352,43 +660,28 @@ async def download_plot(request: Request, background_tasks: BackgroundTasks,):
         background_tasks (BackgroundTasks): The background tasks object.
 
     Returns:
-        FileResponse: The file response containing the generated plot.
+        Response: The generated plot, as PNG or, with format=svg, as SVG.
     """
     unique_id = request.query_params.get("unique_id")
-    with open("app/scores/classification_scores"+unique_id+".json", 'r') as f:
-        classification_scores = json.load(f)
-
-    # Extract class labels and scores from the list
-    classes, scores = zip(*classification_scores)
-
-    # Create an index for each class
-    class_indices = list(range(1, len(classes) + 1))
-
-    # Invert the order of the classes
-    class_indices = class_indices[::-1]
-
-    # Create the appropriate dimension figure
-    plt.figure(figsize=(11, len(classes)))
-    # Create a bar plot
-    plt.grid(alpha=0.2)
-    plt.barh(class_indices, scores, color=[
-        '#1A4A04', '#750014', '#795703', '#06216C', '#3F0355'])
-
-    # Optionally rotate class labels for better readability
-    plt.yticks(class_indices, classes, ha='right')
-    plt.ylabel('Class')
-    plt.xlabel('Score')
-    plt.title('Classification Scores')
-
-    # Save the plot as a PNG file
-    plt.savefig(
-        'app/scores/classification_plot'+unique_id+'.png')
-
-    # Close the plot to free up resources
-    plt.close()
+    fmt = request.query_params.get("format", "png")
+    if fmt not in plotting.FORMATS:
+        raise HTTPException(status_code=400, detail="Unknown plot format")
+    classification_scores = await get_result(unique_id)
+
+    # The plot is determined by the scores, so that the browser cache is
+    # revalidated without rendering it
+    etag = make_etag(json.dumps(classification_scores), fmt)
+    cache = cache_control(private=True)
+    response = not_modified(request, etag, cache)
+    if response is not None:
+        return response
 
-    temp_path = "app/scores/classification_plot"+unique_id+".png"
-    return FileResponse(temp_path, media_type='application/png', filename='classification_plot.png')
+    # Render the plot, repeated downloads are served from the plot cache
+    content = await executor.run(plotting.render_scores, classification_scores, fmt)
+    return artifact_response(
+        request, content, plotting.FORMATS[fmt], etag=etag, cache=cache,
+        filename=f"classification_plot.{fmt}",
+    )
 
 
 @app.post("/delete-content")
@@ -403,8 +696,6 @@ async def delete_content(request: Request):
         dict: A dictionary containing the success message.
     """
     unique_id = request.query_params.get("unique_id")
-    if os.path.exists("app/scores/classification_plot"+unique_id+".png"):
-        os.remove("app/scores/classification_plot"+unique_id+".png")
-    if os.path.exists("app/scores/classification_scores"+unique_id+".json"):
-        os.remove("app/scores/classification_scores"+unique_id+".json")
+    if unique_id:
+        await run_in_threadpool(results_store.delete, unique_id)
     return {"message": "Content deleted successfully"}
@@ -0,0 +1,31 @@
+"""
+The batch scheduler fails only the batch whose images cannot be
+stacked, and keeps serving the next requests.
+"""
+import asyncio
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from app.ml.batching import BatchScheduler  # noqa: E402
+
+
+def classify_sizes(model_id, batch, variant="fp32"):
+    """Returns the batch size as the result of each image."""
+    return [len(batch)] * len(batch)
+
+
+def test_mismatched_batch_does_not_stop_the_worker():
+    scheduler = BatchScheduler(4, 50, classify=classify_sizes, models=["resnet18"])
+
+    async def run():
+        mismatched = await asyncio.wait_for(asyncio.gather(
+            scheduler.classify("resnet18", torch.zeros(3, 4, 4)),
+            scheduler.classify("resnet18", torch.zeros(3, 5, 5)),
+            return_exceptions=True,
+        ), 5)
+        assert all(isinstance(result, RuntimeError) for result in mismatched)
+        return await asyncio.wait_for(scheduler.classify("resnet18", torch.zeros(3, 4, 4)), 5)
+
+    assert asyncio.run(run()) == 1
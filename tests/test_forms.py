@@ -0,0 +1,65 @@
+"""
+The API forms read JSON bodies and query parameters alike, and reject
+malformed parameters.
+"""
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("fastapi")
+from starlette.requests import Request  # noqa: E402
+
+from app.config import Configuration  # noqa: E402
+from app.forms.compare_form import CompareForm  # noqa: E402
+from app.forms.similar_form import SimilarForm  # noqa: E402
+
+IMAGES = {"n01443537_goldfish.JPEG"}
+
+
+def json_request(body, query=b"", method="POST"):
+    content = body if isinstance(body, bytes) else json.dumps(body).encode()
+
+    async def receive():
+        return {"type": "http.request", "body": content, "more_body": False}
+
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": "/",
+        "query_string": query,
+        "headers": [(b"content-type", b"application/json")],
+    }
+    return Request(scope, receive)
+
+
+def load(form_class, request):
+    form = form_class(request)
+    asyncio.run(form.load_data())
+    return form
+
+
+def test_missing_top_k_is_the_default():
+    form = load(CompareForm, json_request({"image_id": "n01443537_goldfish.JPEG"}))
+    assert form.is_valid(IMAGES)
+    assert form.top_k == Configuration.top_k
+    assert form.models == list(Configuration.models)
+
+
+def test_top_k_from_the_query_string():
+    form = load(SimilarForm, json_request({"image_id": "n01443537_goldfish.JPEG"}, b"top_k=3"))
+    assert form.is_valid(IMAGES)
+    assert form.top_k == 3
+
+
+@pytest.mark.parametrize("top_k", [0, -1, "three", 2.5, [3], True])
+def test_invalid_top_k(top_k):
+    form = load(CompareForm, json_request({"image_id": "n01443537_goldfish.JPEG", "top_k": top_k}))
+    assert not form.is_valid(IMAGES)
+
+
+@pytest.mark.parametrize("body", [b"{not json", b"[]", b'"image"'])
+def test_body_must_be_an_object(body):
+    form = load(SimilarForm, json_request(body))
+    assert not form.is_valid(IMAGES)
+    assert form.errors == ["The JSON body must be an object"]
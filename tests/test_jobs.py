@@ -0,0 +1,69 @@
+"""
+The rq backend runs the tasks through Redis and reports their status,
+and malformed job requests are rejected.
+"""
+import pytest
+
+from app import jobs
+
+
+def add(a, b):
+    return a + b
+
+
+def fail():
+    raise RuntimeError("task failed")
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("rq")
+    monkeypatch.setitem(jobs.TASKS, "add", add)
+    monkeypatch.setitem(jobs.TASKS, "fail", fail)
+    # without is_async the jobs run when they are enqueued
+    return jobs.RQBackend(fakeredis.FakeStrictRedis(), queue_name="test", is_async=False)
+
+
+@pytest.fixture
+def client():
+    pytest.importorskip("httpx")
+    fastapi = pytest.importorskip("fastapi")
+    from fastapi.testclient import TestClient
+
+    from app.api import jobs_router
+
+    app = fastapi.FastAPI()
+    app.include_router(jobs_router)
+    return TestClient(app)
+
+
+def test_finished_job(backend):
+    job_id = backend.enqueue("add", a=2, b=3)
+    job = backend.fetch(job_id)
+    assert job["status"] == jobs.FINISHED
+    assert (job["task"], job["result"], job["error"]) == ("add", 5, None)
+
+
+def test_failed_job(backend):
+    job = backend.fetch(backend.enqueue("fail"))
+    assert job["status"] == jobs.FAILED
+    assert job["result"] is None
+    assert "task failed" in job["error"]
+
+
+def test_unknown_job(backend):
+    with pytest.raises(jobs.JobNotFound):
+        backend.fetch("missing")
+
+
+@pytest.mark.parametrize("body", [
+    b"{not json",
+    b"[]",
+    b'{"type": ["classification"]}',
+    b'{"type": "classification", "params": []}',
+    b'{"type": "classification", "params": {"image_id": [], "model_id": "resnet18"}}',
+])
+def test_malformed_job_request(client, body):
+    response = client.post("/jobs", content=body, headers={"content-type": "application/json"})
+    assert response.status_code == 400
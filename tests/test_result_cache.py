@@ -0,0 +1,79 @@
+"""
+The result cache shares the results through its Redis tier and keeps
+working from memory when Redis is unavailable.
+"""
+from app.ml.result_cache import ResultCache, cache_key
+
+
+class StubRedis:
+    """Stub of the get/set interface of redis.Redis."""
+
+    def __init__(self):
+        self.data = {}
+        self.expiry = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value.encode()
+        self.expiry[key] = ex
+
+
+class DownRedis:
+    """Client whose server cannot be reached."""
+
+    def get(self, key):
+        raise ConnectionError("connection refused")
+
+    def set(self, key, value, ex=None):
+        raise ConnectionError("connection refused")
+
+
+SCORES = [["goldfish", 97.5], ["tench", 1.25]]
+
+
+def test_cache_key_ignores_params_order():
+    a = cache_key("abc", "resnet18", {"color": 1.0, "contrast": 2.0})
+    b = cache_key("abc", "resnet18", {"contrast": 2.0, "color": 1.0})
+    assert a == b
+    assert a != cache_key("abc", "resnet18")
+    assert a != cache_key("abc", "alexnet", {"color": 1.0, "contrast": 2.0})
+
+
+def test_redis_tier_is_shared():
+    client = StubRedis()
+    key = cache_key("abc", "resnet18")
+    ResultCache(10, ttl=60, redis_client=client).set(key, SCORES)
+    assert client.expiry[key] == 60
+
+    other = ResultCache(10, ttl=60, redis_client=client)
+    assert other.get(key) == SCORES
+    # then served by the memory tier
+    assert other.get(key) == SCORES
+    assert other.get(cache_key("def", "resnet18")) is None
+    stats = other.stats()
+    assert (stats["redis_hits"], stats["hits"], stats["misses"]) == (1, 1, 1)
+    assert stats["redis"]
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = ResultCache(2, redis_client=StubRedis())
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert len(cache.memory) == 2
+    assert cache.memory.get("b") is None
+    assert cache.memory.get("a") == 1
+    # still found in Redis
+    assert cache.get("b") == 2
+
+
+def test_redis_errors_fall_back_to_memory():
+    cache = ResultCache(10, ttl=60, redis_client=DownRedis())
+    key = cache_key("abc", "resnet18")
+    cache.set(key, SCORES)
+    assert cache.get(key) == SCORES
+    assert cache.get(cache_key("def", "resnet18")) is None
+    assert cache.stats()["redis_errors"] == 2
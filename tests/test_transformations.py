@@ -0,0 +1,57 @@
+"""
+The fused transformation pipeline must match PIL's ImageEnhance.
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+PIL = pytest.importorskip("PIL")
+from PIL import Image, ImageEnhance  # noqa: E402
+
+from app.ml.transformations import enhance  # noqa: E402
+
+# maximum mean difference per pixel, as in benchmarks.transformations
+TOLERANCE = 1.0
+
+
+def image_enhance(img, color, brightness, contrast, sharpness):
+    img = ImageEnhance.Color(img).enhance(color)
+    img = ImageEnhance.Brightness(img).enhance(brightness)
+    img = ImageEnhance.Contrast(img).enhance(contrast)
+    return ImageEnhance.Sharpness(img).enhance(sharpness)
+
+
+def sample_image(size=64, seed=0):
+    """Returns a (3, size, size) uint8 tensor with gradients and noise."""
+    rng = np.random.default_rng(seed)
+    ramp = np.linspace(0, 255, size)
+    channels = np.stack([
+        np.add.outer(ramp, ramp) / 2,
+        np.tile(ramp, (size, 1)),
+        np.tile(ramp[::-1, None], (1, size)),
+    ])
+    noisy = channels + rng.normal(0, 20, channels.shape)
+    return torch.from_numpy(noisy.clip(0, 255).astype(np.uint8))
+
+
+@pytest.mark.parametrize("color, brightness, contrast, sharpness", [
+    (1.0, 1.0, 1.0, 1.0),
+    (0.0, 1.0, 1.0, 1.0),
+    (0.5, 1.5, 0.7, 1.0),
+    (1.0, 0.4, 1.8, 0.0),
+    (0.3, 1.2, 1.3, 2.0),
+])
+def test_enhance_matches_image_enhance(color, brightness, contrast, sharpness):
+    cropped = sample_image()
+    params = {
+        "color": color, "brightness": brightness,
+        "contrast": contrast, "sharpness": sharpness,
+    }
+    reference = image_enhance(Image.fromarray(cropped.permute(1, 2, 0).numpy()), **params)
+    reference = torch.from_numpy(np.array(reference)).permute(2, 0, 1)
+
+    fused = enhance(cropped, **params)
+
+    assert fused.dtype == torch.uint8
+    assert fused.shape == cropped.shape
+    assert (fused.int() - reference.int()).abs().float().mean().item() <= TOLERANCE